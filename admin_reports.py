@@ -0,0 +1,109 @@
+# admin_reports.py
+"""
+Отчеты для команд администратора.
+
+Список участников с общим объемом строится одним запросом (users LEFT JOIN
+user_totals), строки читаются из курсора порциями через yield_per и сразу
+собираются в сообщения, укладывающиеся в лимит Telegram. Сообщения режутся
+только по границам строк.
+"""
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import User, UserTotal
+
+# Запас до лимита Telegram в 4096 символов под префикс «Часть i/n»
+REPORT_CHUNK_SIZE = 4000
+# Сколько строк читать из курсора за раз
+REPORT_BATCH_SIZE = 500
+
+# Строка отчета: (user_id, first_name, username, total_volume)
+UserReportRow = Tuple[int, Optional[str], Optional[str], float]
+
+
+def _users_with_totals_query():
+    return (
+        select(User.id, User.first_name, User.username, func.coalesce(UserTotal.total_volume, 0.0))
+        .outerjoin(UserTotal, UserTotal.user_id == User.id)
+    )
+
+
+def iter_users_with_totals(db: Session, batch_size: int = REPORT_BATCH_SIZE) -> Iterator[UserReportRow]:
+    """Yields (id, first_name, username, total_volume) for every user, ordered by id."""
+    statement = _users_with_totals_query().order_by(User.id).execution_options(yield_per=batch_size)
+    for user_id, first_name, username, total_volume in db.execute(statement):
+        yield user_id, first_name, username, total_volume
+
+
+def get_user_with_total(db: Session, user_id: int) -> Optional[UserReportRow]:
+    """Returns the report row of a single user or None if the user does not exist."""
+    row = db.execute(_users_with_totals_query().where(User.id == user_id)).first()
+    return tuple(row) if row else None
+
+
+def chunk_lines(lines: Iterable[str], header: str = "", limit: int = REPORT_CHUNK_SIZE) -> List[str]:
+    """
+    Собирает строки в сообщения длиной не более limit символов.
+
+    Строки не разрываются; слишком длинная строка (больше limit) режется по limit.
+    Если получилось несколько сообщений, к каждому добавляется префикс «Часть i/n».
+
+    Args:
+        lines: Строки отчета без завершающего перевода строки
+        header (str): Заголовок первого сообщения
+        limit (int): Максимальная длина сообщения без префикса части
+
+    Returns:
+        List[str]: Готовые к отправке сообщения
+    """
+    chunks: List[str] = []
+    current = header
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        chunks.append(current)
+
+    if len(chunks) > 1:
+        chunks = [f"Часть {index}/{len(chunks)}:\n{chunk}" for index, chunk in enumerate(chunks, start=1)]
+    return chunks
+
+
+def build_user_report(db: Session, format_row: Callable[[UserReportRow], str], header: str,
+                      footer: str = "") -> List[str]:
+    """
+    Строит отчет по всем участникам, разбитый на сообщения Telegram.
+
+    Args:
+        db (Session): Сессия базы данных
+        format_row: Функция, превращающая строку отчета в текст
+        header (str): Заголовок отчета
+        footer (str): Текст в конце отчета (например, подсказка для следующего шага)
+
+    Returns:
+        List[str]: Сообщения отчета; пустой список, если участников нет
+    """
+    rows = iter_users_with_totals(db)
+    first_row = next(rows, None)
+    if first_row is None:
+        return []
+
+    def lines() -> Iterator[str]:
+        yield format_row(first_row)
+        for row in rows:
+            yield format_row(row)
+        if footer:
+            yield f"\n{footer}"
+
+    return chunk_lines(lines(), header)
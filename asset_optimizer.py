@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Оптимизация изображений достижений для отправки в Telegram.
+
+Каждое изображение из assets перекодируется в JPEG с ограничением по размеру
+стороны и объему файла. Результаты сохраняются в assets/optimized под именем
+с хешем исходного файла, поэтому повторная обработка выполняется только при
+изменении исходника.
+
+Запуск вручную (выводит отчет об экономии):
+    python asset_optimizer.py
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+ASSETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+OPTIMIZED_PATH = os.path.join(ASSETS_PATH, 'optimized')
+
+# Telegram все равно уменьшает фото до 1280 px по большей стороне
+MAX_DIMENSION = 1280
+# Желаемый максимальный размер файла; качество снижается ступенями, пока файл не уложится
+MAX_BYTES = 300 * 1024
+JPEG_QUALITIES = (85, 80, 75, 70, 60)
+
+# Исходный путь -> путь к оптимизированному варианту
+_optimized: Dict[str, str] = {}
+_optimized_lock = threading.Lock()
+
+# Результат обработки одного файла: (исходный путь, итоговый путь, байт до, байт после)
+OptimizationResult = Tuple[str, str, int, int]
+
+
+def _source_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _encode_jpeg(source_path: str) -> bytes:
+    from PIL import Image  # Pillow нужен только при перекодировании
+
+    with Image.open(source_path) as image:
+        image = image.convert('RGB')
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION))
+        encoded = b''
+        for quality in JPEG_QUALITIES:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+            encoded = buffer.getvalue()
+            if len(encoded) <= MAX_BYTES:
+                break
+        return encoded
+
+
+def optimize_image(source_path: str) -> OptimizationResult:
+    """
+    Возвращает оптимизированный вариант изображения, создавая его при необходимости.
+
+    Если вариант получился не меньше исходника, используется исходный файл.
+
+    Args:
+        source_path (str): Путь к исходному изображению
+
+    Returns:
+        OptimizationResult: Исходный путь, путь к используемому файлу и размеры до/после
+    """
+    source_size = os.path.getsize(source_path)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    target_path = os.path.join(OPTIMIZED_PATH, f"{stem}.{_source_hash(source_path)[:16]}.jpg")
+
+    if not os.path.exists(target_path):
+        os.makedirs(OPTIMIZED_PATH, exist_ok=True)
+        encoded = _encode_jpeg(source_path)
+        # Пишем во временный файл и переименовываем, чтобы не отдать недописанный файл
+        tmp_path = target_path + '.tmp'
+        with open(tmp_path, 'wb') as target:
+            target.write(encoded)
+        os.replace(tmp_path, target_path)
+        logger.info(f"Optimized {os.path.basename(source_path)}: {source_size / 1024:.0f} KB -> {len(encoded) / 1024:.0f} KB")
+
+        # Удаляем варианты, созданные из прежних версий исходника
+        for name in os.listdir(OPTIMIZED_PATH):
+            stale_path = os.path.join(OPTIMIZED_PATH, name)
+            if name.startswith(f"{stem}.") and name.endswith('.jpg') and stale_path != target_path:
+                os.remove(stale_path)
+
+    optimized_size = os.path.getsize(target_path)
+    if optimized_size >= source_size:
+        return source_path, source_path, source_size, source_size
+    return source_path, target_path, source_size, optimized_size
+
+
+def optimize_assets(source_paths: Iterable[str]) -> List[OptimizationResult]:
+    """Optimizes every existing source image and registers the variants for optimized_path()."""
+    results = []
+    for source_path in source_paths:
+        if not os.path.exists(source_path):
+            logger.warning(f"Asset not found, skipping optimization: {source_path}")
+            continue
+        try:
+            result = optimize_image(source_path)
+        except Exception as e:
+            logger.error(f"Failed to optimize {source_path}: {e}", exc_info=True)
+            continue
+        with _optimized_lock:
+            _optimized[source_path] = result[1]
+        results.append(result)
+
+    saved = sum(before - after for _source, _target, before, after in results)
+    logger.info(f"Asset optimization finished: {len(results)} images, {saved / 1024:.0f} KB saved per full set of uploads")
+    return results
+
+
+def optimized_path(source_path: str) -> str:
+    """Returns the optimized variant of an image if it is ready, otherwise the source path."""
+    with _optimized_lock:
+        return _optimized.get(source_path, source_path)
+
+
+def main():
+    from handlers.achievements import ACHIEVEMENTS
+
+    results = optimize_assets(achievement['image'] for achievement in ACHIEVEMENTS)
+    total_before = sum(before for _source, _target, before, _after in results)
+    total_after = sum(after for _source, _target, _before, after in results)
+
+    print("====== Оптимизация изображений достижений ======")
+    for source, target, before, after in results:
+        print(f"{os.path.basename(source)}: {before / 1024:.0f} КБ -> {after / 1024:.0f} КБ ({os.path.basename(target)})")
+    if total_before:
+        print(f"Итого: {total_before / 1024:.0f} КБ -> {total_after / 1024:.0f} КБ "
+              f"(экономия {100 * (total_before - total_after) / total_before:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
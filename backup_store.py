@@ -0,0 +1,230 @@
+# backup_store.py
+"""
+Инкрементальное хранилище резервных копий с адресацией по содержимому.
+
+Снимок базы режется на блоки по CHUNK_PAGES страниц SQLite. Каждый блок
+хранится один раз под именем SHA-256 своего содержимого и сжимается gzip,
+а снимок описывается небольшим JSON-манифестом со списком хешей блоков.
+Поэтому очередная копия занимает место только под изменившиеся блоки.
+
+Структура каталога:
+    <root>/manifests/<snapshot_id>.json
+    <root>/chunks/<первые 2 символа хеша>/<хеш>.gz
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import BinaryIO, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Страниц SQLite в одном блоке: меньше — лучше дедупликация, больше — меньше файлов
+CHUNK_PAGES = int(os.environ.get("BACKUP_CHUNK_PAGES", "16"))
+DEFAULT_PAGE_SIZE = 4096
+GZIP_LEVEL = 6
+
+MANIFEST_VERSION = 1
+
+
+class BackupStoreError(Exception):
+    """Снимок не найден или поврежден."""
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(data)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_page_size(path: str) -> int:
+    """Reads the page size from the SQLite header (offset 16, big-endian; 1 means 65536)."""
+    with open(path, 'rb') as db_file:
+        header = db_file.read(100)
+    if len(header) < 18 or not header.startswith(b"SQLite format 3\x00"):
+        return DEFAULT_PAGE_SIZE
+    page_size = int.from_bytes(header[16:18], 'big')
+    return 65536 if page_size == 1 else page_size
+
+
+class BackupStore:
+    """Каталог снимков: создание, список, восстановление и удаление старых снимков."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.manifest_dir = os.path.join(root, 'manifests')
+        self.chunk_dir = os.path.join(root, 'chunks')
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunk_dir, digest[:2], f"{digest}.gz")
+
+    def _manifest_path(self, snapshot_id: str) -> str:
+        return os.path.join(self.manifest_dir, f"{snapshot_id}.json")
+
+    def _new_snapshot_id(self, label: str) -> str:
+        snapshot_id = f"{label}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        candidate, suffix = snapshot_id, 1
+        while os.path.exists(self._manifest_path(candidate)):
+            suffix += 1
+            candidate = f"{snapshot_id}_{suffix}"
+        return candidate
+
+    def create_snapshot(self, source_path: str, label: str = "beer_challenge",
+                        metadata: Optional[Dict] = None) -> Dict:
+        """
+        Добавляет в хранилище снимок согласованной копии базы данных.
+
+        Args:
+            source_path (str): Файл копии (не рабочая база: файл не должен меняться во время чтения)
+            label (str): Префикс идентификатора снимка
+            metadata (Dict, optional): Дополнительные поля манифеста (например, позиция журнала изменений)
+
+        Returns:
+            Dict: Манифест снимка, включая число новых блоков и их размер на диске
+        """
+        started = time.perf_counter()
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        page_size = _read_page_size(source_path)
+        chunk_size = page_size * CHUNK_PAGES
+
+        chunks: List[str] = []
+        new_chunks = 0
+        new_bytes = 0
+        size = 0
+        with open(source_path, 'rb') as source:
+            for block in iter(lambda: source.read(chunk_size), b''):
+                size += len(block)
+                digest = hashlib.sha256(block).hexdigest()
+                chunks.append(digest)
+                chunk_path = self._chunk_path(digest)
+                if os.path.exists(chunk_path):
+                    continue
+                os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                compressed = gzip.compress(block, compresslevel=GZIP_LEVEL, mtime=0)
+                _write_atomic(chunk_path, compressed)
+                new_chunks += 1
+                new_bytes += len(compressed)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "id": self._new_snapshot_id(label),
+            # С микросекундами снимки одной секунды сортируются по времени, а не по суффиксу id (_10 < _2)
+            "created_at": datetime.datetime.now().isoformat(timespec='microseconds'),
+            "page_size": page_size,
+            "chunk_size": chunk_size,
+            "size": size,
+            "chunks": chunks,
+            "new_chunks": new_chunks,
+            "new_bytes": new_bytes,
+            **(metadata or {}),
+        }
+        # Манифест пишется последним: снимок виден только после записи всех его блоков
+        _write_atomic(self._manifest_path(manifest["id"]), json.dumps(manifest).encode('utf-8'))
+        logger.info(
+            f"Backup snapshot {manifest['id']}: {len(chunks)} chunks, {new_chunks} new, "
+            f"{new_bytes / 1024:.1f} KB stored in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        return manifest
+
+    def list_snapshots(self) -> List[Dict]:
+        """Returns manifests sorted from oldest to newest (only manifests are read)."""
+        if not os.path.isdir(self.manifest_dir):
+            return []
+        manifests = []
+        for name in os.listdir(self.manifest_dir):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.manifest_dir, name), encoding='utf-8') as manifest_file:
+                manifests.append(json.load(manifest_file))
+        return sorted(manifests, key=lambda manifest: (manifest["created_at"], manifest["id"]))
+
+    def get_snapshot(self, snapshot_id: str) -> Dict:
+        path = self._manifest_path(snapshot_id)
+        if not os.path.exists(path):
+            raise BackupStoreError(f"Snapshot not found: {snapshot_id}")
+        with open(path, encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def latest_snapshot(self) -> Optional[Dict]:
+        snapshots = self.list_snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def write_snapshot(self, snapshot_id: str, target: BinaryIO) -> int:
+        """
+        Потоково собирает файл базы из блоков снимка, проверяя хеш каждого блока.
+
+        Returns:
+            int: Количество записанных байт
+        """
+        manifest = self.get_snapshot(snapshot_id)
+        written = 0
+        for digest in manifest["chunks"]:
+            chunk_path = self._chunk_path(digest)
+            if not os.path.exists(chunk_path):
+                raise BackupStoreError(f"Snapshot {snapshot_id} is missing chunk {digest}")
+            with gzip.open(chunk_path, 'rb') as chunk_file:
+                block = chunk_file.read()
+            if hashlib.sha256(block).hexdigest() != digest:
+                raise BackupStoreError(f"Snapshot {snapshot_id} has a corrupted chunk {digest}")
+            target.write(block)
+            written += len(block)
+        if written != manifest["size"]:
+            raise BackupStoreError(f"Snapshot {snapshot_id} size mismatch: {written} != {manifest['size']}")
+        return written
+
+    def export_snapshot(self, snapshot_id: str, target_path: str) -> int:
+        """Assembles a snapshot into a standalone database file."""
+        tmp_path = target_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as target:
+                written = self.write_snapshot(snapshot_id, target)
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return written
+
+    def prune(self, keep: int) -> int:
+        """
+        Удаляет все снимки, кроме keep последних, и блоки, на которые они больше не ссылаются.
+
+        Returns:
+            int: Количество удаленных блоков
+        """
+        snapshots = self.list_snapshots()
+        if keep <= 0 or len(snapshots) <= keep:
+            return 0
+        for manifest in snapshots[:-keep]:
+            os.remove(self._manifest_path(manifest["id"]))
+            logger.info(f"Removed old backup snapshot: {manifest['id']}")
+
+        referenced = {digest for manifest in snapshots[-keep:] for digest in manifest["chunks"]}
+        removed = 0
+        for prefix in os.listdir(self.chunk_dir):
+            prefix_dir = os.path.join(self.chunk_dir, prefix)
+            for name in os.listdir(prefix_dir):
+                if name.endswith('.gz') and name[:-3] not in referenced:
+                    os.remove(os.path.join(prefix_dir, name))
+                    removed += 1
+            if not os.listdir(prefix_dir):
+                shutil.rmtree(prefix_dir, ignore_errors=True)
+        if removed:
+            logger.info(f"Removed {removed} unreferenced backup chunks")
+        return removed
+
+    def stored_bytes(self) -> int:
+        """Returns the total size of all chunk files on disk."""
+        total = 0
+        if not os.path.isdir(self.chunk_dir):
+            return total
+        for prefix in os.listdir(self.chunk_dir):
+            prefix_dir = os.path.join(self.chunk_dir, prefix)
+            total += sum(os.path.getsize(os.path.join(prefix_dir, name)) for name in os.listdir(prefix_dir))
+        return total
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк отчета администратора со списком участников.
+
+Сравнивает прежний способ (все User, затем отдельный SUM-запрос в новой сессии
+на каждого участника) с одним агрегирующим запросом admin_reports.
+
+Запуск:
+    python -m benchmarks.bench_admin_reports --users 5000
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import func
+
+from admin_reports import build_user_report
+from benchmarks.common import temporary_database
+from database.database import SessionLocal
+from db_utils import rebuild_user_totals
+from models import BeerEntry, User
+
+
+def _populate(users: int, entries_per_user: int) -> None:
+    rng = random.Random(42)
+    with SessionLocal() as db:
+        db.bulk_insert_mappings(User, [
+            {"id": user_id, "first_name": f"user{user_id}", "username": f"nick{user_id}" if user_id % 3 else None}
+            for user_id in range(1, users + 1)
+        ])
+        db.bulk_insert_mappings(BeerEntry, [
+            {"user_id": user_id, "volume_liters": rng.choice((0.3, 0.4, 0.5, 1.0))}
+            for user_id in range(1, users + 1)
+            for _ in range(entries_per_user)
+        ])
+        db.commit()
+        rebuild_user_totals(db)
+
+
+def _format_row(row) -> str:
+    user_id, first_name, _username, total_volume = row
+    return f"ID: {user_id}, Имя: {first_name}, Объем: {total_volume:.2f} л"
+
+
+def _n_plus_one_report() -> str:
+    """Воспроизводит прежний код: запрос SUM в отдельной сессии на каждого участника."""
+    text = "Список участников:\n"
+    with SessionLocal() as db:
+        users = db.query(User).all()
+        for user in users:
+            with SessionLocal() as user_db:
+                total = user_db.query(func.sum(BeerEntry.volume_liters)).filter(BeerEntry.user_id == user.id).scalar() or 0.0
+            text += _format_row((user.id, user.first_name, user.username, total)) + "\n"
+    return text
+
+
+def _single_query_report():
+    with SessionLocal() as db:
+        return build_user_report(db, _format_row, "Список участников:")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Admin report benchmark")
+    parser.add_argument("--users", type=int, default=5000, help="Количество участников")
+    parser.add_argument("--entries", type=int, default=5, help="Записей о пиве на участника")
+    args = parser.parse_args()
+
+    with temporary_database():
+        _populate(args.users, args.entries)
+
+        started = time.perf_counter()
+        old_text = _n_plus_one_report()
+        old_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        chunks = _single_query_report()
+        new_elapsed = time.perf_counter() - started
+
+    print(f"users: {args.users}, entries: {args.users * args.entries}")
+    print(f"N+1 queries:        {old_elapsed * 1000:9.1f} ms")
+    print(f"single query:       {new_elapsed * 1000:9.1f} ms ({len(chunks)} messages)")
+    # Каждое сообщение укладывается в лимит, строки отчета совпадают с прежним форматом
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    new_lines = [line for chunk in chunks for line in chunk.splitlines() if line.startswith("ID: ")]
+    assert new_lines == [line for line in old_text.splitlines() if line.startswith("ID: ")]
+    print("consistency: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк задержки обработки заявок при одновременных отправках.
+
+Сравнивает прежний режим (синхронный вызов SQLAlchemy прямо в event loop)
+с выполнением запросов через db_utils.run_db. Каждое обновление моделирует
+handle_volume_choice: запись в БД и несколько вызовов Telegram API.
+
+Запуск:
+    python -m benchmarks.bench_async_db --updates 300 --rate 200
+"""
+import argparse
+import asyncio
+import logging
+
+from benchmarks.common import temporary_database, percentile
+from database.database import SessionLocal
+from db_utils import run_db, record_submission
+
+# Задержка одного вызова Telegram API (answer, edit_message_text, send_photo...)
+API_CALL_DELAY = 0.02
+API_CALLS_PER_UPDATE = 3
+
+
+async def _simulate_update(user_id: int, blocking: bool) -> None:
+    await asyncio.sleep(API_CALL_DELAY)  # query.answer()
+    if blocking:
+        with SessionLocal() as db:
+            record_submission(db, user_id, f"user{user_id}", None, 0.5, "bench_photo")
+    else:
+        await run_db(record_submission, user_id, f"user{user_id}", None, 0.5, "bench_photo")
+    for _ in range(API_CALLS_PER_UPDATE - 1):
+        await asyncio.sleep(API_CALL_DELAY)
+
+
+async def _run(updates: int, rate: float, users: int, blocking: bool) -> list:
+    latencies = []
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def one(i: int, arrived_at: float) -> None:
+        await _simulate_update(i % users + 1, blocking)
+        # Задержка считается от планового времени прихода обновления, поэтому
+        # время ожидания заблокированного event loop тоже попадает в замер
+        latencies.append(loop.time() - arrived_at)
+
+    tasks = []
+    for i in range(updates):
+        arrived_at = start + i / rate
+        delay = arrived_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i, arrived_at)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="p99 latency of concurrent beer submissions")
+    parser.add_argument("--updates", type=int, default=300, help="Количество заявок")
+    parser.add_argument("--rate", type=float, default=200.0, help="Заявок в секунду")
+    parser.add_argument("--users", type=int, default=50, help="Количество участников")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    for label, blocking in (("blocking (before)", True), ("run_db (after)", False)):
+        with temporary_database():
+            latencies = asyncio.run(_run(args.updates, args.rate, args.users, blocking))
+        print(
+            f"{label:<18} p50={percentile(latencies, 50) * 1000:7.1f} ms  "
+            f"p99={percentile(latencies, 99) * 1000:7.1f} ms  "
+            f"max={max(latencies) * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк восстановления на момент времени: применение журнала изменений.
+
+Записывает в журнал сезон конкурса (регистрации, заявки, правки объема и
+удаления записей админом) и применяет его к пустой базе, как это делает
+db_backup.py --restore-to, если ближайший снимок сделан в начале сезона.
+
+Запуск:
+    python -m benchmarks.bench_journal_replay --users 2000 --entries 60
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from change_journal import (
+    OP_ENTRIES_REPLACED, OP_ENTRY_ADDED, OP_ENTRY_DELETED, OP_USER, ChangeJournal, replay_journal,
+)
+from models import Base
+
+
+def _write_season(journal: ChangeJournal, users: int, entries_per_user: int) -> int:
+    rng = random.Random(42)
+    for user_id in range(1, users + 1):
+        journal.append(OP_USER, user_id=user_id, first_name=f"user{user_id}", username=f"nick{user_id}")
+    entry_id = 0
+    for _ in range(users * entries_per_user):
+        entry_id += 1
+        journal.append(
+            OP_ENTRY_ADDED, entry_id=entry_id, user_id=rng.randint(1, users), volume=rng.choice((0.33, 0.5, 1.0)),
+            photo_file_id=f"photo{entry_id}", submitted_at="2025-07-01 12:00:00.000000",
+        )
+        if rng.random() < 0.01:
+            journal.append(OP_ENTRY_DELETED, entry_id=rng.randint(1, entry_id))
+        if rng.random() < 0.002:
+            entry_id += 1
+            journal.append(
+                OP_ENTRIES_REPLACED, photo_file_id="manual_admin", submitted_at="2025-07-01 12:00:00.000000",
+                entries=[{"entry_id": entry_id, "user_id": rng.randint(1, users), "volume": 10.0}],
+            )
+    journal.sync()
+    return journal.last_seq
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Change journal replay benchmark")
+    parser.add_argument("--users", type=int, default=2000, help="Количество участников")
+    parser.add_argument("--entries", type=int, default=60, help="Заявок на участника за сезон")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        journal = ChangeJournal(os.path.join(tmp_dir, "journal", "changes.jsonl"))
+        started = time.perf_counter()
+        records = _write_season(journal, args.users, args.entries)
+        write_duration = time.perf_counter() - started
+        journal.close()
+        journal_size = os.path.getsize(journal.path)
+
+        db_path = os.path.join(tmp_dir, "restore.db")
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+
+        connection = sqlite3.connect(db_path, isolation_level=None)
+        started = time.perf_counter()
+        applied = replay_journal(connection, journal.read())
+        replay_duration = time.perf_counter() - started
+        entries, total = connection.execute("SELECT count(*), sum(total_volume) FROM user_totals").fetchone()
+        connection.close()
+
+    print(f"journal:  {records} records, {journal_size / 1024 / 1024:.1f} MB, "
+          f"written in {write_duration:.2f}s ({records / write_duration:.0f} records/s)")
+    print(f"replay:   {applied} records in {replay_duration:.2f}s ({applied / replay_duration:.0f} records/s)")
+    print(f"restored: {entries} users with entries, {total:.1f} L total")
+
+
+if __name__ == "__main__":
+    main()
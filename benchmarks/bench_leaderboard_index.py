@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк индекса рейтинга на большом числе участников.
+
+Измеряет загрузку индекса, обновления после новых заявок и запросы
+«топ N», «место участника», «участники рядом с местом k». Для сравнения
+приводится полная пересортировка, которой по сути является GROUP BY + ORDER BY.
+
+Запуск:
+    python -m benchmarks.bench_leaderboard_index --users 100000
+"""
+import argparse
+import random
+import time
+
+from leaderboard_index import LeaderboardIndex
+
+
+def _timed(label: str, operations: int, fn) -> None:
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {elapsed * 1000:9.1f} ms total  {elapsed / operations * 1e6:9.2f} us/op")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Leaderboard index benchmark")
+    parser.add_argument("--users", type=int, default=100_000, help="Количество участников")
+    parser.add_argument("--ops", type=int, default=10_000, help="Количество операций каждого типа")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    rows = [(user_id, f"user{user_id}", None, round(rng.uniform(0, 150), 1)) for user_id in range(1, args.users + 1)]
+    index = LeaderboardIndex()
+
+    _timed("load", 1, lambda: index.load(rows))
+
+    user_ids = [rng.randint(1, args.users) for _ in range(args.ops)]
+
+    def updates():
+        for user_id in user_ids:
+            index.update(user_id, index.total_of(user_id) + 0.5)
+
+    def ranks():
+        for user_id in user_ids:
+            index.rank_of(user_id)
+
+    def tops():
+        for _ in range(args.ops):
+            index.top(100)
+
+    def arounds():
+        for user_id in user_ids:
+            index.around(index.rank_of(user_id), 5)
+
+    _timed("update (+0.5 l)", args.ops, updates)
+    _timed("rank_of", args.ops, ranks)
+    _timed("top(100)", args.ops, tops)
+    _timed("around(rank, 5)", args.ops, arounds)
+
+    snapshot = index.snapshot()
+    baseline_ops = 20
+    _timed(
+        "baseline: full sort + top(100)",
+        baseline_ops,
+        lambda: [sorted(snapshot.items(), key=lambda item: (-item[1], item[0]))[:100] for _ in range(baseline_ops)],
+    )
+
+    # Проверка согласованности с полной сортировкой
+    expected = [user_id for user_id, _ in sorted(snapshot.items(), key=lambda item: (-item[1], item[0]))]
+    assert [row[1] for row in index.top(1000)] == expected[:1000]
+    for user_id in user_ids[:1000]:
+        assert expected[index.rank_of(user_id) - 1] == user_id
+    print("consistency: OK")
+
+
+if __name__ == "__main__":
+    main()
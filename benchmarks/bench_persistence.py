@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк SQLitePersistence: стоимость периодической записи user_data.
+
+Application раз в PERSISTENCE_FLUSH_INTERVAL секунд копирует user_data всех
+пользователей, от которых пришли обновления, и передает их в persistence.
+Замеряются три интервала при N активных пользователях:
+
+    first    — у всех пользователей новые данные (первая запись после запуска);
+    partial  — обновления пришли от всех, данные изменились у --changed процентов;
+    idle     — обновления пришли от всех, данные ни у кого не изменились.
+
+Для каждого интервала выводится время в event loop (копирование и сравнение,
+как в Application.update_persistence) и полное время вместе с записью в базу.
+Затем замеряется ленивая загрузка user_data при первом обновлении от пользователя.
+
+Запуск:
+    python -m benchmarks.bench_persistence --users 10000 --changed 10
+"""
+import argparse
+import asyncio
+import random
+import time
+from copy import deepcopy
+from typing import Dict
+
+from benchmarks.common import percentile, temporary_database
+from bot_persistence import SQLitePersistence
+from user_session import UserSession
+
+
+def _user_data(user_id: int, version: int) -> UserSession:
+    """Сессия посреди отправки заявки, как в handlers/beer_tracking.py и handlers/leaderboard.py."""
+    session = UserSession()
+    session.photo_file_id = f"AgACAgIAAxkBAAI{user_id:08d}v{version}"
+    session.original_message_id = 1000 + version
+    session.original_chat_id = -1001234567890
+    session.prompt_message_id = 2000 + version
+    session.prompt_chat_id = -1001234567890
+    session.leaderboard_message_id = 3000 + version
+    return session
+
+
+async def _interval(persistence: SQLitePersistence, user_data: Dict[int, UserSession]) -> tuple:
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        persistence.update_user_data(user_id, deepcopy(data)) for user_id, data in user_data.items()
+    ))
+    loop_duration = time.perf_counter() - started
+    await persistence.flush()
+    return loop_duration, time.perf_counter() - started
+
+
+async def _run(users: int, changed_pct: float, lookups: int) -> None:
+    rng = random.Random(42)
+    persistence = SQLitePersistence()
+    user_data = {user_id: UserSession() for user_id in range(1, users + 1)}
+    for user_id in user_data:
+        await persistence.refresh_user_data(user_id, user_data[user_id])
+
+    for user_id in user_data:
+        user_data[user_id] = _user_data(user_id, 0)
+    results = [("first", users, await _interval(persistence, user_data))]
+
+    changed = rng.sample(sorted(user_data), int(users * changed_pct / 100))
+    for user_id in changed:
+        user_data[user_id] = _user_data(user_id, 1)
+    results.append(("partial", len(changed), await _interval(persistence, user_data)))
+    results.append(("idle", 0, await _interval(persistence, user_data)))
+
+    for name, dirty, (loop_duration, total_duration) in results:
+        print(f"{name:<8} {users} users, {dirty:>6} changed: event loop {loop_duration * 1000:7.1f}ms, "
+              f"with write {total_duration * 1000:7.1f}ms")
+
+    # Новый процесс: данные загружаются по одному пользователю при первом обновлении
+    restarted = SQLitePersistence()
+    samples = []
+    for user_id in rng.sample(sorted(user_data), min(lookups, users)):
+        loaded = UserSession()
+        started = time.perf_counter()
+        await restarted.refresh_user_data(user_id, loaded)
+        samples.append(time.perf_counter() - started)
+        assert loaded.to_dict() == user_data[user_id].to_dict(), f"user_data of {user_id} did not survive the restart"
+    print(f"lazy load {len(samples)} users: p50 {percentile(samples, 50) * 1000:.2f}ms, "
+          f"p99 {percentile(samples, 99) * 1000:.2f}ms (only the first update of each user)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLite persistence flush benchmark")
+    parser.add_argument("--users", type=int, default=10000, help="Активных пользователей за интервал")
+    parser.add_argument("--changed", type=float, default=10.0, help="Процент пользователей с измененными данными")
+    parser.add_argument("--lookups", type=int, default=1000, help="Сколько пользователей загрузить после перезапуска")
+    args = parser.parse_args()
+
+    with temporary_database():
+        asyncio.run(_run(args.users, args.changed, args.lookups))
+
+
+if __name__ == "__main__":
+    main()
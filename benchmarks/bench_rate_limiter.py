@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк ограничения частоты: наплыв обновлений из одной группы.
+
+N пользователей одной группы присылают вперемешку фото, нажатия кнопок выбора
+объема и таблицы лидеров, запросы таблицы лидеров и обычные сообщения так
+быстро, как их успевает проверить RateLimitHandler.check_update. Выводится
+стоимость проверки (p50/p99) и сколько обновлений каждого вида пропущено
+дальше к обработчикам, а сколько отклонено и по какому лимиту.
+
+Запуск:
+    python -m benchmarks.bench_rate_limiter --users 500 --updates 100000
+"""
+import argparse
+import datetime
+import random
+import time
+from collections import Counter
+
+from telegram import CallbackQuery, Chat, Message, PhotoSize, Update, User
+
+from benchmarks.common import percentile
+from rate_limiter import RateLimiter, RateLimitHandler, classify_update, load_rate_limits
+
+GROUP = Chat(id=-1001234567890, type=Chat.SUPERGROUP)
+NOW = datetime.datetime.now(datetime.timezone.utc)
+PHOTO = (PhotoSize("file", "unique", 1280, 960),)
+
+
+def _make_update(update_id: int, user: User, kind: str) -> Update:
+    message = Message(
+        update_id, NOW, GROUP, from_user=user,
+        photo=PHOTO if kind == "photo" else None,
+        text={"leaderboard": "Таблица лидеров", "command": "/info", "message": "Привет"}.get(kind),
+    )
+    if kind in ("volume", "page"):
+        data = "lb:2" if kind == "page" else "0.5"
+        return Update(update_id, callback_query=CallbackQuery(str(update_id), user, "instance", message=message, data=data))
+    return Update(update_id, message=message)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rate limiter flood benchmark")
+    parser.add_argument("--users", type=int, default=500, help="Участников группы")
+    parser.add_argument("--updates", type=int, default=100000, help="Всего обновлений в наплыве")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    users = [User(user_id, f"User{user_id}", False) for user_id in range(1, args.users + 1)]
+    kinds = ("photo", "volume", "page", "leaderboard", "command", "message")
+    updates = [_make_update(i, rng.choice(users), rng.choice(kinds)) for i in range(args.updates)]
+
+    handler = RateLimitHandler(RateLimiter(load_rate_limits()))
+    allowed, rejected = Counter(), Counter()
+    samples = []
+    started = time.perf_counter()
+    for update in updates:
+        check_started = time.perf_counter()
+        result = handler.check_update(update)
+        samples.append(time.perf_counter() - check_started)
+        if result is None:
+            allowed[classify_update(update)] += 1
+        else:
+            rejected[result] += 1
+    duration = time.perf_counter() - started
+
+    print(f"{args.updates} updates from {args.users} users in {duration * 1000:.0f}ms: "
+          f"check p50 {percentile(samples, 50) * 1e6:.1f}us, p99 {percentile(samples, 99) * 1e6:.1f}us, "
+          f"{len(handler.limiter)} buckets")
+    for category in sorted(set(allowed) | {category for category, _ in rejected}):
+        by_scope = ", ".join(f"{scope} {count}" for (cat, scope), count in sorted(rejected.items()) if cat == category)
+        print(f"  {category:<16} allowed {allowed[category]:>6}, rejected {sum(c for (cat, _), c in rejected.items() if cat == category):>6}"
+              f"{f' ({by_scope})' if by_scope else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк настроек SQLite под смешанной нагрузкой.
+
+Несколько потоков записывают заявки (record_submission), другие потоки
+одновременно читают историю участников и статистику конкурса. Сравниваются
+движок SQLAlchemy по умолчанию (журнал отката, synchronous=FULL) и движок
+бота из database.create_sqlite_engine (WAL, synchronous=NORMAL и т.д.).
+
+Запуск:
+    python -m benchmarks.bench_sqlite_engine --seconds 5 --writers 2 --readers 4
+"""
+import argparse
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from benchmarks.common import percentile, temporary_database
+from database.database import SessionLocal, create_sqlite_engine
+from db_utils import get_contest_stats, get_user_entries, record_submission
+
+
+def _default_engine(url: str):
+    return create_engine(url)
+
+
+def _run_load(seconds: float, writers: int, readers: int, users: int) -> dict:
+    stop_at = time.perf_counter() + seconds
+    lock = threading.Lock()
+    results = {"writes": 0, "write_errors": 0, "reads": 0, "read_errors": 0, "read_latencies": []}
+
+    def writer(seed: int) -> None:
+        rng = random.Random(seed)
+        writes = errors = 0
+        while time.perf_counter() < stop_at:
+            user_id = rng.randint(1, users)
+            try:
+                with SessionLocal() as db:
+                    record_submission(db, user_id, f"user{user_id}", None, 0.5, "bench_photo")
+                writes += 1
+            except Exception:
+                errors += 1
+        with lock:
+            results["writes"] += writes
+            results["write_errors"] += errors
+
+    def reader(seed: int) -> None:
+        rng = random.Random(seed)
+        latencies = []
+        errors = 0
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                with SessionLocal() as db:
+                    get_user_entries(db, rng.randint(1, users))
+                    get_contest_stats(db)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+        with lock:
+            results["reads"] += len(latencies)
+            results["read_errors"] += errors
+            results["read_latencies"].extend(latencies)
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(writers)]
+    threads += [threading.Thread(target=reader, args=(1000 + seed,)) for seed in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLite engine settings benchmark")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Длительность каждого прогона")
+    parser.add_argument("--writers", type=int, default=2, help="Потоков записи")
+    parser.add_argument("--readers", type=int, default=4, help="Потоков чтения")
+    parser.add_argument("--users", type=int, default=1000, help="Количество участников")
+    args = parser.parse_args()
+
+    # Логи каждой записи искажают замеры
+    logging.disable(logging.INFO)
+
+    for label, factory in (("default engine", _default_engine), ("tuned engine (WAL)", create_sqlite_engine)):
+        with temporary_database(factory):
+            results = _run_load(args.seconds, args.writers, args.readers, args.users)
+        latencies = results["read_latencies"]
+        print(f"{label}:")
+        print(f"  writes: {results['writes'] / args.seconds:8.1f}/s  errors: {results['write_errors']}")
+        print(f"  reads:  {results['reads'] / args.seconds:8.1f}/s  errors: {results['read_errors']}  "
+              f"p50 {percentile(latencies, 50) * 1000:.2f} ms  p99 {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
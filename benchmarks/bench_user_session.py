@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти на пользователя: прежний словарь user_data против UserSession.
+
+Для N пользователей строятся данные после типичного сценария (отправка заявки
+и запрос таблицы лидеров): словарь с прежними ключами и UserSession с теми же
+значениями. Память замеряется через tracemalloc, также выводится время
+deepcopy всех сессий (его делает Application при каждой записи persistence)
+и время прохода evict_idle_sessions по всем сессиям.
+
+Запуск:
+    python -m benchmarks.bench_user_session --users 10000
+"""
+import argparse
+import time
+import tracemalloc
+from copy import deepcopy
+from types import SimpleNamespace
+from typing import Callable, Dict
+
+from user_session import UserSession, evict_idle_sessions
+
+
+def _dict_user_data(user_id: int) -> dict:
+    """user_data в прежнем виде: ключи со строковыми именами, в том числе с ID пользователя."""
+    return {
+        "photo_file_id": f"AgACAgIAAxkBAAI{user_id:08d}",
+        "original_message_id": 1000 + user_id,
+        "original_chat_id": -1001234567890,
+        "prompt_message_id": 2000 + user_id,
+        "prompt_chat_id": -1001234567890,
+        f"last_leaderboard_message_id_{user_id}": 3000 + user_id,
+        f"leaderboard_last_request_{user_id}": 1750000000.0 + user_id,
+    }
+
+
+def _session_user_data(user_id: int) -> UserSession:
+    session = UserSession()
+    session.photo_file_id = f"AgACAgIAAxkBAAI{user_id:08d}"
+    session.original_message_id = 1000 + user_id
+    session.original_chat_id = -1001234567890
+    session.prompt_message_id = 2000 + user_id
+    session.prompt_chat_id = -1001234567890
+    session.leaderboard_message_id = 3000 + user_id
+    return session
+
+
+def _measure(factory: Callable[[int], object], users: int) -> Dict[str, float]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    user_data = {user_id: factory(user_id) for user_id in range(1, users + 1)}
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for data in user_data.values():
+        deepcopy(data)
+    copy_duration = time.perf_counter() - started
+    return {"bytes_per_user": allocated / users, "copy_ms": copy_duration * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-user session memory benchmark")
+    parser.add_argument("--users", type=int, default=10000, help="Количество пользователей")
+    args = parser.parse_args()
+
+    for name, factory in (("dict", _dict_user_data), ("UserSession", _session_user_data)):
+        result = _measure(factory, args.users)
+        print(f"{name:<12} {result['bytes_per_user']:6.0f} bytes per user, "
+              f"deepcopy of {args.users} users {result['copy_ms']:6.1f}ms")
+
+    # Проход по всем сессиям, из которых устарела половина
+    application = SimpleNamespace(user_data={})
+    application.drop_user_data = lambda user_id: application.user_data.pop(user_id)
+    for user_id in range(1, args.users + 1):
+        session = _session_user_data(user_id)
+        session.last_seen -= 7200 if user_id % 2 else 0
+        application.user_data[user_id] = session
+    started = time.perf_counter()
+    evicted = evict_idle_sessions(application, ttl=3600)
+    duration = time.perf_counter() - started
+    print(f"eviction     {evicted} of {args.users} sessions evicted in {duration * 1000:.1f}ms, "
+          f"{len(application.user_data)} remain")
+
+
+if __name__ == "__main__":
+    main()
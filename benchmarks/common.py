@@ -0,0 +1,50 @@
+"""Общие утилиты для бенчмарков: временная база данных и перцентили."""
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+
+from sqlalchemy.engine import Engine
+
+from change_journal import change_journal
+from database.database import SessionLocal, create_sqlite_engine
+from models import Base
+
+
+@contextmanager
+def temporary_database(engine_factory: Callable[[str], Engine] = create_sqlite_engine) -> Iterator[str]:
+    """
+    Создает пустую базу во временной директории и привязывает к ней SessionLocal,
+    а журнал изменений переводит в ту же директорию.
+
+    Args:
+        engine_factory: Функция, создающая движок по URL (по умолчанию настройки бота)
+
+    Yields:
+        str: Путь к файлу временной базы данных
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        engine = engine_factory(f"sqlite:///{db_path}")
+        Base.metadata.create_all(bind=engine)
+        previous_bind = SessionLocal.kw.get("bind")
+        previous_journal = change_journal.path
+        SessionLocal.configure(bind=engine)
+        change_journal.close()
+        change_journal.path = os.path.join(tmp_dir, "journal", "changes.jsonl")
+        try:
+            yield db_path
+        finally:
+            change_journal.close()
+            change_journal.path = previous_journal
+            SessionLocal.configure(bind=previous_bind)
+            engine.dispose()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Returns the pct-th percentile (0-100) of samples using nearest-rank."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
@@ -0,0 +1,295 @@
+# bot_persistence.py
+"""
+Хранение user_data (UserSession), bot_data и состояний диалогов в базе SQLite бота.
+
+Без persistence перезапуск посреди диалога терял выбранное фото заявки, ID
+сообщений с подсказками, ограничение частоты /leaderboard и вход администратора.
+SQLitePersistence реализует BasePersistence из python-telegram-bot:
+
+    - user_data загружается лениво, при первом обновлении от пользователя
+      (refresh_user_data), а не целиком при запуске; записи пользователей
+      и состояния диалогов, от чьих пользователей не было обновлений дольше
+      SESSION_TTL, удаляются при запуске;
+    - Application раз в PERSISTENCE_FLUSH_INTERVAL секунд передает данные
+      пользователей, получивших обновления; значения сравниваются с последними
+      записанными, и в базу одной транзакцией попадают только изменившиеся ключи;
+    - у неизменившихся ключей активного пользователя (его user_data и диалогов)
+      продлевается только updated_at, не чаще раза в PERSISTENCE_TOUCH_INTERVAL
+      секунд: по нему удаляются устаревшие записи, поэтому он означает время
+      последней активности, а не последнего изменения;
+    - сериализация, сравнение и запись идут в потоке БД (run_db), поэтому
+      обработка обновлений их не ждет.
+
+Значения хранятся в JSON (UserSession — через to_dict/restore). Значение,
+которое нельзя сериализовать, остается только в памяти.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db_utils import load_persistent_data, purge_persistent_data, run_db, store_persistent_data
+from user_session import SESSION_TTL, UserSession
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передает изменения в persistence (секунды)
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get("PERSISTENCE_FLUSH_INTERVAL", "30"))
+# Как часто продлевать updated_at неизменившихся ключей активного пользователя (секунды, меньше SESSION_TTL)
+PERSISTENCE_TOUCH_INTERVAL = float(os.environ.get("PERSISTENCE_TOUCH_INTERVAL", "3600"))
+
+USER_DATA = "user_data"
+BOT_DATA = "bot_data"
+BOT_DATA_KEY = "bot"
+CONVERSATION_PREFIX = "conversation:"
+
+# (namespace, key) в таблице bot_persistence
+StoreKey = Tuple[str, str]
+ConversationKey = Tuple[Any, ...]
+
+
+def _encode(value) -> Optional[str]:
+    """Returns the JSON text to store; None means the key should be deleted."""
+    if isinstance(value, UserSession):
+        value = value.to_dict()
+    if value is None or value == {}:
+        return None
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def _session_cutoff() -> datetime.datetime:
+    """Returns the naive UTC time before which stored sessions and conversations are stale."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(seconds=SESSION_TTL)
+
+
+class SQLitePersistence(BasePersistence[UserSession, dict, dict]):
+    """BasePersistence поверх таблицы bot_persistence (models.PersistentData)."""
+
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        # Последний записанный (или загруженный) JSON по ключу: неизменившиеся данные не пишутся
+        self._stored: Dict[StoreKey, str] = {}
+        # Значения, переданные Application с последней записи; None или {} — удалить ключ
+        self._dirty: Dict[StoreKey, object] = {}
+        # Ключи диалогов активных пользователей, у которых нужно продлить updated_at
+        self._touch: Set[StoreKey] = set()
+        # Время (monotonic) последней записи или продления ключа в базе
+        self._touched_at: Dict[StoreKey, float] = {}
+        # user_id -> ключи его диалогов (ID пользователя входит в ключ диалога)
+        self._user_conversations: Dict[int, Set[StoreKey]] = {}
+        self._loaded_users: Set[int] = set()
+        self._write_task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+    # --- Очередь записи ---
+
+    def _queue(self, store_key: StoreKey, value) -> None:
+        # Application передает глубокую копию, поэтому значение можно сериализовать позже в потоке БД
+        self._dirty[store_key] = value
+        self._schedule_write()
+
+    def _schedule_write(self) -> None:
+        if self._write_task is None or self._write_task.done():
+            # Application вызывает update_* для всех измененных ключей разом:
+            # задача запускается после них и пишет весь пакет одной транзакцией
+            self._write_task = asyncio.get_running_loop().create_task(self._write_dirty())
+
+    def _needs_touch(self, store_key: StoreKey, now: float) -> bool:
+        if store_key not in self._stored:
+            # Ключа нет в базе: продлевать нечего
+            return False
+        # Ключ, загруженный из базы и еще не продленный, продлевается при первой активности
+        touched_at = self._touched_at.get(store_key)
+        return touched_at is None or now - touched_at >= PERSISTENCE_TOUCH_INTERVAL
+
+    def _write_batch(self, db, batch: Dict[StoreKey, object], touch: Set[StoreKey] = frozenset()) -> int:
+        """
+        Сериализует пакет в потоке БД и записывает только значения, отличающиеся от сохраненных.
+
+        У сохраненных ключей без изменений (из пакета и из touch) продлевается
+        updated_at, если с последней записи прошло PERSISTENCE_TOUCH_INTERVAL.
+        """
+        rows = []
+        unchanged = set(touch)
+        for store_key, value in batch.items():
+            try:
+                text = _encode(value)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Not persisting {store_key}: value is not JSON serializable ({e})")
+                continue
+            if self._stored.get(store_key) != text:
+                rows.append((store_key[0], store_key[1], text))
+                unchanged.discard(store_key)
+            else:
+                unchanged.add(store_key)
+        now = time.monotonic()
+        touched = [store_key for store_key in unchanged if self._needs_touch(store_key, now)]
+        if not rows and not touched:
+            return 0
+        written = store_persistent_data(db, rows, touched)
+        for namespace, key, text in rows:
+            if text is None:
+                self._stored.pop((namespace, key), None)
+                self._touched_at.pop((namespace, key), None)
+            else:
+                self._stored[(namespace, key)] = text
+                self._touched_at[(namespace, key)] = now
+        for store_key in touched:
+            self._touched_at[store_key] = now
+        return written
+
+    async def _write_dirty(self) -> int:
+        written = 0
+        async with self._write_lock:
+            while self._dirty or self._touch:
+                batch, self._dirty = self._dirty, {}
+                touch, self._touch = self._touch, set()
+                try:
+                    written += await run_db(self._write_batch, batch, touch)
+                except Exception as e:
+                    # Возвращаем пакет в очередь, не затирая более новые значения
+                    for store_key, value in batch.items():
+                        self._dirty.setdefault(store_key, value)
+                    self._touch |= touch
+                    logger.error(f"Failed to write {len(batch)} persistence keys: {e}", exc_info=True)
+                    break
+        if written:
+            logger.debug(f"Persisted {written} changed keys")
+        return written
+
+    async def flush(self) -> None:
+        """Записывает все ожидающие изменения (вызывается при остановке бота)."""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_dirty()
+        logger.info("Persistence flushed")
+
+    # --- user_data: ленивая загрузка по пользователю ---
+
+    async def get_user_data(self) -> Dict[int, UserSession]:
+        # Данные пользователя загружаются в refresh_user_data при первом обновлении от него.
+        # Сессии, брошенные дольше SESSION_TTL назад, уже не нужны (см. user_session.py)
+        cutoff = _session_cutoff()
+        purged = await run_db(purge_persistent_data, USER_DATA, cutoff)
+        if purged:
+            logger.info(f"Purged {purged} user sessions idle since before {cutoff:%Y-%m-%d %H:%M} UTC")
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: UserSession) -> None:
+        # Application вызывает этот метод перед обработчиками каждого обновления от пользователя
+        user_data.touch()
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        store_key = (USER_DATA, str(user_id))
+        try:
+            rows = await run_db(load_persistent_data, USER_DATA, str(user_id))
+        except Exception as e:
+            self._loaded_users.discard(user_id)
+            logger.error(f"Failed to load user_data for {user_id}: {e}", exc_info=True)
+            return
+        text = rows.get(str(user_id))
+        if text is None:
+            return
+        self._stored[store_key] = text
+        user_data.restore(json.loads(text))
+
+    async def update_user_data(self, user_id: int, data: UserSession) -> None:
+        # Application вызывает метод для каждого пользователя, от которого были обновления,
+        # поэтому здесь же продлеваются и его сохраненные диалоги
+        conversations = self._user_conversations.get(user_id)
+        if conversations:
+            self._touch |= conversations
+            self._schedule_write()
+        if user_id not in self._loaded_users and not data.to_dict():
+            # Данные не загружались и не менялись: нечего записывать
+            return
+        self._queue((USER_DATA, str(user_id)), data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._queue((USER_DATA, str(user_id)), None)
+
+    # --- bot_data ---
+
+    async def get_bot_data(self) -> dict:
+        rows = await run_db(load_persistent_data, BOT_DATA, BOT_DATA_KEY)
+        text = rows.get(BOT_DATA_KEY)
+        if text is None:
+            return {}
+        self._stored[(BOT_DATA, BOT_DATA_KEY)] = text
+        return json.loads(text)
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._queue((BOT_DATA, BOT_DATA_KEY), data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        # bot_data меняет только этот процесс, перечитывать его не нужно
+        pass
+
+    # --- Диалоги ---
+
+    async def get_conversations(self, name: str) -> Dict[ConversationKey, object]:
+        namespace = CONVERSATION_PREFIX + name
+        # Диалог, брошенный дольше SESSION_TTL назад, удаляется вместе с сессией пользователя:
+        # без ее данных (фото заявки, выбранная запись) его нельзя продолжить
+        cutoff = _session_cutoff()
+        purged = await run_db(purge_persistent_data, namespace, cutoff)
+        if purged:
+            logger.info(f"Purged {purged} {name} conversations idle since before {cutoff:%Y-%m-%d %H:%M} UTC")
+        rows = await run_db(load_persistent_data, namespace)
+        conversations = {}
+        for key, text in rows.items():
+            self._stored[(namespace, key)] = text
+            conversation_key = tuple(json.loads(key))
+            self._index_conversation((namespace, key), conversation_key, True)
+            conversations[conversation_key] = json.loads(text)
+        logger.info(f"Loaded {len(conversations)} active conversations for {name}")
+        return conversations
+
+    def _index_conversation(self, store_key: StoreKey, key: ConversationKey, active: bool) -> None:
+        # Ключ диалога — (chat_id, user_id), (user_id,) или (chat_id,); ID группы (< 0)
+        # пользователем не бывает, а ID личного чата совпадает с ID пользователя
+        for part in key:
+            if not isinstance(part, int) or part <= 0:
+                continue
+            if active:
+                self._user_conversations.setdefault(part, set()).add(store_key)
+            else:
+                keys = self._user_conversations.get(part)
+                if keys is not None:
+                    keys.discard(store_key)
+                    if not keys:
+                        del self._user_conversations[part]
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        store_key = (CONVERSATION_PREFIX + name, json.dumps(list(key)))
+        self._index_conversation(store_key, key, new_state is not None)
+        self._queue(store_key, new_state)
+
+    # --- Не используются: chat_data и callback_data не хранятся ---
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
@@ -0,0 +1,413 @@
+# change_journal.py
+"""
+Журнал изменений базы данных для восстановления на момент времени.
+
+Каждая запись через db_utils (новая заявка, изменение объема админом, удаление
+записи или участника, импорт) после коммита добавляется в append-only файл
+JSON Lines с порядковым номером seq и временем ts (UTC). Строки сразу
+передаются ОС, а fsync выполняется пачками: каждые JOURNAL_FSYNC_BATCH записей,
+не реже чем раз в JOURNAL_FSYNC_INTERVAL секунд и при остановке бота.
+
+Снимок в хранилище бэкапов запоминает последний seq журнала на момент начала
+копирования. Восстановление на момент времени берет ближайший снимок и
+применяет к нему записи журнала после этого seq (см. replay_journal).
+Все операции журнала задают итоговое состояние (INSERT OR REPLACE, DELETE),
+поэтому повторное применение записи, уже попавшей в снимок, ничего не ломает.
+"""
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from database.database import DB_DIRECTORY
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка файла между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = os.environ.get("JOURNAL_PATH", os.path.join(DB_DIRECTORY, "journal", "changes.jsonl"))
+JOURNAL_FSYNC_BATCH = int(os.environ.get("JOURNAL_FSYNC_BATCH", "64"))
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("JOURNAL_FSYNC_INTERVAL", "1.0"))
+
+# Операции журнала
+OP_USER = "user"                      # участник добавлен или изменены имя/ник
+OP_ENTRY_ADDED = "entry_added"        # новая запись о пиве
+OP_ENTRY_DELETED = "entry_deleted"    # запись удалена админом
+OP_ENTRIES_REPLACED = "entries_replaced"  # записи участников заменены (правка объема, импорт)
+OP_USER_DELETED = "user_deleted"      # участник удален вместе с записями
+OP_RESTORED = "restored"              # база восстановлена из бэкапа (начало новой ветки истории)
+
+
+def _lock_file(journal_file) -> None:
+    if fcntl is not None:
+        fcntl.flock(journal_file.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(journal_file) -> None:
+    if fcntl is not None:
+        fcntl.flock(journal_file.fileno(), fcntl.LOCK_UN)
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as journal_file:
+        journal_file.seek(-1, os.SEEK_END)
+        return journal_file.read(1) == b"\n"
+
+
+def utc_now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+def timestamp_text(value: Any) -> Optional[str]:
+    """Converts a datetime to the text form SQLite stores (naive UTC, space separator)."""
+    if value is None or isinstance(value, str):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=" ")
+
+
+def parse_timestamp(value: str) -> str:
+    """Parses a user-supplied ISO timestamp (local time if naive) into the journal's UTC form."""
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment.astimezone(datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+class ChangeJournal:
+    """
+    Append-only журнал изменений с пакетным fsync.
+
+    Бот и утилита db_backup.py могут работать с журналом одновременно, поэтому
+    запись и перезапись файла (compact, mark_restored) выполняются под
+    блокировкой файла, а seq перечитывается, если файл изменил другой процесс.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH, fsync_batch: int = JOURNAL_FSYNC_BATCH,
+                 fsync_interval: float = JOURNAL_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_seq: Optional[int] = None
+        # Размер файла после нашей последней записи: если он другой, файл дописал другой процесс
+        self._end = -1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _read_last_seq(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as journal_file:
+            journal_file.seek(0, os.SEEK_END)
+            position = journal_file.tell()
+            # Читаем хвост файла, пока в нем не окажется целая последняя строка
+            block = 4096
+            tail = b""
+            while position > 0:
+                step = min(block, position)
+                position -= step
+                journal_file.seek(position)
+                tail = journal_file.read(step) + tail
+                lines = tail.rstrip(b"\n").split(b"\n")
+                if len(lines) > 1 or position == 0:
+                    for line in reversed(lines):
+                        try:
+                            return json.loads(line)["seq"]
+                        except (ValueError, KeyError):
+                            # Оборванная при сбое строка в конце файла
+                            continue
+                    if position == 0:
+                        return 0
+                block *= 2
+        return 0
+
+    @property
+    def last_seq(self) -> int:
+        """Номер последней записи журнала (в том числе записанной другим процессом)."""
+        with self._lock:
+            if self._file is not None:
+                self._close_file()
+            return self._read_last_seq()
+
+    def _close_file(self) -> None:
+        self._fsync()
+        self._file.close()
+        self._file = None
+
+    def _open_locked(self):
+        """Opens the current journal file and takes its exclusive lock."""
+        while True:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            _lock_file(self._file)
+            try:
+                current = os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                return self._file
+            # Файл перезаписан другим процессом (compact): открываем новый
+            _unlock_file(self._file)
+            self._close_file()
+            self._last_seq = None
+
+    def append(self, op: str, **data: Any) -> int:
+        """
+        Добавляет запись в журнал.
+
+        Args:
+            op (str): Одна из констант OP_*
+            **data: Данные операции (JSON-совместимые)
+
+        Returns:
+            int: Номер записи seq
+        """
+        with self._lock:
+            journal_file = self._open_locked()
+            try:
+                size = os.fstat(journal_file.fileno()).st_size
+                if self._last_seq is None or size != self._end:
+                    self._last_seq = self._read_last_seq()
+                    if size and not _ends_with_newline(self.path):
+                        # Строку, оборванную при сбое, отделяем от новых записей
+                        journal_file.write("\n")
+                self._last_seq += 1
+                record = {"seq": self._last_seq, "ts": utc_now(), "op": op, **data}
+                journal_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                # Строка сразу уходит в ОС: ее увидят другие процессы и она переживет падение бота
+                journal_file.flush()
+                self._end = journal_file.tell()
+            finally:
+                _unlock_file(journal_file)
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._fsync()
+            return self._last_seq
+
+    def _fsync(self) -> None:
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self) -> None:
+        """Сбрасывает накопленные записи на диск (fsync)."""
+        with self._lock:
+            self._fsync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._close_file()
+            self._last_seq = None
+
+    def read(self, after_seq: int = 0, until_ts: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Потоково читает записи с seq > after_seq и ts <= until_ts."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping damaged journal line: {line[:80]!r}")
+                    continue
+                if record["seq"] <= after_seq:
+                    continue
+                if until_ts is not None and record["ts"] > until_ts:
+                    break
+                yield record
+
+    def _rewrite(self, keep: Callable[[Dict[str, Any]], bool],
+                 trailer: Optional[Dict[str, Any]] = None) -> Tuple[List[str], int]:
+        """
+        Rewrites the journal keeping records for which keep(record) is true.
+
+        Without a trailer the last record is always kept, so seq never goes back.
+        With a trailer (op and data of a new record) every record goes through keep
+        and the trailer is appended with the next seq.
+
+        Returns:
+            Tuple[List[str], int]: Dropped lines and the last seq in the journal
+        """
+        dropped: List[str] = []
+        if self._file is not None:
+            self._close_file()
+        self._last_seq = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Файл открывается на дозапись, чтобы под блокировкой был и новый журнал
+        tmp_path = self.path + ".tmp"
+        with open(self.path, "a+", encoding="utf-8") as source:
+            _lock_file(source)
+            try:
+                source.seek(0)
+                last_seq = 0
+                with open(tmp_path, "w", encoding="utf-8") as target:
+                    previous = None
+                    for line in source:
+                        if not line.endswith("\n"):
+                            # Оборванная при сбое последняя строка
+                            break
+                        if previous is not None:
+                            if keep(previous[0]):
+                                target.write(previous[1])
+                            else:
+                                dropped.append(previous[1])
+                        try:
+                            previous = (json.loads(line), line)
+                            last_seq = previous[0]["seq"]
+                        except ValueError:
+                            logger.warning(f"Dropping damaged journal line: {line[:80]!r}")
+                    if previous is not None:
+                        if trailer is None or keep(previous[0]):
+                            target.write(previous[1])
+                        else:
+                            dropped.append(previous[1])
+                    if trailer is not None:
+                        last_seq += 1
+                        record = {"seq": last_seq, "ts": utc_now(), **trailer}
+                        target.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.replace(tmp_path, self.path)
+            finally:
+                _unlock_file(source)
+        return dropped, last_seq
+
+    def compact(self, keep_after_seq: int) -> int:
+        """Удаляет записи с seq <= keep_after_seq (они уже есть во всех хранимых снимках)."""
+        with self._lock:
+            dropped, _last_seq = self._rewrite(lambda record: record["seq"] > keep_after_seq)
+        if dropped:
+            logger.info(f"Compacted change journal: removed {len(dropped)} records up to seq {keep_after_seq}")
+        return len(dropped)
+
+    def mark_restored(self, restored_seq: Optional[int], description: str) -> int:
+        """
+        Отмечает восстановление базы: записи после restored_seq больше не описывают
+        текущее состояние, поэтому они переносятся в отдельный архивный файл,
+        а в журнал добавляется запись OP_RESTORED.
+
+        Args:
+            restored_seq (int, optional): seq, которому соответствует восстановленное
+                состояние; None — неизвестен (восстановление из полной копии)
+            description (str): Откуда восстановлена база
+
+        Returns:
+            int: seq записи OP_RESTORED
+        """
+        # Номера seq не переиспользуются: запись OP_RESTORED продолжает нумерацию
+        with self._lock:
+            dropped, seq = self._rewrite(
+                lambda record: restored_seq is None or record["seq"] <= restored_seq,
+                trailer={"op": OP_RESTORED, "restored_seq": restored_seq, "description": description},
+            )
+        if dropped:
+            archive_path = f"{self.path}.undone_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            with open(archive_path, "w", encoding="utf-8") as archive:
+                archive.writelines(dropped)
+            logger.info(f"Moved {len(dropped)} undone journal records to {archive_path}")
+        return seq
+
+    def last_restore_marker(self, until_ts: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Returns the latest OP_RESTORED record not later than until_ts."""
+        marker = None
+        for record in self.read(until_ts=until_ts):
+            if record["op"] == OP_RESTORED:
+                marker = record
+        return marker
+
+
+def _upsert_users(cursor: sqlite3.Cursor, users: List[Dict[str, Any]]) -> None:
+    # Снимок может уже содержать более поздние изменения, чем применяемая запись:
+    # ник временно освобождается у другого участника, его вернет одна из следующих записей
+    cursor.executemany(
+        "UPDATE users SET username = NULL WHERE username = ? AND id != ?",
+        [(user["username"], user["user_id"]) for user in users if user["username"] is not None],
+    )
+    cursor.executemany(
+        "INSERT INTO users (id, first_name, username) VALUES (?, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET first_name = excluded.first_name, username = excluded.username",
+        [(user["user_id"], user["first_name"], user["username"]) for user in users],
+    )
+
+
+def replay_journal(connection: sqlite3.Connection, records) -> int:
+    """
+    Применяет записи журнала к базе (обычно к собранному снимку) одной транзакцией
+    и пересчитывает user_totals.
+
+    Args:
+        connection (sqlite3.Connection): Соединение с базой, к которой применяются записи
+        records: Записи журнала в порядке seq
+
+    Returns:
+        int: Количество примененных записей
+    """
+    applied = 0
+    cursor = connection.cursor()
+    cursor.execute("BEGIN")
+    try:
+        for record in records:
+            op = record["op"]
+            if op == OP_USER:
+                _upsert_users(cursor, [record])
+            elif op == OP_ENTRY_ADDED:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO beer_entries (id, user_id, volume_liters, photo_file_id, submitted_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (record["entry_id"], record["user_id"], record["volume"], record["photo_file_id"], record["submitted_at"]),
+                )
+            elif op == OP_ENTRY_DELETED:
+                cursor.execute("DELETE FROM beer_entries WHERE id = ?", (record["entry_id"],))
+            elif op == OP_ENTRIES_REPLACED:
+                _upsert_users(cursor, record.get("users", []))
+                entries = record["entries"]
+                cursor.executemany(
+                    "DELETE FROM beer_entries WHERE user_id = ?",
+                    [(entry["user_id"],) for entry in entries],
+                )
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO beer_entries (id, user_id, volume_liters, photo_file_id, submitted_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (entry["entry_id"], entry["user_id"], entry["volume"], record["photo_file_id"], record["submitted_at"])
+                        for entry in entries
+                    ],
+                )
+            elif op == OP_USER_DELETED:
+                cursor.execute("DELETE FROM beer_entries WHERE user_id = ?", (record["user_id"],))
+                cursor.execute("DELETE FROM users WHERE id = ?", (record["user_id"],))
+            elif op == OP_RESTORED:
+                continue
+            else:
+                logger.warning(f"Unknown journal operation {op!r} at seq {record['seq']}, skipping")
+                continue
+            applied += 1
+
+        # Суммы пересчитываются один раз по итоговым записям
+        cursor.execute("DELETE FROM user_totals")
+        cursor.execute(
+            "INSERT INTO user_totals (user_id, total_volume, entry_count, last_submitted_at) "
+            "SELECT user_id, SUM(volume_liters), COUNT(id), MAX(submitted_at) FROM beer_entries GROUP BY user_id"
+        )
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return applied
+
+
+# Общий журнал процесса
+change_journal = ChangeJournal()
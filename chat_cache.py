@@ -0,0 +1,142 @@
+# chat_cache.py
+"""
+Кеш метаданных чатов: закрепленное сообщение и участники (права бота и админов).
+
+Раньше каждое нажатие кнопки таблицы лидеров вызывало getChat, чтобы узнать
+закрепленное сообщение, а каждая команда /leaderboard в группе — getChatMember
+для проверки права бота удалять сообщения. Теперь ответы хранятся CHAT_CACHE_TTL
+секунд и сбрасываются раньше по обновлениям от Telegram:
+
+    my_chat_member / chat_member — изменились права бота или участника;
+    служебное сообщение о закреплении — известен новый закрепленный ID.
+
+Об откреплении Telegram не сообщает, поэтому устаревший закрепленный ID живет
+не дольше CHAT_CACHE_TTL; ошибка при этом безопасна (сообщение просто не удаляется).
+Одновременные промахи по одному ключу ждут один общий запрос к Bot API.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from telegram import Bot, ChatMember, Update
+from telegram.ext import Application, ChatMemberHandler, ContextTypes, MessageHandler, filters
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд хранить ответы getChat/getChatMember
+CHAT_CACHE_TTL = float(os.environ.get("CHAT_CACHE_TTL", "300"))
+# Группа обработчиков, сбрасывающих кеш: выполняется до основных и не останавливает их
+CHAT_CACHE_HANDLER_GROUP = -1
+
+
+class ChatMetadataCache:
+    def __init__(self, ttl: float = CHAT_CACHE_TTL):
+        self.ttl = ttl
+        # chat_id -> (истекает, ID закрепленного сообщения или None)
+        self._pinned: Dict[int, Tuple[float, Optional[int]]] = {}
+        # (chat_id, user_id) -> (истекает, ChatMember)
+        self._members: Dict[Tuple[int, int], Tuple[float, ChatMember]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+
+    async def _load(self, key: Hashable, fetch: Callable[[], Awaitable]):
+        # Несколько обработчиков с одним промахом ждут один запрос к Bot API
+        future = self._inflight.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetch()
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже получает вызывающий; ожидающих может не быть
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def pinned_message_id(self, bot: Bot, chat_id: int) -> Optional[int]:
+        """Returns the ID of the pinned message in the chat, calling getChat at most once per TTL."""
+        cached = self._pinned.get(chat_id)
+        if cached is not None and cached[0] > time.monotonic():
+            self._stats["hits"] += 1
+            return cached[1]
+        self._stats["misses"] += 1
+
+        async def fetch() -> Optional[int]:
+            chat = await bot.get_chat(chat_id)
+            return chat.pinned_message.message_id if chat.pinned_message else None
+
+        message_id = await self._load(("pinned", chat_id), fetch)
+        self._pinned[chat_id] = (time.monotonic() + self.ttl, message_id)
+        return message_id
+
+    async def get_chat_member(self, bot: Bot, chat_id: int, user_id: int) -> ChatMember:
+        """Returns the chat member (status and rights), calling getChatMember at most once per TTL."""
+        key = (chat_id, user_id)
+        cached = self._members.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self._stats["hits"] += 1
+            return cached[1]
+        self._stats["misses"] += 1
+        member = await self._load(("member", chat_id, user_id), lambda: bot.get_chat_member(chat_id, user_id))
+        self._members[key] = (time.monotonic() + self.ttl, member)
+        return member
+
+    def set_pinned(self, chat_id: int, message_id: Optional[int]) -> None:
+        self._pinned[chat_id] = (time.monotonic() + self.ttl, message_id)
+
+    def invalidate_member(self, chat_id: int, user_id: int) -> None:
+        if self._members.pop((chat_id, user_id), None) is not None:
+            self._stats["invalidations"] += 1
+
+    def invalidate_chat(self, chat_id: int) -> None:
+        """Забывает все сведения о чате (например, бот удален из группы)."""
+        keys = [key for key in self._members if key[0] == chat_id]
+        for key in keys:
+            del self._members[key]
+        if self._pinned.pop(chat_id, None) is not None or keys:
+            self._stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Счетчики кеша для /metrics (см. metrics.register_cache_gauges)."""
+        return dict(self._stats, size=len(self._pinned) + len(self._members))
+
+
+chat_cache = ChatMetadataCache()
+
+
+async def _on_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сбрасывает кеш участника, чей статус или права изменились (в том числе самого бота)."""
+    member_update = update.chat_member or update.my_chat_member
+    chat_id = member_update.chat.id
+    user_id = member_update.new_chat_member.user.id
+    if update.my_chat_member and member_update.new_chat_member.status in (ChatMember.LEFT, ChatMember.BANNED):
+        chat_cache.invalidate_chat(chat_id)
+    else:
+        chat_cache.invalidate_member(chat_id, user_id)
+    logger.debug(f"Chat member {user_id} in chat {chat_id} changed, cache entry dropped")
+
+
+async def _on_pinned_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запоминает новое закрепленное сообщение из служебного сообщения о закреплении."""
+    message = update.effective_message
+    pinned = message.pinned_message
+    chat_cache.set_pinned(message.chat_id, pinned.message_id if pinned else None)
+
+
+def register_chat_cache_handlers(application: Application) -> None:
+    """Добавляет обработчики, сбрасывающие кеш по обновлениям от Telegram."""
+    application.add_handler(
+        ChatMemberHandler(_on_chat_member_update, ChatMemberHandler.ANY_CHAT_MEMBER), group=CHAT_CACHE_HANDLER_GROUP
+    )
+    application.add_handler(
+        MessageHandler(filters.StatusUpdate.PINNED_MESSAGE, _on_pinned_message), group=CHAT_CACHE_HANDLER_GROUP
+    )
@@ -1,6 +1,8 @@
 import os
 import logging
-from sqlalchemy import create_engine
+from typing import Optional, Tuple
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -28,11 +30,89 @@ logger.info("Database path: %s", DB_PATH)
 # Use SQLite database
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+# Настройки SQLite (можно переопределить переменными окружения).
+# WAL позволяет читать во время записи, а synchronous=NORMAL в режиме WAL
+# не теряет целостность при сбое процесса и заметно ускоряет коммиты.
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+# Размер кеша страниц на соединение, КБ
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "16384"))
+# Объем файла, читаемый через mmap, байт (0 отключает mmap)
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+SQLITE_TEMP_STORE = os.environ.get("SQLITE_TEMP_STORE", "MEMORY")
+# Сколько ждать освобождения блокировки вместо немедленной ошибки "database is locked", мс
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Соединения пула: потоки БД (DB_WORKERS), фоновые задачи и скрипты обслуживания
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "4"))
+SQLITE_MAX_OVERFLOW = int(os.environ.get("SQLITE_MAX_OVERFLOW", "4"))
+
 from models import Base  # Import Base from root models.py
 
-engine = create_engine(DATABASE_URL)
+def _sqlite_pragmas(journal_mode: str, synchronous: str) -> Tuple[str, ...]:
+    return (
+        f"PRAGMA journal_mode={journal_mode}",
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA temp_store={SQLITE_TEMP_STORE}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    )
+
+def create_sqlite_engine(url: str = DATABASE_URL, journal_mode: Optional[str] = None,
+                         synchronous: Optional[str] = None) -> Engine:
+    """
+    Создает движок SQLite с настройками для бота.
+
+    PRAGMA применяются к каждому новому соединению пула через событие connect.
+
+    Args:
+        url (str): URL базы данных
+        journal_mode (str, optional): Режим журнала (по умолчанию SQLITE_JOURNAL_MODE)
+        synchronous (str, optional): Режим синхронизации (по умолчанию SQLITE_SYNCHRONOUS)
+
+    Returns:
+        Engine: Настроенный движок SQLAlchemy
+    """
+    pragmas = _sqlite_pragmas(journal_mode or SQLITE_JOURNAL_MODE, synchronous or SQLITE_SYNCHRONOUS)
+    sqlite_engine = create_engine(
+        url,
+        pool_size=SQLITE_POOL_SIZE,
+        max_overflow=SQLITE_MAX_OVERFLOW,
+        # Соединение используется то одним, то другим потоком пула, но никогда двумя сразу
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _apply_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    return sqlite_engine
+
+engine = create_sqlite_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def checkpoint_wal(mode: str = "PASSIVE", bind: Optional[Engine] = None) -> Optional[Tuple[int, int, int]]:
+    """
+    Переносит страницы из WAL-файла в основной файл базы данных.
+
+    PASSIVE не ждет читателей и писателей, TRUNCATE дополнительно обнуляет WAL-файл
+    (используется при остановке бота).
+
+    Returns:
+        Tuple[int, int, int]: (busy, страниц в WAL, перенесено страниц) или None, если WAL не используется
+    """
+    with (bind or engine).connect() as connection:
+        if connection.exec_driver_sql("PRAGMA journal_mode").scalar().lower() != "wal":
+            return None
+        busy, log_pages, checkpointed = connection.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one()
+    logger.info(f"WAL checkpoint ({mode}): busy={busy}, wal_pages={log_pages}, checkpointed={checkpointed}")
+    return busy, log_pages, checkpointed
+
 # Function to create database tables
 def init_db():
     # Убедимся, что директория существует
@@ -43,10 +123,7 @@ def init_db():
     Base.metadata.create_all(bind=engine)
     logger.info("Database tables created/checked at: %s", DB_PATH)
 
-# Dependency to get DB session in handlers
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+    # Применяем миграции схемы; планы ключевых запросов проверяет tests/test_migrations.py
+    from database.migrations import run_migrations
+    run_migrations(engine)
+
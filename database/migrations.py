@@ -0,0 +1,178 @@
+# database/migrations.py
+"""
+Версионные миграции схемы базы данных.
+
+init_db сначала создает недостающие таблицы через create_all, затем применяет
+миграции, еще не записанные в таблицу schema_migrations. Каждая миграция
+выполняется в своей транзакции вместе с записью о ее применении, поэтому
+прерванный запуск просто повторит незавершенную миграцию.
+
+Чтобы изменить схему, добавьте функцию миграции и запись в MIGRATIONS
+со следующим номером версии. Уже выпущенные миграции не меняются.
+"""
+import logging
+from typing import Callable, List, NamedTuple, Set, Tuple
+
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_TABLE = "schema_migrations"
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _column_is_not_null(connection: Connection, table: str, column: str) -> bool:
+    for row in connection.exec_driver_sql(f"PRAGMA table_info({table})"):
+        # (cid, name, type, notnull, dflt_value, pk)
+        if row[1] == column:
+            return bool(row[3])
+    return False
+
+
+def _make_photo_file_id_nullable(connection: Connection) -> None:
+    """Бывший скрипт migrate_photo_nullable.py: пересоздает beer_entries с photo_file_id NULL."""
+    if not _column_is_not_null(connection, "beer_entries", "photo_file_id"):
+        return
+    connection.exec_driver_sql("""
+        CREATE TABLE beer_entries_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id BIGINT NOT NULL,
+            volume_liters FLOAT NOT NULL,
+            photo_file_id VARCHAR,
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    connection.exec_driver_sql("""
+        INSERT INTO beer_entries_new (id, user_id, volume_liters, photo_file_id, submitted_at)
+        SELECT id, user_id, volume_liters, photo_file_id, submitted_at FROM beer_entries
+    """)
+    connection.exec_driver_sql("DROP TABLE beer_entries")
+    connection.exec_driver_sql("ALTER TABLE beer_entries_new RENAME TO beer_entries")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_beer_entries_id ON beer_entries (id)")
+
+
+def _add_beer_entries_user_history_index(connection: Connection) -> None:
+    """История участника и пересчет его суммы: WHERE user_id = ? ORDER BY submitted_at."""
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_beer_entries_user_id_submitted_at ON beer_entries (user_id, submitted_at)"
+    )
+    # Индекс только по user_id из старого скрипта миграции является префиксом нового
+    connection.exec_driver_sql("DROP INDEX IF EXISTS idx_beer_entries_user_id")
+
+
+def _add_beer_entries_submitted_at_index(connection: Connection) -> None:
+    """Запросы по временному окну: WHERE submitted_at >= ?."""
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_beer_entries_submitted_at ON beer_entries (submitted_at)"
+    )
+
+
+def _add_user_totals_ranking_index(connection: Connection) -> None:
+    """Рейтинг: ORDER BY total_volume DESC (базы, созданные до появления индекса в модели)."""
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_user_totals_total_volume ON user_totals (total_volume)"
+    )
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "beer_entries.photo_file_id nullable", _make_photo_file_id_nullable),
+    Migration(2, "index beer_entries (user_id, submitted_at)", _add_beer_entries_user_history_index),
+    Migration(3, "index beer_entries (submitted_at)", _add_beer_entries_submitted_at_index),
+    Migration(4, "index user_totals (total_volume)", _add_user_totals_ranking_index),
+]
+
+
+def _ensure_schema_table(connection: Connection) -> None:
+    connection.exec_driver_sql(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def applied_versions(engine: Engine) -> Set[int]:
+    """Returns the versions recorded in schema_migrations."""
+    with engine.begin() as connection:
+        _ensure_schema_table(connection)
+        return {row[0] for row in connection.exec_driver_sql(f"SELECT version FROM {SCHEMA_TABLE}")}
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    """Returns migrations that have not been applied yet, in version order."""
+    applied = applied_versions(engine)
+    return [migration for migration in sorted(MIGRATIONS) if migration.version not in applied]
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """
+    Применяет все непримененные миграции по порядку версий.
+
+    Returns:
+        List[int]: Версии, примененные при этом запуске
+    """
+    applied_now = []
+    for migration in pending_migrations(engine):
+        logger.info(f"Applying migration {migration.version}: {migration.description}")
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            connection.exec_driver_sql(
+                f"INSERT INTO {SCHEMA_TABLE} (version, description) VALUES (?, ?)",
+                (migration.version, migration.description),
+            )
+        applied_now.append(migration.version)
+    if applied_now:
+        logger.info(f"Applied migrations: {applied_now}")
+    return applied_now
+
+
+# Запросы, которые должны идти по индексу: (название, SQL, ожидаемый индекс)
+QUERY_PLAN_EXPECTATIONS: List[Tuple[str, str, str]] = [
+    (
+        "user history",
+        "SELECT id, volume_liters, submitted_at FROM beer_entries WHERE user_id = 1 ORDER BY submitted_at, id",
+        "ix_beer_entries_user_id_submitted_at",
+    ),
+    (
+        "user total recalculation",
+        "SELECT sum(volume_liters), count(id), max(submitted_at) FROM beer_entries WHERE user_id = 1",
+        "ix_beer_entries_user_id_submitted_at",
+    ),
+    (
+        "time window",
+        "SELECT count(*), sum(volume_liters) FROM beer_entries WHERE submitted_at >= '2025-06-01'",
+        "ix_beer_entries_submitted_at",
+    ),
+    (
+        "leaderboard top",
+        "SELECT user_id, total_volume FROM user_totals ORDER BY total_volume DESC LIMIT 10",
+        "ix_user_totals_total_volume",
+    ),
+]
+
+
+def check_query_plans(engine: Engine) -> List[str]:
+    """
+    Проверяет через EXPLAIN QUERY PLAN, что ключевые запросы используют индексы.
+
+    Returns:
+        List[str]: Описания регрессий (полный просмотр таблицы, сортировка во
+        временном B-дереве или не тот индекс); пустой список, если все в порядке
+    """
+    problems = []
+    with engine.connect() as connection:
+        for name, sql, expected_index in QUERY_PLAN_EXPECTATIONS:
+            details = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+            plan = "; ".join(details)
+            if not any(expected_index in detail for detail in details):
+                problems.append(f"{name}: expected index {expected_index}, got plan: {plan}")
+            elif any("USE TEMP B-TREE" in detail for detail in details):
+                problems.append(f"{name}: sorts in a temporary B-tree: {plan}")
+    return problems
@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 """
 Скрипт для автоматического резервного копирования базы данных SQLite.
-Копирует файл базы данных и сохраняет его с меткой времени.
-Также позволяет восстановить базу данных из бэкапа.
+Копирует базу данных через SQLite backup API и сохраняет снимок в хранилище
+с дедупликацией блоков (backup_store.py): каждый снимок занимает место только
+под изменившиеся страницы.
+Копирование идет порциями страниц с паузами между ними, поэтому его можно
+выполнять на работающем боте (бот запускает его по расписанию).
+Также позволяет восстановить базу данных из бэкапа, в том числе на заданный
+момент времени: к ближайшему снимку применяется журнал изменений (change_journal.py).
 """
 import os
 import sys
-import shutil
+import time
 import sqlite3
 import argparse
-import datetime
 import glob
 import logging
 
+from backup_store import BackupStore, BackupStoreError
+from change_journal import change_journal, parse_timestamp, replay_journal, utc_now
+from database.database import DB_PATH
+
 # Настройка логирования
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
@@ -22,8 +30,21 @@ logger = logging.getLogger(__name__)
 
 # Пути к файлам и директориям
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(SCRIPT_DIR, 'beer_challenge.db')
-BACKUP_DIR = os.path.join(SCRIPT_DIR, 'backups')
+# Та же база, с которой работает бот (на Render.com — на постоянном диске)
+DB_FILE = DB_PATH
+BACKUP_DIR = os.environ.get("BACKUP_DIR", os.path.join(SCRIPT_DIR, 'backups'))
+# Снимки с дедупликацией блоков (см. backup_store.py)
+BACKUP_STORE_DIR = os.path.join(BACKUP_DIR, 'store')
+
+# Сколько последних снимков хранить; каждый следующий занимает место только под изменившиеся блоки
+BACKUP_RETENTION = int(os.environ.get("BACKUP_RETENTION", "48"))
+# Страниц за один шаг копирования и пауза между шагами, чтобы не задерживать запись бота
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE = float(os.environ.get("BACKUP_STEP_PAUSE", "0.005"))
+# Проверка копии: quick_check (быстрая, без проверки индексов) или integrity_check (полная)
+BACKUP_CHECK = os.environ.get("BACKUP_CHECK", "quick_check")
+if BACKUP_CHECK not in ("quick_check", "integrity_check"):
+    raise ValueError(f"BACKUP_CHECK must be quick_check or integrity_check, got {BACKUP_CHECK!r}")
 
 def setup_backup_dir():
     """Создаёт директорию для резервных копий, если она не существует."""
@@ -31,8 +52,56 @@ def setup_backup_dir():
         os.makedirs(BACKUP_DIR)
         logger.info(f"Создана директория для резервных копий: {BACKUP_DIR}")
 
-def create_backup():
-    """Создаёт резервную копию базы данных с текущей датой и временем."""
+def _copy_database(source_path, target_path, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE, check=BACKUP_CHECK):
+    """
+    Копирует базу данных через SQLite backup API порциями по pages страниц.
+
+    Между порциями поток засыпает на pause секунд, освобождая базу для записи.
+    Копия сначала пишется во временный файл и переименовывается только после
+    успешной проверки, поэтому в папке бэкапов не бывает недописанных файлов.
+
+    Returns:
+        tuple: (число скопированных страниц, длительность в секундах)
+    """
+    started = time.perf_counter()
+    tmp_path = target_path + '.tmp'
+    total_pages = 0
+
+    def progress(_status, remaining, total):
+        nonlocal total_pages
+        total_pages = total
+        if remaining and pause:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(tmp_path)
+    try:
+        # Открытая транзакция чтения фиксирует снимок базы: в режиме WAL бот продолжает
+        # писать, а копирование не начинается заново после каждой его записи
+        source.execute("BEGIN")
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=progress)
+        source.execute("COMMIT")
+        # Проверяем копию, а не рабочую базу: проверка не блокирует бота
+        check_result = target.execute(f"PRAGMA {check}").fetchone()[0]
+        if check_result != "ok":
+            raise sqlite3.DatabaseError(f"{check} failed: {check_result}")
+    except Exception:
+        target.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(tmp_path, target_path)
+    return total_pages, time.perf_counter() - started
+
+def _store():
+    return BackupStore(BACKUP_STORE_DIR)
+
+def create_backup(label="beer_challenge"):
+    """Создаёт снимок базы данных в хранилище резервных копий."""
     setup_backup_dir()
     
     # Проверяем, существует ли файл базы данных
@@ -40,89 +109,203 @@ def create_backup():
         logger.error(f"Файл базы данных не найден: {DB_FILE}")
         return False
     
-    # Создаём имя файла резервной копии с текущей датой и временем
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(BACKUP_DIR, f"beer_challenge_{timestamp}.db")
+    # Согласованная копия снимается во временный файл, затем режется на блоки
+    tmp_copy = os.path.join(BACKUP_DIR, f".{label}_{os.getpid()}.db")
     
     try:
-        # Перед копированием проверяем целостность базы данных
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA integrity_check")
-        integrity_result = cursor.fetchone()[0]
-        conn.close()
-        
-        if integrity_result != "ok":
-            logger.error(f"База данных повреждена: {integrity_result}")
-            return False
-        
-        # Копируем файл базы данных
-        shutil.copy2(DB_FILE, backup_file)
-        logger.info(f"Создана резервная копия: {backup_file}")
+        started = time.perf_counter()
+        # Позиция журнала читается до копирования: все записи с меньшим seq уже есть в копии,
+        # а более поздние при восстановлении на момент времени применяются повторно без вреда
+        journal_position = {"journal_seq": change_journal.last_seq, "taken_at": utc_now()}
+        pages, copy_duration = _copy_database(DB_FILE, tmp_copy)
+        manifest = _store().create_snapshot(tmp_copy, label=label, metadata=journal_position)
+        duration = time.perf_counter() - started
+        logger.info(f"Создана резервная копия: {manifest['id']}")
+        logger.info(
+            f"Backup metrics: duration={duration * 1000:.0f}ms copy={copy_duration * 1000:.0f}ms "
+            f"size={manifest['size'] / 1024:.1f}KB stored={manifest['new_bytes'] / 1024:.1f}KB "
+            f"pages={pages} new_chunks={manifest['new_chunks']}/{len(manifest['chunks'])}"
+        )
         
-        # Удаляем старые резервные копии (оставляем только 10 последних)
+        # Удаляем старые снимки (оставляем только BACKUP_RETENTION последних)
         cleanup_old_backups()
         
         return True
     except Exception as e:
         logger.error(f"Ошибка при создании резервной копии: {e}")
         return False
+    finally:
+        if os.path.exists(tmp_copy):
+            os.remove(tmp_copy)
 
 def list_backups():
-    """Выводит список доступных резервных копий."""
-    setup_backup_dir()
+    """Выводит список доступных снимков, читая только их манифесты."""
+    snapshots = _store().list_snapshots()
     
-    backup_files = sorted(glob.glob(os.path.join(BACKUP_DIR, "beer_challenge_*.db")))
-    
-    if not backup_files:
+    if not snapshots:
         logger.info("Резервные копии не найдены.")
         return []
     
     logger.info("Доступные резервные копии:")
-    for i, file in enumerate(backup_files, 1):
-        filename = os.path.basename(file)
-        size = os.path.getsize(file) / 1024  # размер в КБ
-        logger.info(f"{i}. {filename} ({size:.2f} КБ)")
+    for i, manifest in enumerate(snapshots, 1):
+        size = manifest['size'] / 1024  # размер в КБ
+        stored = manifest['new_bytes'] / 1024
+        logger.info(f"{i}. {manifest['id']} ({size:.2f} КБ, новых данных {stored:.2f} КБ)")
     
-    return backup_files
+    return snapshots
 
-def restore_backup(backup_file):
-    """Восстанавливает базу данных из указанной резервной копии."""
-    if not os.path.exists(backup_file):
-        logger.error(f"Файл резервной копии не найден: {backup_file}")
+def _restore_from_file(backup_file, restored_seq=None, description=None):
+    """
+    Проверяет файл базы данных и восстанавливает из него рабочую базу.
+
+    Args:
+        backup_file (str): Файл базы данных
+        restored_seq (int, optional): Последняя запись журнала, отраженная в файле;
+            None, если неизвестна (полная копия без журнала)
+        description (str, optional): Источник восстановления для журнала
+    """
+    # Проверяем целостность резервной копии
+    conn = sqlite3.connect(backup_file)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA integrity_check")
+    integrity_result = cursor.fetchone()[0]
+    conn.close()
+    
+    if integrity_result != "ok":
+        logger.error(f"Резервная копия повреждена: {integrity_result}")
         return False
     
-    try:
-        # Проверяем целостность резервной копии
-        conn = sqlite3.connect(backup_file)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA integrity_check")
-        integrity_result = cursor.fetchone()[0]
-        conn.close()
-        
-        if integrity_result != "ok":
-            logger.error(f"Резервная копия повреждена: {integrity_result}")
+    # Создаем снимок текущей БД перед восстановлением
+    if os.path.exists(DB_FILE):
+        if not create_backup(label="pre_restore"):
+            logger.error("Не удалось сохранить текущую БД перед восстановлением")
             return False
+    
+    # Восстанавливаем из резервной копии через backup API: запись идет через SQLite,
+    # поэтому WAL-файл рабочей базы остается согласованным с восстановленными данными
+    source = sqlite3.connect(backup_file)
+    target = sqlite3.connect(DB_FILE)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+    # Отмененные записи журнала уходят в архив, а снимок восстановленного состояния
+    # становится отправной точкой для следующих восстановлений на момент времени
+    change_journal.mark_restored(restored_seq, description or backup_file)
+    if not create_backup(label="post_restore"):
+        logger.warning("Не удалось создать снимок восстановленной базы")
+    return True
+
+def restore_backup(backup):
+    """
+    Восстанавливает базу данных из снимка хранилища или из файла полной копии.
+
+    Args:
+        backup (str): Идентификатор снимка (см. --list) или путь к файлу .db
+    """
+    try:
+        if os.path.isfile(backup):
+            # Полные копии, созданные до появления хранилища снимков
+            restored = _restore_from_file(backup)
+        else:
+            setup_backup_dir()
+            # Снимок потоково собирается из блоков во временный файл
+            assembled = os.path.join(BACKUP_DIR, f".restore_{os.getpid()}.db")
+            try:
+                store = _store()
+                manifest = store.get_snapshot(backup)
+                store.export_snapshot(backup, assembled)
+                restored = _restore_from_file(assembled, manifest.get('journal_seq'), backup)
+            finally:
+                if os.path.exists(assembled):
+                    os.remove(assembled)
         
-        # Создаем резервную копию текущей БД перед восстановлением
-        current_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        current_backup = os.path.join(BACKUP_DIR, f"pre_restore_{current_timestamp}.db")
-        
-        if os.path.exists(DB_FILE):
-            shutil.copy2(DB_FILE, current_backup)
-            logger.info(f"Создана резервная копия текущей БД: {current_backup}")
-        
-        # Восстанавливаем из резервной копии
-        shutil.copy2(backup_file, DB_FILE)
-        logger.info(f"База данных восстановлена из: {backup_file}")
-        
-        return True
-    except Exception as e:
+        if restored:
+            logger.info(f"База данных восстановлена из: {backup}")
+        return restored
+    except (BackupStoreError, OSError, sqlite3.Error) as e:
         logger.error(f"Ошибка при восстановлении базы данных: {e}")
         return False
 
-def cleanup_old_backups(keep=10):
-    """Удаляет старые резервные копии, оставляя только указанное количество последних."""
+def restore_to(moment):
+    """
+    Восстанавливает базу данных на заданный момент времени.
+
+    Берет последний снимок, сделанный не позже этого момента, и применяет к нему
+    записи журнала изменений вплоть до указанного времени.
+
+    Args:
+        moment (str): Время в формате ISO 8601 (без часового пояса — местное время)
+    """
+    try:
+        until_ts = parse_timestamp(moment)
+    except ValueError:
+        logger.error(f"Неверный формат времени: {moment}")
+        return False
+
+    store = _store()
+    # После предыдущего восстановления годятся только снимки новой ветки истории
+    marker = change_journal.last_restore_marker(until_ts)
+    candidates = [
+        manifest for manifest in store.list_snapshots()
+        if manifest.get('journal_seq') is not None and manifest['taken_at'] <= until_ts
+        and (marker is None or manifest['journal_seq'] >= marker['seq'])
+    ]
+    if not candidates:
+        logger.error(f"Нет снимка с журналом изменений, сделанного до {until_ts}")
+        return False
+    base = max(candidates, key=lambda manifest: manifest['journal_seq'])
+
+    setup_backup_dir()
+    assembled = os.path.join(BACKUP_DIR, f".restore_{os.getpid()}.db")
+    try:
+        started = time.perf_counter()
+        store.export_snapshot(base['id'], assembled)
+        last_seq = base['journal_seq']
+
+        def records():
+            nonlocal last_seq
+            for record in change_journal.read(after_seq=base['journal_seq'], until_ts=until_ts):
+                last_seq = record['seq']
+                yield record
+
+        conn = sqlite3.connect(assembled, isolation_level=None)
+        try:
+            applied = replay_journal(conn, records())
+        finally:
+            conn.close()
+        logger.info(
+            f"Replayed {applied} journal records on top of {base['id']} "
+            f"(seq {base['journal_seq']}..{last_seq}) in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        restored = _restore_from_file(assembled, last_seq, f"{base['id']} + journal до {until_ts}")
+        if restored:
+            logger.info(f"База данных восстановлена на момент {until_ts}")
+        return restored
+    except (BackupStoreError, OSError, ValueError, KeyError, sqlite3.Error) as e:
+        logger.error(f"Ошибка при восстановлении базы данных на момент времени: {e}")
+        return False
+    finally:
+        if os.path.exists(assembled):
+            os.remove(assembled)
+
+def latest_backup():
+    """Возвращает идентификатор последнего снимка (без снимков перед восстановлением)."""
+    snapshots = [manifest for manifest in _store().list_snapshots() if not manifest['id'].startswith('pre_restore')]
+    return snapshots[-1]['id'] if snapshots else None
+
+def cleanup_old_backups(keep=BACKUP_RETENTION):
+    """Удаляет старые снимки и полные копии, оставляя только указанное количество последних."""
+    store = _store()
+    store.prune(keep)
+    
+    # Записи журнала, которые есть во всех оставшихся снимках, для восстановления не нужны
+    journal_positions = [manifest['journal_seq'] for manifest in store.list_snapshots() if 'journal_seq' in manifest]
+    if journal_positions:
+        change_journal.compact(min(journal_positions))
+    
     backup_files = sorted(glob.glob(os.path.join(BACKUP_DIR, "beer_challenge_*.db")))
     
     if len(backup_files) <= keep:
@@ -141,8 +324,10 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--backup', action='store_true', help='Создать резервную копию базы данных')
     group.add_argument('--list', action='store_true', help='Показать список доступных резервных копий')
-    group.add_argument('--restore', metavar='BACKUP_FILE', help='Восстановить базу данных из указанной резервной копии')
+    group.add_argument('--restore', metavar='BACKUP', help='Восстановить базу данных из снимка (ID из --list) или файла .db')
     group.add_argument('--restore-latest', action='store_true', help='Восстановить из последней резервной копии')
+    group.add_argument('--restore-to', metavar='TIME',
+                       help='Восстановить базу данных на момент времени (ISO 8601, например "2025-06-01 18:30")')
     
     args = parser.parse_args()
     
@@ -166,17 +351,23 @@ def main():
             sys.exit(1)
     
     elif args.restore_latest:
-        backup_files = sorted(glob.glob(os.path.join(BACKUP_DIR, "beer_challenge_*.db")))
+        snapshot_id = latest_backup()
         
-        if not backup_files:
+        if not snapshot_id:
             print("Резервные копии не найдены.")
             sys.exit(1)
         
-        latest_backup = backup_files[-1]
-        if restore_backup(latest_backup):
-            print(f"База данных успешно восстановлена из последней копии: {latest_backup}.")
+        if restore_backup(snapshot_id):
+            print(f"База данных успешно восстановлена из последней копии: {snapshot_id}.")
+        else:
+            print(f"Не удалось восстановить базу данных из {snapshot_id}.")
+            sys.exit(1)
+    
+    elif args.restore_to:
+        if restore_to(args.restore_to):
+            print(f"База данных успешно восстановлена на момент {args.restore_to}.")
         else:
-            print(f"Не удалось восстановить базу данных из {latest_backup}.")
+            print(f"Не удалось восстановить базу данных на момент {args.restore_to}.")
             sys.exit(1)
 
 if __name__ == "__main__":
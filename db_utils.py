@@ -1,10 +1,17 @@
 # db_utils.py
+import asyncio
+import contextvars
+import functools
 import logging
 import os
 import sys
-from typing import Optional, List, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional, List, Tuple, TypeVar
+from datetime import datetime, timezone
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import bindparam, func, desc, delete, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 # Добавляем обработку различных путей импорта для повышения надежности
 try:
@@ -18,33 +25,115 @@ except ImportError:
         # Последняя попытка с относительным импортом
         from .database.database import SessionLocal
 
-from models import User, BeerEntry
+from models import User, BeerEntry, UserTotal, MediaFileCache, PersistentData
+from leaderboard_index import leaderboard_index
+from tracing import record_span
+from change_journal import (
+    OP_ENTRIES_REPLACED, OP_ENTRY_ADDED, OP_ENTRY_DELETED, OP_USER, OP_USER_DELETED,
+    change_journal, timestamp_text,
+)
 
 logger = logging.getLogger(__name__)
 
-def get_db():
-    """Dependency to get a database session."""
-    db = SessionLocal()
+T = TypeVar("T")
+
+# Допустимое расхождение агрегата с суммой записей (погрешность сложения float)
+TOTALS_TOLERANCE = 1e-6
+
+# Количество потоков для работы с БД. SQLite допускает только одного писателя,
+# поэтому по умолчанию все запросы выполняются последовательно в одном потоке,
+# а event loop бота остается свободным для обработки других обновлений.
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "1"))
+
+# Сколько ID передавать в одном условии IN при массовом импорте
+IMPORT_DELETE_CHUNK = 500
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+def _call_with_session(fn: Callable[..., T], args: tuple, kwargs: dict) -> T:
+    """Opens a session, runs fn(db, *args, **kwargs) and always closes the session."""
+    with SessionLocal() as db:
+        return fn(db, *args, **kwargs)
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Выполняет синхронную функцию работы с БД в отдельном потоке, не блокируя event loop.
+
+    Функция получает новую сессию первым аргументом, сессия закрывается после выполнения:
+
+        total = await run_db(get_user_total_volume, user.id)
+
+    Args:
+        fn: Функция вида fn(db, *args, **kwargs)
+
+    Returns:
+        Результат fn. ORM-объекты в результате отсоединены от сессии,
+        поэтому возвращать лучше простые значения.
+    """
+    loop = asyncio.get_running_loop()
+    # Поток БД получает копию контекста, чтобы SQL-запросы попали в трассу обновления
+    context = contextvars.copy_context()
+    started = time.perf_counter()
+    error = None
     try:
-        yield db
+        return await loop.run_in_executor(
+            _db_executor, context.run, functools.partial(_call_with_session, fn, args, kwargs)
+        )
+    except Exception as e:
+        error = type(e).__name__
+        raise
     finally:
-        db.close()
+        # Отрезок включает ожидание свободного потока БД
+        record_span("db", getattr(fn, "__name__", repr(fn)), started, time.perf_counter() - started, error)
 
-def add_or_update_user(db: Session, user_id: int, first_name: Optional[str], username: Optional[str]) -> User:
-    """Adds a new user or updates existing user's info."""
+def pending_db_jobs() -> int:
+    """Returns the number of database jobs waiting for a worker thread."""
+    return _db_executor._work_queue.qsize()
+
+def shutdown_db_executor() -> None:
+    """Waits for pending database jobs and stops the worker threads."""
+    _db_executor.shutdown(wait=True)
+
+def _journal(op: str, **data: Any) -> None:
+    """
+    Записывает уже закоммиченное изменение в журнал для восстановления на момент времени.
+
+    Ошибка журнала не отменяет запись в БД: она логируется, а следующий
+    снимок базы все равно содержит изменение.
+    """
+    try:
+        change_journal.append(op, **data)
+    except Exception as e:
+        logger.error(f"Failed to journal {op} {data}: {e}")
+
+def _stage_user(db: Session, user_id: int, first_name: Optional[str], username: Optional[str]) -> Tuple[User, bool]:
+    """Adds or updates the user row in the session without committing; returns (user, changed)."""
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user:
         # Update info if changed
-        if db_user.first_name != first_name or db_user.username != username:
-            db_user.first_name = first_name
-            db_user.username = username
-            logger.info(f"Updated user info for {user_id}")
+        if db_user.first_name == first_name and db_user.username == username:
+            return db_user, False
+        db_user.first_name = first_name
+        db_user.username = username
+        logger.info(f"Updated user info for {user_id}")
     else:
         db_user = User(id=user_id, first_name=first_name, username=username)
         db.add(db_user)
         logger.info(f"Added new user: {user_id} ({username or first_name}) ")
+    return db_user, True
+
+def _user_committed(db_user: User, changed: bool) -> None:
+    """Обновляет индекс рейтинга и журнал после коммита данных пользователя."""
+    leaderboard_index.set_names(db_user.id, db_user.first_name, db_user.username)
+    if changed:
+        _journal(OP_USER, user_id=db_user.id, first_name=db_user.first_name, username=db_user.username)
+
+def add_or_update_user(db: Session, user_id: int, first_name: Optional[str], username: Optional[str]) -> User:
+    """Adds a new user or updates existing user's info."""
+    db_user, changed = _stage_user(db, user_id, first_name, username)
     db.commit()
     db.refresh(db_user)
+    _user_committed(db_user, changed)
     return db_user
 
 def add_beer_entry(db: Session, user_id: int, volume: float, photo_id: str = None) -> BeerEntry:
@@ -67,24 +156,207 @@ def add_beer_entry(db: Session, user_id: int, volume: float, photo_id: str = Non
     #     # Handle this case appropriately, maybe raise an error or return None
     #     return None
 
+    db_entry, new_total = _stage_beer_entry(db, user_id, volume, photo_id)
+    db.commit()
+    _entry_committed(db, db_entry, new_total)
+    return db_entry
+
+def _stage_beer_entry(db: Session, user_id: int, volume: float, photo_id: Optional[str]) -> Tuple[BeerEntry, float]:
+    """Adds the entry and its increment of user_totals to the session without committing; returns (entry, new total)."""
     db_entry = BeerEntry(user_id=user_id, volume_liters=volume, photo_file_id=photo_id)
     db.add(db_entry)
-    db.commit()
+    # Строка пользователя и запись должны попасть в базу раньше агрегата (внешний ключ)
+    db.flush()
+    return db_entry, _add_to_user_total(db, user_id, volume)
+
+def _entry_committed(db: Session, db_entry: BeerEntry, new_total: float) -> None:
+    """Обновляет индекс рейтинга и журнал после коммита новой записи."""
+    leaderboard_index.update(db_entry.user_id, new_total)
     db.refresh(db_entry)
-    logger.info(f"Added beer entry for user {user_id}: {volume}L, photo: {photo_id}")
-    return db_entry
+    logger.info(f"Added beer entry for user {db_entry.user_id}: {db_entry.volume_liters}L, photo: {db_entry.photo_file_id}")
+    _journal(
+        OP_ENTRY_ADDED, entry_id=db_entry.id, user_id=db_entry.user_id, volume=db_entry.volume_liters,
+        photo_file_id=db_entry.photo_file_id, submitted_at=timestamp_text(db_entry.submitted_at),
+    )
+
+def _add_to_user_total(db: Session, user_id: int, volume: float) -> float:
+    """
+    Adds a single new entry to the user's aggregate row (creating it if needed) and returns the new total.
+
+    Прибавление выполняется одним UPSERT в базе, а не чтением и записью из Python,
+    поэтому одновременные заявки одного пользователя из разных потоков БД не
+    затирают приращения друг друга.
+    """
+    table = UserTotal.__table__
+    stmt = sqlite_insert(table).values(
+        user_id=user_id, total_volume=volume, entry_count=1,
+        # То же значение по умолчанию, что и у beer_entries.submitted_at
+        last_submitted_at=func.now(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={
+            "total_volume": table.c.total_volume + stmt.excluded.total_volume,
+            "entry_count": table.c.entry_count + 1,
+            "last_submitted_at": stmt.excluded.last_submitted_at,
+        },
+    ).returning(table.c.total_volume)
+    new_total = db.execute(stmt).scalar_one()
+    # Загруженный в сессию объект UserTotal (если есть) больше не совпадает с базой
+    cached = db.identity_map.get(db.identity_key(UserTotal, user_id))
+    if cached is not None:
+        db.expire(cached)
+    return new_total
+
+def _recalculate_user_total(db: Session, user_id: int) -> Optional[float]:
+    """
+    Recomputes the aggregate row of one user from beer_entries (used by admin edits).
+
+    Returns the new total or None if the user has no entries left.
+    """
+    db.flush()
+    total_volume, entry_count, last_submitted_at = (
+        db.query(
+            func.coalesce(func.sum(BeerEntry.volume_liters), 0.0),
+            func.count(BeerEntry.id),
+            func.max(BeerEntry.submitted_at),
+        )
+        .filter(BeerEntry.user_id == user_id)
+        .one()
+    )
+    totals = db.get(UserTotal, user_id)
+    if entry_count == 0:
+        if totals is not None:
+            db.delete(totals)
+        return None
+    if totals is None:
+        totals = UserTotal(user_id=user_id)
+        db.add(totals)
+    totals.total_volume = total_volume
+    totals.entry_count = entry_count
+    totals.last_submitted_at = last_submitted_at
+    return total_volume
+
+def _sync_leaderboard_index(user_id: int, total_volume: Optional[float]) -> None:
+    """Mirrors a committed total into the in-memory ranking."""
+    if total_volume is None:
+        leaderboard_index.remove(user_id)
+    else:
+        leaderboard_index.update(user_id, total_volume)
+
+def rebuild_user_totals(db: Session) -> int:
+    """
+    Пересчитывает таблицу user_totals целиком по beer_entries.
+
+    Returns:
+        int: Количество пользователей с записями
+    """
+    db.query(UserTotal).delete()
+    aggregated = (
+        db.query(
+            BeerEntry.user_id,
+            func.sum(BeerEntry.volume_liters),
+            func.count(BeerEntry.id),
+            func.max(BeerEntry.submitted_at),
+        )
+        .group_by(BeerEntry.user_id)
+        .all()
+    )
+    db.add_all(
+        UserTotal(user_id=user_id, total_volume=total, entry_count=count, last_submitted_at=last)
+        for user_id, total, count, last in aggregated
+    )
+    db.commit()
+    logger.info(f"Rebuilt user_totals for {len(aggregated)} users")
+    warm_leaderboard_index(db)
+    return len(aggregated)
+
+def verify_user_totals(db: Session) -> List[Tuple[int, float, float, int, int]]:
+    """
+    Сравнивает user_totals с фактическими суммами по beer_entries.
+
+    Returns:
+        List[Tuple[int, float, float, int, int]]: Расхождения в виде
+        (user_id, сохраненный объем, фактический объем, сохраненное число записей, фактическое число записей)
+    """
+    actual = {
+        user_id: (total, count)
+        for user_id, total, count in (
+            db.query(BeerEntry.user_id, func.sum(BeerEntry.volume_liters), func.count(BeerEntry.id))
+            .group_by(BeerEntry.user_id)
+            .all()
+        )
+    }
+    stored = {
+        user_id: (total, count)
+        for user_id, total, count in db.query(UserTotal.user_id, UserTotal.total_volume, UserTotal.entry_count).all()
+    }
+    drift = []
+    for user_id in actual.keys() | stored.keys():
+        stored_total, stored_count = stored.get(user_id, (0.0, 0))
+        actual_total, actual_count = actual.get(user_id, (0.0, 0))
+        if abs(stored_total - actual_total) > TOTALS_TOLERANCE or stored_count != actual_count:
+            drift.append((user_id, stored_total, actual_total, stored_count, actual_count))
+    return sorted(drift)
+
+def ensure_user_totals() -> None:
+    """Fills user_totals on the first start after the table was introduced."""
+    with SessionLocal() as db:
+        if db.query(UserTotal.user_id).first() is None and db.query(BeerEntry.id).first() is not None:
+            logger.info("user_totals is empty, building it from beer_entries...")
+            rebuild_user_totals(db)
+
+def warm_leaderboard_index(db: Session) -> int:
+    """
+    Загружает индекс рейтинга из users и user_totals.
+
+    Returns:
+        int: Количество участников в рейтинге
+    """
+    rows = (
+        db.query(User.id, User.first_name, User.username, UserTotal.total_volume)
+        .outerjoin(UserTotal, User.id == UserTotal.user_id)
+        .all()
+    )
+    leaderboard_index.load(rows)
+    return len(leaderboard_index)
+
+def verify_leaderboard_index(db: Session) -> List[Tuple[int, Optional[float], Optional[float]]]:
+    """
+    Сравнивает индекс рейтинга в памяти с таблицей user_totals.
+
+    Returns:
+        List[Tuple[int, Optional[float], Optional[float]]]: Расхождения (user_id, в индексе, в БД)
+    """
+    stored = dict(db.query(UserTotal.user_id, UserTotal.total_volume).all())
+    indexed = leaderboard_index.snapshot()
+    drift = []
+    for user_id in stored.keys() | indexed.keys():
+        in_index = indexed.get(user_id)
+        in_db = stored.get(user_id)
+        if in_index is None or in_db is None or abs(in_index - in_db) > TOTALS_TOLERANCE:
+            drift.append((user_id, in_index, in_db))
+    return sorted(drift)
+
+def check_leaderboard_index(db: Session) -> int:
+    """Verifies the in-memory ranking and reloads it on drift. Returns the number of mismatches."""
+    drift = verify_leaderboard_index(db)
+    if drift:
+        logger.warning(f"Leaderboard index drifted from user_totals for {len(drift)} users, reloading: {drift[:10]}")
+        warm_leaderboard_index(db)
+    return len(drift)
 
 def get_leaderboard(db: Session, limit: int = 10) -> List[Tuple[Optional[str], Optional[str], float]]:
     """Gets the leaderboard data (top users by total volume), returning first_name, username, and volume."""
+    # Читаем готовые суммы из user_totals по индексу total_volume вместо GROUP BY по всем записям
     results = (
         db.query(
             User.first_name,
             User.username, # Add username
-            func.sum(BeerEntry.volume_liters).label('total_volume')
+            UserTotal.total_volume,
         )
-        .join(BeerEntry, User.id == BeerEntry.user_id)
-        .group_by(User.id, User.first_name, User.username) # Group by username as well
-        .order_by(desc('total_volume'))
+        .join(UserTotal, User.id == UserTotal.user_id)
+        .order_by(desc(UserTotal.total_volume))
         .limit(limit)
         .all()
     )
@@ -104,8 +376,266 @@ def get_user_total_volume(db: Session, user_id: int) -> float:
         float: Общий объем выпитого пива в литрах
     """
     result = (
-        db.query(func.sum(BeerEntry.volume_liters).label('total_volume'))
-        .filter(BeerEntry.user_id == user_id)
+        db.query(UserTotal.total_volume)
+        .filter(UserTotal.user_id == user_id)
         .scalar()
     )
-    return result or 0.0  # Возвращаем 0, если у пользователя еще нет записей
\ No newline at end of file
+    return result or 0.0  # Возвращаем 0, если у пользователя еще нет записей
+
+def record_submission(db: Session, user_id: int, first_name: Optional[str], username: Optional[str],
+                      volume: float, photo_id: Optional[str]) -> Tuple[float, float]:
+    """
+    Сохраняет новую заявку пользователя: обновляет данные пользователя и добавляет запись о пиве.
+
+    Returns:
+        Tuple[float, float]: Общий объем до и после добавления записи
+    """
+    # Пользователь, запись и агрегат сохраняются одной транзакцией
+    db_user, user_changed = _stage_user(db, user_id, first_name, username)
+    db_entry, new_volume = _stage_beer_entry(db, user_id, volume, photo_id)
+    db.commit()
+    _user_committed(db_user, user_changed)
+    _entry_committed(db, db_entry, new_volume)
+    # Объем до заявки выводится из результата UPSERT, а не из отдельного чтения,
+    # чтобы одновременная заявка того же пользователя не попала между ними
+    return new_volume - volume, new_volume
+
+def get_user_entries(db: Session, user_id: int) -> List[Tuple[int, float, Any]]:
+    """Returns (entry_id, volume_liters, submitted_at) for all entries of a user."""
+    return [
+        (entry_id, volume, submitted_at)
+        for entry_id, volume, submitted_at in (
+            db.query(BeerEntry.id, BeerEntry.volume_liters, BeerEntry.submitted_at)
+            .filter(BeerEntry.user_id == user_id)
+            # Порядок совпадает с индексом (user_id, submitted_at), сортировка не нужна
+            .order_by(BeerEntry.submitted_at, BeerEntry.id)
+            .all()
+        )
+    ]
+
+def set_user_total_volume(db: Session, user_id: int, volume: float) -> bool:
+    """
+    Заменяет все записи пользователя одной записью с указанным объемом (ручная правка админом).
+
+    Returns:
+        bool: False, если пользователь не найден
+    """
+    if not db.query(User.id).filter(User.id == user_id).first():
+        return False
+    db.query(BeerEntry).filter(BeerEntry.user_id == user_id).delete()
+    db_entry = BeerEntry(user_id=user_id, volume_liters=volume, photo_file_id="manual_admin")
+    db.add(db_entry)
+    new_total = _recalculate_user_total(db, user_id)
+    db.commit()
+    _sync_leaderboard_index(user_id, new_total)
+    _journal(
+        OP_ENTRIES_REPLACED, photo_file_id=db_entry.photo_file_id, submitted_at=timestamp_text(db_entry.submitted_at),
+        entries=[{"entry_id": db_entry.id, "user_id": user_id, "volume": volume}],
+    )
+    return True
+
+def delete_beer_entry(db: Session, entry_id: int) -> bool:
+    """Deletes a single beer entry. Returns False if it did not exist."""
+    user_id = db.query(BeerEntry.user_id).filter(BeerEntry.id == entry_id).scalar()
+    if user_id is None:
+        return False
+    db.query(BeerEntry).filter(BeerEntry.id == entry_id).delete()
+    new_total = _recalculate_user_total(db, user_id)
+    db.commit()
+    _sync_leaderboard_index(user_id, new_total)
+    _journal(OP_ENTRY_DELETED, entry_id=entry_id)
+    return True
+
+def delete_user(db: Session, user_id: int) -> Tuple[int, int]:
+    """
+    Удаляет пользователя и все его записи о пиве.
+
+    Returns:
+        Tuple[int, int]: Количество удаленных пользователей и записей
+    """
+    db.query(UserTotal).filter(UserTotal.user_id == user_id).delete()
+    deleted_entries = db.query(BeerEntry).filter(BeerEntry.user_id == user_id).delete()
+    deleted_user = db.query(User).filter(User.id == user_id).delete()
+    db.commit()
+    leaderboard_index.remove(user_id, forget_name=True)
+    if deleted_user or deleted_entries:
+        _journal(OP_USER_DELETED, user_id=user_id)
+    return deleted_user, deleted_entries
+
+def _chunked(values: List[int], size: int) -> Iterable[List[int]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def bulk_import_users(db: Session, rows: Iterable[Tuple[int, str, Optional[str], float]]) -> int:
+    """
+    Импортирует участников одной транзакцией.
+
+    Пользователи добавляются или обновляются через INSERT ... ON CONFLICT,
+    их записи заменяются одной импортированной записью с указанным объемом,
+    а user_totals заполняется теми же значениями. При любой ошибке
+    (например, занятый другим участником ник) откатывается весь импорт.
+
+    Args:
+        db (Session): Сессия базы данных
+        rows: Кортежи (user_id, first_name, username, volume) с уникальными user_id
+
+    Returns:
+        int: Количество импортированных участников
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    user_ids = [user_id for user_id, _first_name, _username, _volume in rows]
+    imported_at = datetime.now(timezone.utc)
+
+    try:
+        user_upsert = sqlite_insert(User)
+        db.execute(
+            user_upsert.on_conflict_do_update(
+                index_elements=[User.id],
+                set_={"first_name": user_upsert.excluded.first_name, "username": user_upsert.excluded.username},
+            ),
+            [
+                {"id": user_id, "first_name": first_name, "username": username}
+                for user_id, first_name, username, _volume in rows
+            ],
+        )
+        # Ограничиваем число параметров в одном IN (...)
+        for chunk in _chunked(user_ids, IMPORT_DELETE_CHUNK):
+            db.execute(delete(BeerEntry).where(BeerEntry.user_id.in_(chunk)))
+        db.execute(
+            insert(BeerEntry),
+            [
+                {"user_id": user_id, "volume_liters": volume, "photo_file_id": "imported_by_admin", "submitted_at": imported_at}
+                for user_id, _first_name, _username, volume in rows
+            ],
+        )
+        # ID новых записей нужны журналу, чтобы восстановление воспроизвело их точно
+        entry_ids = {}
+        for chunk in _chunked(user_ids, IMPORT_DELETE_CHUNK):
+            entry_ids.update(
+                (user_id, entry_id)
+                for entry_id, user_id in db.query(BeerEntry.id, BeerEntry.user_id).filter(BeerEntry.user_id.in_(chunk))
+            )
+        totals_upsert = sqlite_insert(UserTotal)
+        db.execute(
+            totals_upsert.on_conflict_do_update(
+                index_elements=[UserTotal.user_id],
+                set_={
+                    "total_volume": totals_upsert.excluded.total_volume,
+                    "entry_count": totals_upsert.excluded.entry_count,
+                    "last_submitted_at": totals_upsert.excluded.last_submitted_at,
+                },
+            ),
+            [
+                {"user_id": user_id, "total_volume": volume, "entry_count": 1, "last_submitted_at": imported_at}
+                for user_id, _first_name, _username, volume in rows
+            ],
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    logger.info(f"Bulk imported {len(rows)} users")
+    _journal(
+        OP_ENTRIES_REPLACED, photo_file_id="imported_by_admin", submitted_at=timestamp_text(imported_at),
+        users=[
+            {"user_id": user_id, "first_name": first_name, "username": username}
+            for user_id, first_name, username, _volume in rows
+        ],
+        entries=[
+            {"entry_id": entry_ids[user_id], "user_id": user_id, "volume": volume}
+            for user_id, _first_name, _username, volume in rows
+        ],
+    )
+    # Перезагрузка индекса целиком дешевле тысяч отдельных обновлений
+    warm_leaderboard_index(db)
+    return len(rows)
+
+def get_contest_stats(db: Session) -> Tuple[int, float]:
+    """Returns the number of participants and the total volume of the contest."""
+    total_participants = db.query(func.count(User.id)).scalar() or 0
+    total_volume = db.query(func.sum(UserTotal.total_volume)).scalar() or 0.0
+    return total_participants, total_volume
+
+def get_cached_file_ids(db: Session) -> dict:
+    """Returns {asset_key: (content_hash, file_id)} for all uploaded assets."""
+    return {
+        asset_key: (content_hash, file_id)
+        for asset_key, content_hash, file_id in db.query(
+            MediaFileCache.asset_key, MediaFileCache.content_hash, MediaFileCache.file_id
+        ).all()
+    }
+
+def store_file_id(db: Session, asset_key: str, content_hash: str, file_id: str) -> None:
+    """Saves the Telegram file_id of an uploaded asset together with its content hash."""
+    cached = db.get(MediaFileCache, asset_key)
+    if cached is None:
+        db.add(MediaFileCache(asset_key=asset_key, content_hash=content_hash, file_id=file_id))
+    else:
+        cached.content_hash = content_hash
+        cached.file_id = file_id
+    db.commit()
+
+def forget_file_id(db: Session, asset_key: str) -> None:
+    """Removes a cached file_id (e.g. when Telegram rejects it)."""
+    db.query(MediaFileCache).filter(MediaFileCache.asset_key == asset_key).delete()
+    db.commit()
+
+def load_persistent_data(db: Session, namespace: str, key: Optional[str] = None) -> dict:
+    """Returns {key: JSON text} for the namespace, or only the given key if it is set."""
+    query = db.query(PersistentData.key, PersistentData.data).filter(PersistentData.namespace == namespace)
+    if key is not None:
+        query = query.filter(PersistentData.key == key)
+    return dict(query.all())
+
+def store_persistent_data(db: Session, rows: Iterable[Tuple[str, str, Optional[str]]],
+                          touched: Iterable[Tuple[str, str]] = ()) -> int:
+    """
+    Записывает изменения persistence одной транзакцией.
+
+    Args:
+        rows: Кортежи (namespace, key, JSON text); None вместо текста удаляет ключ
+        touched: Ключи (namespace, key) без изменений, у которых продлевается только updated_at
+
+    Returns:
+        int: Количество записанных, удаленных и продленных ключей
+    """
+    upserts = []
+    deletes = []
+    for namespace, key, data in rows:
+        if data is None:
+            deletes.append((namespace, key))
+        else:
+            upserts.append({"namespace": namespace, "key": key, "data": data})
+    if upserts:
+        stmt = sqlite_insert(PersistentData)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PersistentData.namespace, PersistentData.key],
+            set_={"data": stmt.excluded.data, "updated_at": func.now()},
+        )
+        db.execute(stmt, upserts)
+    for namespace, key in deletes:
+        db.query(PersistentData).filter(
+            PersistentData.namespace == namespace, PersistentData.key == key
+        ).delete(synchronize_session=False)
+    touched = list(touched)
+    if touched:
+        table = PersistentData.__table__
+        db.execute(
+            update(table)
+            .where(table.c.namespace == bindparam("touched_namespace"), table.c.key == bindparam("touched_key"))
+            .values(updated_at=func.now()),
+            [{"touched_namespace": namespace, "touched_key": key} for namespace, key in touched],
+        )
+    db.commit()
+    return len(upserts) + len(deletes) + len(touched)
+
+def purge_persistent_data(db: Session, namespace: str, older_than: datetime) -> int:
+    """Deletes keys of the namespace last written or touched before older_than (naive UTC)."""
+    deleted = db.query(PersistentData).filter(
+        PersistentData.namespace == namespace, PersistentData.updated_at < older_than
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -3,7 +3,7 @@
 
 import os
 import logging
-from handlers.achievements import get_achievement_for_volume, check_new_achievement, format_achievement_message
+from handlers.achievements import get_achievement_for_volume, check_new_achievement, get_crossed_achievements, format_achievement_message
 
 # Настройка логирования
 logging.basicConfig(
@@ -50,6 +50,10 @@ def test_achievements():
         else:
             logger.info("  Нет нового достижения")
         
+        # Все пересеченные пороги (бот объявляет каждый из них)
+        crossed = get_crossed_achievements(old_volume, new_volume)
+        logger.info(f"  Пересеченные пороги: {[a['volume'] for a in crossed] or 'нет'}")
+        
         # Проверяем, есть ли новое достижение
         achievement = check_new_achievement(old_volume, new_volume)
         if achievement:
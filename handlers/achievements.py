@@ -1,10 +1,22 @@
 # handlers/achievements.py
 """Модуль для работы с достижениями пивного челленджа."""
+import bisect
+import hashlib
+import json
+import logging
 import os
 
+from asset_optimizer import optimized_path
+
+logger = logging.getLogger(__name__)
+
 # Путь к папке с изображениями достижений
 ASSETS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'assets')
 
+# Необязательный JSON-файл с определениями достижений в том же формате, что и список ниже
+# (пути к изображениям указываются относительно папки assets)
+ACHIEVEMENTS_FILE = os.environ.get("ACHIEVEMENTS_FILE")
+
 # Список достижений по объему выпитого пива (в литрах)
 ACHIEVEMENTS = [
     {
@@ -72,9 +84,58 @@ ACHIEVEMENTS = [
     }
 ]
 
+def _definitions_fingerprint(achievements):
+    """Возвращает отпечаток видимых полей достижений для инвалидации кешей."""
+    digest = hashlib.sha1()
+    for achievement in achievements:
+        digest.update(f"{achievement['volume']}|{achievement['title']}|{achievement['icon']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+# Отсортированные пороги достижений для поиска делением пополам; строятся в load_achievements()
+_THRESHOLDS = []
+_ACHIEVEMENTS_VERSION = None
+
+def load_achievements(definitions=None):
+    """
+    Загружает определения достижений в индекс порогов.
+
+    Args:
+        definitions (list, optional): Список словарей достижений. По умолчанию берется
+            файл ACHIEVEMENTS_FILE, если он задан, иначе встроенный список.
+
+    Returns:
+        list: Достижения, отсортированные по возрастанию порога
+    """
+    global _THRESHOLDS, _ACHIEVEMENTS_VERSION
+
+    if definitions is None and ACHIEVEMENTS_FILE:
+        with open(ACHIEVEMENTS_FILE, encoding="utf-8") as definitions_file:
+            definitions = json.load(definitions_file)
+        for achievement in definitions:
+            achievement["image"] = os.path.join(ASSETS_PATH, achievement["image"])
+        logger.info(f"Loaded {len(definitions)} achievements from {ACHIEVEMENTS_FILE}")
+
+    if definitions is not None:
+        # Список меняется на месте, чтобы ссылки из других модулей оставались актуальными
+        ACHIEVEMENTS[:] = definitions
+    ACHIEVEMENTS.sort(key=lambda achievement: achievement["volume"])
+
+    _THRESHOLDS = [achievement["volume"] for achievement in ACHIEVEMENTS]
+    _ACHIEVEMENTS_VERSION = _definitions_fingerprint(ACHIEVEMENTS)
+    return ACHIEVEMENTS
+
+def achievements_version():
+    """
+    Возвращает версию определений достижений.
+
+    Версия меняется при изменении порогов, названий или иконок и
+    используется как часть ключа кеша таблицы лидеров.
+    """
+    return _ACHIEVEMENTS_VERSION
+
 def get_achievement_for_volume(total_volume):
     """
-    Возвращает достижение для указанного объема пива.
+    Возвращает достижение для указанного объема пива за O(log k).
     
     Args:
         total_volume (float): Общий объем выпитого пива
@@ -82,18 +143,24 @@ def get_achievement_for_volume(total_volume):
     Returns:
         dict or None: Словарь с информацией о достижении или None, если достижение не найдено
     """
-    current_achievement = None
-    
-    # Находим самое высокое достижение, которое соответствует объему
-    for achievement in ACHIEVEMENTS:
-        if total_volume >= achievement["volume"]:
-            current_achievement = achievement
-        else:
-            # Список отсортирован по возрастанию объема, 
-            # так что можно прервать цикл, когда находим объем больше текущего
-            break
+    # Количество порогов, не превышающих объем, равно индексу следующего за текущим достижения
+    position = bisect.bisect_right(_THRESHOLDS, total_volume)
+    return ACHIEVEMENTS[position - 1] if position else None
+
+def get_crossed_achievements(old_volume, new_volume):
+    """
+    Возвращает все достижения, пороги которых пересечены при росте объема.
     
-    return current_achievement
+    Args:
+        old_volume (float): Старый общий объем выпитого пива
+        new_volume (float): Новый общий объем выпитого пива
+        
+    Returns:
+        list: Новые достижения по возрастанию порога (пустой список, если их нет)
+    """
+    start = bisect.bisect_right(_THRESHOLDS, old_volume)
+    end = bisect.bisect_right(_THRESHOLDS, new_volume)
+    return ACHIEVEMENTS[start:end]
 
 def check_new_achievement(old_volume, new_volume):
     """
@@ -104,16 +171,20 @@ def check_new_achievement(old_volume, new_volume):
         new_volume (float): Новый общий объем выпитого пива
         
     Returns:
-        dict or None: Словарь с информацией о новом достижении или None, если нет нового достижения
+        dict or None: Самое высокое из новых достижений или None, если нового достижения нет
     """
-    old_achievement = get_achievement_for_volume(old_volume)
-    new_achievement = get_achievement_for_volume(new_volume)
-    
-    # Если достижение изменилось, значит получено новое
-    if new_achievement and (not old_achievement or old_achievement["volume"] < new_achievement["volume"]):
-        return new_achievement
-    
-    return None
+    crossed = get_crossed_achievements(old_volume, new_volume)
+    return crossed[-1] if crossed else None
+
+def get_achievement_image(achievement):
+    """
+    Возвращает путь к изображению достижения для отправки.
+
+    Если при запуске уже подготовлен оптимизированный вариант (см. asset_optimizer.py),
+    возвращается он, иначе исходный файл из assets.
+    """
+    image_path = achievement.get("image", "")
+    return optimized_path(image_path) if image_path else image_path
 
 def format_achievement_message(achievement, username):
     """
@@ -129,4 +200,6 @@ def format_achievement_message(achievement, username):
     return (f"🏆 НОВОЕ ДОСТИЖЕНИЕ! 🏆\n\n"
             f"{username} достиг(ла) звания «{achievement['title']}»!\n"
             f"{achievement['message']}\n\n"
-            f"Объем выпитого пива: {achievement['volume']}+ литров") 
\ No newline at end of file
+            f"Объем выпитого пива: {achievement['volume']}+ литров") 
+
+load_achievements()
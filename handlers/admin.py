@@ -1,11 +1,20 @@
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler, ConversationHandler, MessageHandler, filters
-from db_utils import get_db, get_leaderboard, add_or_update_user
-from models import User, BeerEntry
+from db_utils import (
+    run_db,
+    get_user_entries,
+    set_user_total_volume,
+    delete_beer_entry,
+    delete_user,
+    bulk_import_users,
+)
+from admin_reports import build_user_report, chunk_lines, get_user_with_total
+from user_import import ImportParseResult, parse_text_payload, parse_csv_stream
+from tracing import SLOW_UPDATE_THRESHOLD, slow_updates
+from user_session import CONVERSATION_TIMEOUT, UserSession
+import io
 import os
-from sqlalchemy import func
-import re
 
 # Добавляем логгер
 logger = logging.getLogger(__name__)
@@ -15,7 +24,40 @@ AWAITING_PASSWORD, AWAITING_USER_ID, AWAITING_NEW_VOLUME, AWAITING_SUBMISSION_US
 AWAITING_ENTRY_ACTION, AWAITING_ACTION_CHOICE, AWAITING_USER_LIST = range(4, 7)
 AWAITING_DELETE_USER_ID, AWAITING_DELETE_CONFIRMATION = range(7, 9)
 
-admin_ids = set()  # Временное хранение id админов
+admin_ids = set()  # id админов, вошедших по паролю; сохраняется в bot_data
+# Ключ bot_data, под которым список админов переживает перезапуск
+ADMIN_IDS_KEY = "admin_ids"
+
+# Сколько успешно импортированных участников перечислять в отчете
+MAX_LISTED_IMPORTS = 50
+# Telegram позволяет ботам скачивать файлы размером до 20 МБ
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+# Сколько медленных обновлений показывать в /slow_updates по умолчанию и максимум
+DEFAULT_SLOW_UPDATES = 5
+MAX_SLOW_UPDATES = 20
+
+def _format_user_row(row) -> str:
+    user_id, first_name, _username, total_volume = row
+    return f"ID: {user_id}, Имя: {first_name}, Объем: {total_volume:.2f} л"
+
+def _format_user_row_short(row) -> str:
+    user_id, first_name, _username, total_volume = row
+    return f"ID: {user_id}, {first_name} - {total_volume:.2f} л"
+
+def _format_user_row_with_username(row) -> str:
+    user_id, first_name, username, total_volume = row
+    username_display = f"@{username}" if username else "нет"
+    return f"ID: {user_id}, Имя: {first_name}, Ник: {username_display}, Объем: {total_volume:.2f} л"
+
+async def _reply_chunks(update: Update, chunks) -> None:
+    """Отправляет отчет, уже разбитый на сообщения по границам строк."""
+    for chunk in chunks:
+        await update.message.reply_text(chunk)
+
+def restore_admin_sessions(bot_data: dict) -> int:
+    """Восстанавливает вход администраторов из сохраненного bot_data после перезапуска."""
+    admin_ids.update(bot_data.get(ADMIN_IDS_KEY, ()))
+    return len(admin_ids)
 
 async def admin_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Введите пароль администратора:")
@@ -24,7 +66,8 @@ async def admin_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def check_admin_password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.text == ADMIN_PASSWORD:
         admin_ids.add(update.effective_user.id)
-        await update.message.reply_text("Режим администратора активирован.\nДоступные команды:\n/change_leaderboard — изменить объем участника\n/check_submission — посмотреть фото участника\n/delete_user — удалить участника\n/list_users — показать список участников")
+        context.bot_data[ADMIN_IDS_KEY] = sorted(admin_ids)
+        await update.message.reply_text("Режим администратора активирован.\nДоступные команды:\n/change_leaderboard — изменить объем участника\n/check_submission — посмотреть фото участника\n/delete_user — удалить участника\n/list_users — показать список участников\n/slow_updates — медленные обновления")
         return ConversationHandler.END
     await update.message.reply_text("Неверный пароль. Попробуйте снова или /cancel.")
     return AWAITING_PASSWORD
@@ -35,7 +78,8 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f"Admin {user.first_name} ({user.id}) canceled the conversation via command.")
     
     # Очищаем все временные данные пользователя
-    context.user_data.clear()
+    session: UserSession = context.user_data
+    session.clear()
     
     await update.message.reply_text("Операция отменена.")
     return ConversationHandler.END
@@ -43,21 +87,13 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Fetches and sends a list of users to the admin for selection."""
     try:
-        with next(get_db()) as db:
-            users = db.query(User).all()
+        chunks = await run_db(build_user_report, _format_user_row, "Список участников:")
 
-        if not users:
+        if not chunks:
             await update.message.reply_text("Список участников пуст.")
             return ConversationHandler.END
 
-        user_list_text = "Список участников:\n"
-        for user in users:
-            # Fetch the total beer volume for each user
-            with next(get_db()) as db:
-                total_volume = db.query(BeerEntry).filter(BeerEntry.user_id == user.id).with_entities(func.sum(BeerEntry.volume_liters)).scalar()
-            user_list_text += f"ID: {user.id}, Имя: {user.first_name}, Объем: {total_volume:.2f} л\n"
-
-        await update.message.reply_text(user_list_text)
+        await _reply_chunks(update, chunks)
         return AWAITING_USER_ID
 
     except Exception as e:
@@ -73,23 +109,18 @@ async def change_leaderboard_entry(update: Update, context: ContextTypes.DEFAULT
     return AWAITING_USER_ID
 
 async def receive_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data['target_user_id'] = update.message.text
+    context.user_data.target_user_id = update.message.text
     await update.message.reply_text("Введите новый общий объем пива (литры):")
     return AWAITING_NEW_VOLUME
 
 async def receive_new_volume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = context.user_data.get('target_user_id')
+    user_id = context.user_data.target_user_id
     try:
         new_volume = float(update.message.text)
-        with next(get_db()) as db:
-            user = db.query(User).filter(User.id == int(user_id)).first()
-            if not user:
-                await update.message.reply_text("Пользователь не найден.")
-                return ConversationHandler.END
-            # Удаляем старые записи и создаём одну новую
-            db.query(BeerEntry).filter(BeerEntry.user_id == int(user_id)).delete()
-            db.add(BeerEntry(user_id=int(user_id), volume_liters=new_volume, photo_file_id="manual_admin"))
-            db.commit()
+        # Удаляем старые записи и создаём одну новую
+        if not await run_db(set_user_total_volume, int(user_id), new_volume):
+            await update.message.reply_text("Пользователь не найден.")
+            return ConversationHandler.END
         await update.message.reply_text(f"Объем для пользователя {user_id} обновлен: {new_volume} л")
     except Exception as e:
         await update.message.reply_text(f"Ошибка: {e}")
@@ -101,43 +132,42 @@ async def check_submission_entry(update: Update, context: ContextTypes.DEFAULT_T
         return ConversationHandler.END
 
     # Fetch and display the list of users with their beer volumes
-    with next(get_db()) as db:
-        users = db.query(User).all()
-        if not users:
-            await update.message.reply_text("Нет зарегистрированных участников.")
-            return ConversationHandler.END
-
-        user_list_text = "Список участников:\n"
-        for user in users:
-            total_volume = sum(entry.volume_liters for entry in user.beer_entries)
-            user_list_text += f"ID: {user.id}, {user.first_name} - {total_volume:.2f} л\n"
+    chunks = await run_db(
+        build_user_report,
+        _format_user_row_short,
+        "Список участников:",
+        "Введите ID пользователя для просмотра его заявок:",
+    )
+    if not chunks:
+        await update.message.reply_text("Нет зарегистрированных участников.")
+        return ConversationHandler.END
 
-        await update.message.reply_text(user_list_text + "\nВведите ID пользователя для просмотра его заявок:")
+    await _reply_chunks(update, chunks)
 
     return AWAITING_SUBMISSION_USER
 
 async def show_user_photos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.message.text
-    with next(get_db()) as db:
-        entries = db.query(BeerEntry).filter(BeerEntry.user_id == int(user_id)).all()
-        if not entries:
-            await update.message.reply_text("Нет записей для этого пользователя.")
-            return ConversationHandler.END
-        entry_list_text = "Выберите запись для изменения или удаления:\n"
-        for index, entry in enumerate(entries, start=1):
-            entry_list_text += f"{index}. {entry.volume_liters} л, {entry.submitted_at}\n"
-        context.user_data['entries'] = entries
-        await update.message.reply_text(entry_list_text + "\nВведите номер записи:")
+    entries = await run_db(get_user_entries, int(user_id))
+    if not entries:
+        await update.message.reply_text("Нет записей для этого пользователя.")
+        return ConversationHandler.END
+    entry_list_text = "Выберите запись для изменения или удаления:\n"
+    for index, (_entry_id, volume, submitted_at) in enumerate(entries, start=1):
+        entry_list_text += f"{index}. {volume} л, {submitted_at}\n"
+    # Храним только ID записей, ORM-объекты после закрытия сессии использовать нельзя
+    context.user_data.entries = tuple(entry_id for entry_id, _volume, _submitted_at in entries)
+    await update.message.reply_text(entry_list_text + "\nВведите номер записи:")
     return AWAITING_ENTRY_ACTION
 
 async def handle_entry_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         entry_index = int(update.message.text) - 1
-        entries = context.user_data.get('entries')
+        entries = context.user_data.entries
         if entries is None or entry_index < 0 or entry_index >= len(entries):
             await update.message.reply_text("Неверный номер записи.")
             return AWAITING_ENTRY_ACTION
-        context.user_data['selected_entry'] = entries[entry_index]
+        context.user_data.selected_entry = entries[entry_index]
         await update.message.reply_text("Введите 'изменить' для изменения или 'удалить' для удаления записи:")
     except ValueError:
         await update.message.reply_text("Пожалуйста, введите корректный номер.")
@@ -145,14 +175,12 @@ async def handle_entry_action(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def update_or_delete_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     action = update.message.text.lower()
-    entry = context.user_data.get('selected_entry')
+    entry = context.user_data.selected_entry
     if action == 'изменить':
         await update.message.reply_text("Введите новый объем пива (литры):")
         return AWAITING_NEW_VOLUME
     elif action == 'удалить':
-        with next(get_db()) as db:
-            db.delete(entry)
-            db.commit()
+        await run_db(delete_beer_entry, entry)
         await update.message.reply_text("Запись удалена.")
     else:
         await update.message.reply_text("Неверный выбор. Пожалуйста, введите 'изменить' или 'удалить'.")
@@ -170,77 +198,69 @@ async def import_users_entry(update: Update, context: ContextTypes.DEFAULT_TYPE)
         "ID: 123456789, Имя: Имя_участника, Ник: @username, Объем: X.XX л\n"
         "ID: 987654321, Имя: Другой_участник, Ник: нет, Объем: Y.YY л\n\n"
         "Каждый участник должен быть на отдельной строке.\n"
-        "Поле 'Ник:' обязательно, если нет ника - укажите 'нет'"
+        "Поле 'Ник:' обязательно, если нет ника - укажите 'нет'\n\n"
+        "Можно также отправить CSV/TSV-файл с колонками: id, имя, ник, объем"
     )
     return AWAITING_USER_LIST
 
-async def receive_user_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обрабатывает полученный список пользователей и добавляет их в базу данных."""
-    user_list_text = update.message.text
-    user_lines = user_list_text.strip().split('\n')
-    
-    successful_imports = 0
-    failed_imports = 0
+async def _import_parsed(update: Update, parsed: ImportParseResult) -> int:
+    """Записывает разобранный список одной транзакцией и отправляет отчет."""
+    if parsed.errors:
+        # Импорт либо сохраняет весь список, либо ничего: при ошибках разбора база не меняется
+        header = (
+            f"❌ Импорт отменен, ничего не сохранено: ошибок в списке — {len(parsed.errors)}.\n"
+            "Исправьте строки и отправьте список заново или введите /cancel.\n\nОшибки:"
+        )
+        await _reply_chunks(update, chunk_lines(parsed.errors, header))
+        return AWAITING_USER_LIST
+
+    rows = list(parsed.rows.values())
+    if not rows:
+        await update.message.reply_text("Список пуст, ничего не импортировано.")
+        return AWAITING_USER_LIST
+
+    try:
+        successful_imports = await run_db(bulk_import_users, rows)
+    except Exception as e:
+        # Транзакция откатывается целиком, ни одна строка не сохраняется
+        logger.error(f"Bulk import of {len(rows)} users failed: {e}", exc_info=True)
+        await update.message.reply_text(f"❌ Импорт отменен, изменения не сохранены: {e}")
+        return ConversationHandler.END
+
     results = []
+    for user_id, name, username, volume in rows[:MAX_LISTED_IMPORTS]:
+        username_display = f"@{username}" if username else "нет"
+        results.append(f"✅ ID: {user_id}, Имя: {name}, Ник: {username_display}, Объем: {volume:.2f} л")
+    if len(rows) > MAX_LISTED_IMPORTS:
+        results.append(f"✅ ...и еще {len(rows) - MAX_LISTED_IMPORTS} участников")
+
+    # Формируем отчет; Telegram ограничивает длину сообщения, поэтому он режется по строкам
+    header = f"Импорт завершен.\n✅ Успешно: {successful_imports}\n\nРезультаты:"
+    await _reply_chunks(update, chunk_lines(results, header))
     
-    # Регулярное выражение для извлечения данных из строки с поддержкой обоих форматов
-    pattern = r'ID:\s*(\d+),\s*Имя:\s*([^,]+),\s*Ник:\s*([^,]+),\s*Объем:\s*(\d+\.?\d*)\s*л'
-    
-    for line in user_lines:
-        match = re.search(pattern, line)
-        if match:
-            user_id, name, username_raw, volume = match.groups()
-            
-            try:
-                user_id = int(user_id)
-                volume = float(volume)
-                
-                # Обрабатываем username
-                username = None
-                if username_raw.strip().lower() not in ['нет', 'no', '-', '']:
-                    # Убираем @ если есть, и очищаем пробелы
-                    username = username_raw.strip().lstrip('@')
-                    if username:  # Проверяем что не пустая строка
-                        username = username
-                    else:
-                        username = None
-                
-                with next(get_db()) as db:
-                    # Добавляем или обновляем пользователя
-                    add_or_update_user(db, user_id=user_id, first_name=name.strip(), username=username)
-                    
-                    # Удаляем существующие записи о пиве для этого пользователя
-                    db.query(BeerEntry).filter(BeerEntry.user_id == user_id).delete()
-                    
-                    # Добавляем новую запись с указанным объемом
-                    db.add(BeerEntry(user_id=user_id, volume_liters=volume, photo_file_id="imported_by_admin"))
-                    db.commit()
-                
-                # Форматируем результат
-                username_display = f"@{username}" if username else "нет"
-                results.append(f"✅ ID: {user_id}, Имя: {name.strip()}, Ник: {username_display}, Объем: {volume:.2f} л")
-                successful_imports += 1
-            
-            except Exception as e:
-                results.append(f"❌ Ошибка в строке '{line}': {str(e)}")
-                failed_imports += 1
-        else:
-            results.append(f"❌ Неверный формат строки: '{line}'")
-            failed_imports += 1
-    
-    # Формируем отчет
-    report = f"Импорт завершен.\n✅ Успешно: {successful_imports}\n❌ Ошибок: {failed_imports}\n\nРезультаты:\n"
-    report += "\n".join(results)
+    return ConversationHandler.END
+
+async def receive_user_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обрабатывает полученный список пользователей и добавляет их в базу данных."""
+    # Сначала разбираем весь список; записывается он одной транзакцией и только без ошибок
+    parsed = parse_text_payload(update.message.text)
+    return await _import_parsed(update, parsed)
+
+async def receive_user_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Импортирует участников из CSV/TSV-файла, отправленного документом."""
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text("Файл слишком большой: бот может скачать не более 20 МБ.")
+        return AWAITING_USER_LIST
     
-    if len(report) > 4096:  # Telegram ограничивает длину сообщения
-        # Отправляем результаты частями
-        chunks = [report[i:i+4000] for i in range(0, len(report), 4000)]
-        for i, chunk in enumerate(chunks):
-            await update.message.reply_text(f"Часть {i+1}/{len(chunks)}:\n{chunk}")
-    else:
-        await update.message.reply_text(report)
+    buffer = io.BytesIO()
+    telegram_file = await document.get_file()
+    await telegram_file.download_to_memory(buffer)
+    buffer.seek(0)
+    logger.info(f"Received import file {document.file_name} ({buffer.getbuffer().nbytes} bytes)")
     
-    return ConversationHandler.END
+    parsed = parse_csv_stream(buffer)
+    return await _import_parsed(update, parsed)
 
 async def delete_user_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Запускает процесс удаления пользователя."""
@@ -250,21 +270,18 @@ async def delete_user_entry(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     # Показываем список всех пользователей
     try:
-        with next(get_db()) as db:
-            users = db.query(User).all()
-
-        if not users:
+        chunks = await run_db(
+            build_user_report,
+            _format_user_row,
+            "Список участников для удаления:",
+            "Введите ID пользователя для удаления:",
+        )
+
+        if not chunks:
             await update.message.reply_text("Список участников пуст.")
             return ConversationHandler.END
 
-        user_list_text = "Список участников для удаления:\n"
-        for user in users:
-            # Получаем общий объем пива для каждого пользователя
-            with next(get_db()) as db:
-                total_volume = db.query(BeerEntry).filter(BeerEntry.user_id == user.id).with_entities(func.sum(BeerEntry.volume_liters)).scalar() or 0
-            user_list_text += f"ID: {user.id}, Имя: {user.first_name}, Объем: {total_volume:.2f} л\n"
-
-        await update.message.reply_text(user_list_text + "\nВведите ID пользователя для удаления:")
+        await _reply_chunks(update, chunks)
         return AWAITING_DELETE_USER_ID
 
     except Exception as e:
@@ -280,31 +297,29 @@ async def receive_delete_user_id(update: Update, context: ContextTypes.DEFAULT_T
         user_id = int(user_id)
         
         # Проверяем, существует ли пользователь
-        with next(get_db()) as db:
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                await update.message.reply_text("Пользователь с таким ID не найден. Попробуйте еще раз или /cancel для отмены.")
-                return AWAITING_DELETE_USER_ID
-            
-            # Получаем общий объем пива
-            total_volume = db.query(BeerEntry).filter(BeerEntry.user_id == user_id).with_entities(func.sum(BeerEntry.volume_liters)).scalar() or 0
-            
-            # Сохраняем данные пользователя для удаления
-            context.user_data['delete_user_id'] = user_id
-            context.user_data['delete_user_name'] = user.first_name
-            context.user_data['delete_user_volume'] = total_volume
-            
-            await update.message.reply_text(
-                f"❗️ ВНИМАНИЕ ❗️\n\n"
-                f"Вы собираетесь удалить участника:\n"
-                f"ID: {user_id}\n"
-                f"Имя: {user.first_name}\n"
-                f"Общий объем: {total_volume:.2f} л\n\n"
-                f"Это действие удалит пользователя и ВСЕ его записи о пиве из базы данных!\n"
-                f"Это действие НЕОБРАТИМО!\n\n"
-                f"Введите 'УДАЛИТЬ' (заглавными буквами) для подтверждения или /cancel для отмены:"
-            )
-            return AWAITING_DELETE_CONFIRMATION
+        user_info = await run_db(get_user_with_total, user_id)
+        if not user_info:
+            await update.message.reply_text("Пользователь с таким ID не найден. Попробуйте еще раз или /cancel для отмены.")
+            return AWAITING_DELETE_USER_ID
+        _user_id, first_name, _username, total_volume = user_info
+        
+        # Сохраняем данные пользователя для удаления
+        session: UserSession = context.user_data
+        session.delete_user_id = user_id
+        session.delete_user_name = first_name
+        session.delete_user_volume = total_volume
+        
+        await update.message.reply_text(
+            f"❗️ ВНИМАНИЕ ❗️\n\n"
+            f"Вы собираетесь удалить участника:\n"
+            f"ID: {user_id}\n"
+            f"Имя: {first_name}\n"
+            f"Общий объем: {total_volume:.2f} л\n\n"
+            f"Это действие удалит пользователя и ВСЕ его записи о пиве из базы данных!\n"
+            f"Это действие НЕОБРАТИМО!\n\n"
+            f"Введите 'УДАЛИТЬ' (заглавными буквами) для подтверждения или /cancel для отмены:"
+        )
+        return AWAITING_DELETE_CONFIRMATION
             
     except ValueError:
         await update.message.reply_text("Неверный формат ID. Введите числовой ID или /cancel для отмены.")
@@ -323,45 +338,37 @@ async def confirm_delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
     
     # Получаем данные пользователя из контекста
-    user_id = context.user_data.get('delete_user_id')
-    user_name = context.user_data.get('delete_user_name')
-    user_volume = context.user_data.get('delete_user_volume')
+    session: UserSession = context.user_data
+    user_id = session.delete_user_id
+    user_name = session.delete_user_name
+    user_volume = session.delete_user_volume
     
     if not user_id:
         await update.message.reply_text("Ошибка: данные пользователя не найдены. Попробуйте снова.")
         return ConversationHandler.END
     
     try:
-        with next(get_db()) as db:
-            # Удаляем все записи о пиве пользователя
-            deleted_entries = db.query(BeerEntry).filter(BeerEntry.user_id == user_id).delete()
-            
-            # Удаляем самого пользователя
-            deleted_user = db.query(User).filter(User.id == user_id).delete()
-            
-            # Применяем изменения
-            db.commit()
-            
-            if deleted_user > 0:
-                await update.message.reply_text(
-                    f"✅ Участник успешно удален:\n"
-                    f"ID: {user_id}\n"
-                    f"Имя: {user_name}\n"
-                    f"Удалено записей о пиве: {deleted_entries}\n"
-                    f"Удаленный объем: {user_volume:.2f} л"
-                )
-                logger.info(f"Admin {update.effective_user.id} deleted user {user_id} ({user_name}) with {deleted_entries} beer entries")
-            else:
-                await update.message.reply_text("Пользователь не был найден (возможно, уже удален).")
+        # Удаляем все записи о пиве пользователя и самого пользователя
+        deleted_user, deleted_entries = await run_db(delete_user, user_id)
+        
+        if deleted_user > 0:
+            await update.message.reply_text(
+                f"✅ Участник успешно удален:\n"
+                f"ID: {user_id}\n"
+                f"Имя: {user_name}\n"
+                f"Удалено записей о пиве: {deleted_entries}\n"
+                f"Удаленный объем: {user_volume:.2f} л"
+            )
+            logger.info(f"Admin {update.effective_user.id} deleted user {user_id} ({user_name}) with {deleted_entries} beer entries")
+        else:
+            await update.message.reply_text("Пользователь не был найден (возможно, уже удален).")
                 
     except Exception as e:
         logger.error(f"Error deleting user {user_id}: {e}", exc_info=True)
         await update.message.reply_text("Произошла ошибка при удалении пользователя. Попробуйте позже.")
     
     # Очищаем временные данные
-    context.user_data.pop('delete_user_id', None)
-    context.user_data.pop('delete_user_name', None)
-    context.user_data.pop('delete_user_volume', None)
+    session.clear_delete_user()
     
     return ConversationHandler.END
 
@@ -372,37 +379,42 @@ async def list_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     try:
-        with next(get_db()) as db:
-            users = db.query(User).all()
+        # Отчет строится одним запросом и разбивается на части по границам строк
+        chunks = await run_db(build_user_report, _format_user_row_with_username, "Список участников:")
 
-        if not users:
+        if not chunks:
             await update.message.reply_text("Список участников пуст.")
             return
 
-        user_list_text = "Список участников:\n"
-        for user in users:
-            # Получаем общий объем пива для каждого пользователя
-            with next(get_db()) as db:
-                total_volume = db.query(BeerEntry).filter(BeerEntry.user_id == user.id).with_entities(func.sum(BeerEntry.volume_liters)).scalar() or 0
-            
-            # Форматируем строку с учетом наличия username
-            if user.username:
-                user_list_text += f"ID: {user.id}, Имя: {user.first_name}, Ник: @{user.username}, Объем: {total_volume:.2f} л\n"
-            else:
-                user_list_text += f"ID: {user.id}, Имя: {user.first_name}, Ник: нет, Объем: {total_volume:.2f} л\n"
-
-        # Разбиваем на части если текст слишком длинный для Telegram
-        if len(user_list_text) > 4096:
-            chunks = [user_list_text[i:i+4000] for i in range(0, len(user_list_text), 4000)]
-            for i, chunk in enumerate(chunks):
-                await update.message.reply_text(f"Часть {i+1}/{len(chunks)}:\n{chunk}")
-        else:
-            await update.message.reply_text(user_list_text)
+        await _reply_chunks(update, chunks)
 
     except Exception as e:
         logger.error(f"Error fetching users list: {e}", exc_info=True)
         await update.message.reply_text("Не удалось загрузить список участников. Попробуйте позже.")
 
+async def slow_updates_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает самые медленные из недавних обновлений с разбивкой по отрезкам: /slow_updates [N]."""
+    if update.effective_user.id not in admin_ids:
+        await update.message.reply_text("Нет доступа. Введите /admin для входа.")
+        return
+
+    limit = DEFAULT_SLOW_UPDATES
+    if context.args:
+        try:
+            limit = max(1, min(MAX_SLOW_UPDATES, int(context.args[0])))
+        except ValueError:
+            await update.message.reply_text("Использование: /slow_updates [N]")
+            return
+
+    traces = slow_updates.worst(limit)
+    if not traces:
+        await update.message.reply_text(f"Медленных обновлений (дольше {SLOW_UPDATE_THRESHOLD:g} с) не было.")
+        return
+
+    lines = [line for trace in traces for line in (trace.format() + "\n").splitlines()]
+    header = f"Самые медленные обновления ({len(traces)} из {len(slow_updates)}):"
+    await _reply_chunks(update, chunk_lines(lines, header))
+
 admin_conv_handler = ConversationHandler(
     entry_points=[CommandHandler("admin", admin_entry)],
     states={
@@ -412,7 +424,10 @@ admin_conv_handler = ConversationHandler(
     },
     fallbacks=[CommandHandler('cancel', cancel)],
     per_user=True, # Default, but explicit
-    per_chat=True  # Add this for better group chat handling
+    per_chat=True,  # Add this for better group chat handling
+    name="admin",
+    conversation_timeout=CONVERSATION_TIMEOUT,  # Брошенный диалог завершается (user_session.py)
+    persistent=True  # Состояние диалога переживает перезапуск (bot_persistence.py)
 )
 
 change_leaderboard_conv_handler = ConversationHandler(
@@ -423,7 +438,10 @@ change_leaderboard_conv_handler = ConversationHandler(
     },
     fallbacks=[CommandHandler('cancel', cancel)],
     per_user=True, # Default, but explicit
-    per_chat=True  # Add this for better group chat handling
+    per_chat=True,  # Add this for better group chat handling
+    name="change_leaderboard",
+    conversation_timeout=CONVERSATION_TIMEOUT,  # Брошенный диалог завершается (user_session.py)
+    persistent=True  # Состояние диалога переживает перезапуск (bot_persistence.py)
 )
 
 check_submission_conv_handler = ConversationHandler(
@@ -436,17 +454,26 @@ check_submission_conv_handler = ConversationHandler(
     },
     fallbacks=[CommandHandler('cancel', cancel)],
     per_user=True, # Default, but explicit
-    per_chat=True  # Add this for better group chat handling
+    per_chat=True,  # Add this for better group chat handling
+    name="check_submission",
+    conversation_timeout=CONVERSATION_TIMEOUT,  # Брошенный диалог завершается (user_session.py)
+    persistent=True  # Состояние диалога переживает перезапуск (bot_persistence.py)
 )
 
 import_users_conv_handler = ConversationHandler(
     entry_points=[CommandHandler("import_users", import_users_entry)],
     states={
-        AWAITING_USER_LIST: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_user_list)],
+        AWAITING_USER_LIST: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, receive_user_list),
+            MessageHandler(filters.Document.ALL, receive_user_document),
+        ],
     },
     fallbacks=[CommandHandler('cancel', cancel)],
     per_user=True,
-    per_chat=True
+    per_chat=True,
+    name="import_users",
+    conversation_timeout=CONVERSATION_TIMEOUT,  # Брошенный диалог завершается (user_session.py)
+    persistent=True  # Состояние диалога переживает перезапуск (bot_persistence.py)
 )
 
 delete_user_conv_handler = ConversationHandler(
@@ -457,5 +484,8 @@ delete_user_conv_handler = ConversationHandler(
     },
     fallbacks=[CommandHandler('cancel', cancel)],
     per_user=True,
-    per_chat=True
+    per_chat=True,
+    name="delete_user",
+    conversation_timeout=CONVERSATION_TIMEOUT,  # Брошенный диалог завершается (user_session.py)
+    persistent=True  # Состояние диалога переживает перезапуск (bot_persistence.py)
 )
\ No newline at end of file
@@ -2,7 +2,8 @@
 import logging
 import os
 from typing import Optional, List, Tuple
-from telegram import Update, Message, PhotoSize, InlineKeyboardButton, InlineKeyboardMarkup # Added InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Update, Message, PhotoSize, InlineKeyboardButton, InlineKeyboardMarkup # Added InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
 from telegram.ext import (
     ContextTypes,
     MessageHandler,
@@ -11,9 +12,13 @@ from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler, # Added CallbackQueryHandler
 )
-from db_utils import add_or_update_user, add_beer_entry, get_db, get_user_total_volume
+from db_utils import run_db, record_submission
 from config import GROUP_CHAT_ID  # Импортируем ID группового чата
-from handlers.achievements import check_new_achievement, format_achievement_message
+from handlers.achievements import get_crossed_achievements, format_achievement_message, get_achievement_image
+from media_cache import send_cached_photo
+from outbound_queue import outbound_queue, PRIORITY_ACHIEVEMENT, PRIORITY_SUBMISSION
+from submission_digest import submission_digest, PendingSubmission
+from user_session import CONVERSATION_TIMEOUT, UserSession
 
 # Enable logging
 logging.basicConfig(
@@ -24,6 +29,18 @@ logger = logging.getLogger(__name__)
 # Define conversation states
 AWAITING_VOLUME_CHOICE = 1 # Renamed state
 
+async def _delete_prompt(context: ContextTypes.DEFAULT_TYPE, session: UserSession, reason: str) -> None:
+    """Удаляет сообщение-подсказку «Отправь мне фото с пивом», если оно было сохранено."""
+    if session.prompt_message_id and session.prompt_chat_id:
+        try:
+            await context.bot.delete_message(
+                chat_id=session.prompt_chat_id,
+                message_id=session.prompt_message_id
+            )
+            logger.info(f"Deleted prompt message {reason}: {session.prompt_message_id} in chat {session.prompt_chat_id}")
+        except Exception as delete_error:
+            logger.error(f"Failed to delete prompt message {reason}: {delete_error}", exc_info=True)
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles incoming photos, stores file_id, and asks for volume via buttons."""
     message: Optional[Message] = update.message
@@ -39,11 +56,12 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     logger.info(f"Received photo from {user.first_name} ({user.id}). File ID: {photo_file_id}")
 
     # Store photo file_id for the next step
-    context.user_data['photo_file_id'] = photo_file_id
+    session: UserSession = context.user_data
+    session.photo_file_id = photo_file_id
     
     # Сохраняем ID и chat_id сообщения с фотографией для последующего удаления
-    context.user_data['original_message_id'] = message.message_id
-    context.user_data['original_chat_id'] = message.chat_id
+    session.original_message_id = message.message_id
+    session.original_chat_id = message.chat_id
     logger.info(f"Stored original message details: message_id={message.message_id}, chat_id={message.chat_id}")
 
     # Define the volume options
@@ -62,6 +80,51 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     return AWAITING_VOLUME_CHOICE # Transition to the state waiting for button press
 
+async def announce_achievement(context: ContextTypes.DEFAULT_TYPE, achievement: dict, username_display: str) -> None:
+    """Ставит в очередь сообщение и изображение о достижении для группового чата."""
+    achievement_message = format_achievement_message(achievement, username_display)
+    
+    # Отладка путей к изображениям
+    image_path = get_achievement_image(achievement)
+    logger.debug(f"Achievement image path: {image_path}")
+    logger.debug(f"Image exists: {os.path.exists(image_path) if image_path else 'N/A'}")
+    
+    # Отправляем сообщение и изображение о достижении только в групповой чат
+    if not GROUP_CHAT_ID:
+        logger.warning("GROUP_CHAT_ID not set, cannot send achievement notification")
+        return
+    
+    async def send_achievement(bot: Bot) -> None:
+        # Проверяем, существует ли файл изображения
+        if image_path and os.path.exists(image_path):
+            logger.info(f"Sending achievement with image: {image_path}")
+            try:
+                # Повторные отправки используют сохраненный file_id вместо загрузки файла
+                await send_cached_photo(
+                    bot,
+                    GROUP_CHAT_ID,
+                    image_path,
+                    caption=achievement_message
+                )
+                logger.info(f"Achievement notification sent to group chat: {GROUP_CHAT_ID}")
+                return
+            except RetryAfter:
+                # Ограничение частоты обрабатывает очередь, повторив отправку позже
+                raise
+            except Exception as e:
+                logger.error(f"Failed to send achievement image to group chat: {e}", exc_info=True)
+                logger.info("Trying to send fallback text-only achievement notification")
+        else:
+            logger.warning(f"Achievement image not found: {image_path}, sending text only")
+        # Если файла нет или изображение отправить не удалось, отправляем только текст
+        await bot.send_message(
+            chat_id=GROUP_CHAT_ID,
+            text=achievement_message
+        )
+        logger.info(f"Text-only achievement notification sent to group chat: {GROUP_CHAT_ID}")
+
+    outbound_queue.enqueue(GROUP_CHAT_ID, send_achievement, PRIORITY_ACHIEVEMENT, f"achievement '{achievement['title']}'")
+
 async def handle_volume_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the volume button press, saves the entry, and ends the conversation."""
     query = update.callback_query
@@ -69,36 +132,15 @@ async def handle_volume_choice(update: Update, context: ContextTypes.DEFAULT_TYP
 
     user = query.from_user
     volume_data = query.data
-    photo_file_id = context.user_data.get('photo_file_id')
+    session: UserSession = context.user_data
+    photo_file_id = session.photo_file_id
 
     if volume_data == 'cancel_volume':
         logger.info(f"User {user.first_name} ({user.id}) canceled volume selection.")
         
         # Удаляем сообщение-подсказку при отмене
-        prompt_message_id = context.user_data.get('prompt_message_id')
-        prompt_chat_id = context.user_data.get('prompt_chat_id')
-        
-        if prompt_message_id and prompt_chat_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=prompt_chat_id,
-                    message_id=prompt_message_id
-                )
-                logger.info(f"Deleted prompt message after cancel: {prompt_message_id}")
-            except Exception as delete_error:
-                logger.error(f"Failed to delete prompt message after cancel: {delete_error}", exc_info=True)
-        
-        # Очищаем user_data
-        if 'photo_file_id' in context.user_data:
-            del context.user_data['photo_file_id']
-        if 'original_message_id' in context.user_data:
-            del context.user_data['original_message_id']
-        if 'original_chat_id' in context.user_data:
-            del context.user_data['original_chat_id']
-        if 'prompt_message_id' in context.user_data:
-            del context.user_data['prompt_message_id']
-        if 'prompt_chat_id' in context.user_data:
-            del context.user_data['prompt_chat_id']
+        await _delete_prompt(context, session, "after cancel")
+        session.clear_submission()
             
         await query.edit_message_text(text="Добавление пива отменено.")
         return ConversationHandler.END
@@ -107,8 +149,7 @@ async def handle_volume_choice(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.warning("User or photo_file_id missing in handle_volume_choice.")
         await query.edit_message_text(text="Что-то пошло не так. Попробуй отправить фото еще раз.")
         # Clear data if something is wrong
-        if 'photo_file_id' in context.user_data:
-            del context.user_data['photo_file_id']
+        session.photo_file_id = None
         return ConversationHandler.END
 
     try:
@@ -116,184 +157,96 @@ async def handle_volume_choice(update: Update, context: ContextTypes.DEFAULT_TYP
     except ValueError:
         logger.error(f"Invalid volume data received from callback: {volume_data}")
         await query.edit_message_text(text="Произошла внутренняя ошибка. Попробуйте позже.")
-        if 'photo_file_id' in context.user_data:
-            del context.user_data['photo_file_id']
+        session.photo_file_id = None
         return ConversationHandler.END
 
     # Save to database
     try:
-        with next(get_db()) as db:
-            # Получаем текущий объем выпитого пива перед добавлением новой записи
-            old_volume = get_user_total_volume(db, user.id)
-            logger.info(f"User {user.id} old volume: {old_volume} L")
-            
-            db_user = add_or_update_user(db, user_id=user.id, first_name=user.first_name, username=user.username)
-            add_beer_entry(db, user_id=db_user.id, volume=volume, photo_id=photo_file_id)
-            
-            # Получаем обновленный объем после добавления
-            new_volume = get_user_total_volume(db, user.id)
-            logger.info(f"User {user.id} new volume: {new_volume} L")
+        # Запись выполняется в потоке БД, чтобы не блокировать обработку других обновлений
+        old_volume, new_volume = await run_db(
+            record_submission,
+            user.id,
+            user.first_name,
+            user.username,
+            volume,
+            photo_file_id,
+        )
+        logger.info(f"User {user.id} volume: {old_volume} L -> {new_volume} L")
 
         # Сообщение пользователю в личный чат
         await query.edit_message_text(
             text=f"Отлично! Засчитано {volume:.2f} л пива. 🍻\nВсего ты выпил(а): {new_volume:.2f} л пива."
         )
         
-        # Отправляем фото и информацию в групповой чат
+        # Отправляем фото и информацию в групповой чат через общую очередь
         if GROUP_CHAT_ID:
             username = f"@{user.username}" if user.username else user.first_name
             caption = f"🍺 {username} выпил(а) {volume:.2f} л пива! 🍻\n📊 Всего выпито: {new_volume:.2f} л"
-            try:
-                # Получаем сохраненные данные об исходном сообщении с фотографией
-                original_message_id = context.user_data.get('original_message_id')
-                original_chat_id = context.user_data.get('original_chat_id')
+            # Получаем сохраненные данные об исходном сообщении с фотографией
+            original_message_id = session.original_message_id
+            original_chat_id = session.original_chat_id
+            keyboard_chat_id = query.message.chat_id
+            keyboard_message_id = query.message.message_id
 
-                # Отправляем фото от имени бота
-                await context.bot.send_photo(
-                    chat_id=GROUP_CHAT_ID,
-                    photo=photo_file_id,
-                    caption=caption
-                )
-                logger.info(f"Beer submission forwarded to group chat: {GROUP_CHAT_ID}")
-                
-                # Удаляем исходное сообщение пользователя с фотографией,
-                # если находимся в групповом чате и удалось получить ID исходного сообщения
+            if submission_digest.enabled:
+                # Заявка попадет в общий альбом; исходные сообщения удалятся после его отправки
+                cleanup_messages = []
                 if original_message_id and original_chat_id == GROUP_CHAT_ID:
-                    try:
-                        await context.bot.delete_message(
-                            chat_id=original_chat_id,
-                            message_id=original_message_id
-                        )
-                        logger.info(f"Original user photo message deleted: {original_message_id}")
-                    except Exception as delete_error:
-                        logger.error(f"Failed to delete original message: {delete_error}", exc_info=True)
+                    cleanup_messages.append((original_chat_id, original_message_id))
+                if keyboard_chat_id == GROUP_CHAT_ID:
+                    cleanup_messages.append((keyboard_chat_id, keyboard_message_id))
+                submission_digest.add(PendingSubmission(
+                    photo_file_id,
+                    f"🍺 {username}: +{volume:.2f} л, всего {new_volume:.2f} л",
+                    cleanup_messages,
+                ))
+            else:
+                async def send_submission(bot: Bot) -> None:
+                    # Отправляем фото от имени бота
+                    await bot.send_photo(
+                        chat_id=GROUP_CHAT_ID,
+                        photo=photo_file_id,
+                        caption=caption
+                    )
+                    logger.info(f"Beer submission forwarded to group chat: {GROUP_CHAT_ID}")
                 
-                # Удаляем сообщение с инлайн-клавиатурой в групповом чате
-                if query.message.chat_id == GROUP_CHAT_ID:
-                    try:
-                        await context.bot.delete_message(
-                            chat_id=query.message.chat_id,
-                            message_id=query.message.message_id
-                        )
-                        logger.info(f"Inline keyboard message deleted in group chat: {query.message.message_id}")
-                    except Exception as delete_error:
-                        logger.error(f"Failed to delete inline keyboard message: {delete_error}", exc_info=True)
-            except Exception as e:
-                logger.error(f"Failed to forward submission to group chat: {e}", exc_info=True)
+                    # Удаляем исходное сообщение с фотографией и сообщение с инлайн-клавиатурой
+                    # только после репоста, отдельными заданиями очереди (каждое — вызов Bot API)
+                    if original_message_id and original_chat_id == GROUP_CHAT_ID:
+                        outbound_queue.enqueue_delete(original_chat_id, original_message_id)
+                    if keyboard_chat_id == GROUP_CHAT_ID:
+                        outbound_queue.enqueue_delete(keyboard_chat_id, keyboard_message_id)
+
+                outbound_queue.enqueue(GROUP_CHAT_ID, send_submission, PRIORITY_SUBMISSION, f"submission of user {user.id}")
         else:
             logger.warning("GROUP_CHAT_ID not set, cannot forward beer submission")
         
-        # Проверяем достижения пользователя
+        # Проверяем достижения пользователя: за одну заявку можно пересечь несколько порогов
         logger.debug(f"Checking achievements for user {user.id}: old={old_volume}, new={new_volume}")
-        new_achievement = check_new_achievement(old_volume, new_volume)
+        crossed_achievements = get_crossed_achievements(old_volume, new_volume)
         
-        if new_achievement:
-            logger.info(f"User {user.id} reached new achievement: {new_achievement['title']} ({new_achievement['volume']} L)")
+        if crossed_achievements:
             username_display = f"@{user.username}" if user.username else user.first_name
-            achievement_message = format_achievement_message(new_achievement, username_display)
-            
-            # Отладка путей к изображениям
-            image_path = new_achievement.get('image', '')
-            logger.debug(f"Achievement image path: {image_path}")
-            logger.debug(f"Image exists: {os.path.exists(image_path) if image_path else 'N/A'}")
-            logger.debug(f"Current directory: {os.getcwd()}")
-            
-            # Отправляем сообщение и изображение о достижении только в групповой чат
-            if GROUP_CHAT_ID:
-                try:
-                    logger.info(f"Trying to send achievement notification to group chat: {GROUP_CHAT_ID}")
-                    # Проверяем, существует ли файл изображения
-                    if image_path and os.path.exists(image_path):
-                        logger.info(f"Sending achievement with image: {image_path}")
-                        with open(image_path, 'rb') as photo:
-                            await context.bot.send_photo(
-                                chat_id=GROUP_CHAT_ID,
-                                photo=photo,
-                                caption=achievement_message
-                            )
-                    else:
-                        logger.warning(f"Achievement image not found: {image_path}, sending text only")
-                        # Если файл не существует, отправляем только текстовое сообщение
-                        await context.bot.send_message(
-                            chat_id=GROUP_CHAT_ID,
-                            text=achievement_message
-                        )
-                    logger.info(f"Achievement notification sent to group chat: {GROUP_CHAT_ID}")
-                except Exception as e:
-                    logger.error(f"Failed to send achievement notification to group chat: {e}", exc_info=True)
-                    # Если не удалось отправить изображение, отправляем только текст
-                    try:
-                        logger.info("Trying to send fallback text-only achievement notification")
-                        await context.bot.send_message(
-                            chat_id=GROUP_CHAT_ID,
-                            text=achievement_message
-                        )
-                        logger.info("Fallback text-only achievement notification sent")
-                    except Exception as inner_e:
-                        logger.error(f"Also failed to send text-only achievement: {inner_e}", exc_info=True)
-            else:
-                logger.warning("GROUP_CHAT_ID not set, cannot send achievement notification")
+            for new_achievement in crossed_achievements:
+                logger.info(f"User {user.id} reached new achievement: {new_achievement['title']} ({new_achievement['volume']} L)")
+                await announce_achievement(context, new_achievement, username_display)
         else:
             logger.debug(f"No new achievement for user {user.id}")
         
         logger.info(f"Successfully added entry for user {user.id}: {volume}L")
         
         # Удаляем сообщение-подсказку "Отправь мне фото с пивом", если оно было сохранено
-        prompt_message_id = context.user_data.get('prompt_message_id')
-        prompt_chat_id = context.user_data.get('prompt_chat_id')
-        
-        if prompt_message_id and prompt_chat_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=prompt_chat_id,
-                    message_id=prompt_message_id
-                )
-                logger.info(f"Deleted prompt message: {prompt_message_id} in chat {prompt_chat_id}")
-                
-                # Очищаем данные о сообщении
-                del context.user_data['prompt_message_id']
-                del context.user_data['prompt_chat_id']
-            except Exception as delete_error:
-                logger.error(f"Failed to delete prompt message: {delete_error}", exc_info=True)
-        
-        # Clear stored data
-        if 'photo_file_id' in context.user_data:
-            del context.user_data['photo_file_id']
-        if 'original_message_id' in context.user_data:
-            del context.user_data['original_message_id']
-        if 'original_chat_id' in context.user_data:
-            del context.user_data['original_chat_id']
+        await _delete_prompt(context, session, "after submission")
+        session.clear_submission()
         return ConversationHandler.END
 
     except Exception as e:
         logger.error(f"Database error while adding beer entry for user {user.id}: {e}", exc_info=True)
         await query.edit_message_text(text="Произошла ошибка при сохранении данных. Попробуй позже.")
         
-        # Удаляем сообщение-подсказку при ошибке
-        prompt_message_id = context.user_data.get('prompt_message_id')
-        prompt_chat_id = context.user_data.get('prompt_chat_id')
-        
-        if prompt_message_id and prompt_chat_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=prompt_chat_id,
-                    message_id=prompt_message_id
-                )
-                logger.info(f"Deleted prompt message after error: {prompt_message_id}")
-            except Exception as delete_error:
-                logger.error(f"Failed to delete prompt message after error: {delete_error}", exc_info=True)
-        
-        # Clear stored data even on error
-        if 'photo_file_id' in context.user_data:
-             del context.user_data['photo_file_id']
-        if 'original_message_id' in context.user_data:
-            del context.user_data['original_message_id']
-        if 'original_chat_id' in context.user_data:
-            del context.user_data['original_chat_id']
-        if 'prompt_message_id' in context.user_data:
-            del context.user_data['prompt_message_id']
-        if 'prompt_chat_id' in context.user_data:
-            del context.user_data['prompt_chat_id']
+        # Удаляем сообщение-подсказку при ошибке и очищаем данные заявки
+        await _delete_prompt(context, session, "after error")
+        session.clear_submission()
         return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -302,30 +255,9 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f"User {user.first_name} ({user.id}) canceled the conversation via command.")
     
     # Удаляем сообщение-подсказку при отмене через команду
-    prompt_message_id = context.user_data.get('prompt_message_id')
-    prompt_chat_id = context.user_data.get('prompt_chat_id')
-    
-    if prompt_message_id and prompt_chat_id:
-        try:
-            await context.bot.delete_message(
-                chat_id=prompt_chat_id,
-                message_id=prompt_message_id
-            )
-            logger.info(f"Deleted prompt message after cancel command: {prompt_message_id}")
-        except Exception as delete_error:
-            logger.error(f"Failed to delete prompt message after cancel command: {delete_error}", exc_info=True)
-    
-    # Clear stored data if any
-    if 'photo_file_id' in context.user_data:
-        del context.user_data['photo_file_id']
-    if 'original_message_id' in context.user_data:
-        del context.user_data['original_message_id']
-    if 'original_chat_id' in context.user_data:
-        del context.user_data['original_chat_id']
-    if 'prompt_message_id' in context.user_data:
-        del context.user_data['prompt_message_id']
-    if 'prompt_chat_id' in context.user_data:
-        del context.user_data['prompt_chat_id']
+    session: UserSession = context.user_data
+    await _delete_prompt(context, session, "after cancel command")
+    session.clear_submission()
 
     await update.message.reply_text(
         'Добавление пива отменено.'
@@ -340,5 +272,8 @@ beer_tracking_conv_handler = ConversationHandler(
     },
     fallbacks=[CommandHandler('cancel', cancel), CallbackQueryHandler(handle_volume_choice, pattern='^cancel_volume$')], # Also handle cancel button
     per_user=True, # Default, but explicit
-    per_chat=True  # Add this for better group chat handling
+    per_chat=True,  # Add this for better group chat handling
+    name="beer_tracking",
+    conversation_timeout=CONVERSATION_TIMEOUT,  # Брошенный диалог завершается (user_session.py)
+    persistent=True  # Выбранное фото и шаг диалога переживают перезапуск (bot_persistence.py)
 )
\ No newline at end of file
@@ -2,8 +2,10 @@
 Модуль для функций, связанных с окончанием конкурса и объявлением победителей.
 """
 import logging
+from telegram import Bot
 from telegram.ext import ContextTypes
 from config import GROUP_CHAT_ID
+from outbound_queue import outbound_queue, PRIORITY_WINNERS
 
 # Enable logging
 logging.basicConfig(
@@ -11,6 +13,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _enqueue_group_text(text: str, description: str) -> None:
+    """Ставит текстовое сообщение для группового чата в очередь с наивысшим приоритетом."""
+    async def send(bot: Bot) -> None:
+        await bot.send_message(chat_id=GROUP_CHAT_ID, text=text)
+        logger.info(f"Sent {description} to group chat {GROUP_CHAT_ID}")
+
+    outbound_queue.enqueue(GROUP_CHAT_ID, send, PRIORITY_WINNERS, description)
+
 async def announce_contest_winners(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Объявляет победителей конкурса в групповой чат после окончания челленджа."""
     if not GROUP_CHAT_ID:
@@ -19,15 +29,14 @@ async def announce_contest_winners(context: ContextTypes.DEFAULT_TYPE) -> None:
     
     try:
         # Получаем таблицу лидеров с тремя лучшими участниками
-        from db_utils import get_db, get_leaderboard
+        from db_utils import run_db, get_leaderboard, get_contest_stats
         
-        with next(get_db()) as db:
-            top_winners = get_leaderboard(db, limit=3)
+        top_winners = await run_db(get_leaderboard, limit=3)
         
         if not top_winners:
-            await context.bot.send_message(
-                chat_id=GROUP_CHAT_ID,
-                text="🏆 Franema Summer Beer Challenge завершен! 🏆\n\nК сожалению, никто не принял участие в челлендже. Будем ждать следующего лета!"
+            _enqueue_group_text(
+                "🏆 Franema Summer Beer Challenge завершен! 🏆\n\nК сожалению, никто не принял участие в челлендже. Будем ждать следующего лета!",
+                "contest results"
             )
             return
         
@@ -55,37 +64,29 @@ async def announce_contest_winners(context: ContextTypes.DEFAULT_TYPE) -> None:
         total_participants = 0
         total_volume = 0.0
         
-        with next(get_db()) as db:
-            # Получаем статистику конкурса
-            try:
-                from sqlalchemy import func, distinct
-                from models import User, BeerEntry
-                
-                total_participants = db.query(func.count(distinct(User.id))).scalar() or 0
-                total_volume = db.query(func.sum(BeerEntry.volume)).scalar() or 0.0
-            except Exception as stats_error:
-                logger.error(f"Error getting contest stats: {stats_error}", exc_info=True)
-                total_participants = len(top_winners)
-                total_volume = sum(winner[2] for winner in top_winners)
+        # Получаем статистику конкурса
+        try:
+            total_participants, total_volume = await run_db(get_contest_stats)
+        except Exception as stats_error:
+            logger.error(f"Error getting contest stats: {stats_error}", exc_info=True)
+            total_participants = len(top_winners)
+            total_volume = sum(winner[2] for winner in top_winners)
         
         winners_text += f"\n🍻 Всего участников: {total_participants}"
         winners_text += f"\n🍺 Общий объем выпитого пива: {total_volume:.2f} л"
         winners_text += "\n\nСпасибо всем за участие! До следующего лета! 🌞"
         
         # Отправляем сообщение с результатами
-        await context.bot.send_message(
-            chat_id=GROUP_CHAT_ID,
-            text=winners_text
-        )
-        logger.info("Contest winners announced successfully")
+        _enqueue_group_text(winners_text, "contest winners")
+        logger.info("Contest winners announcement queued")
         
     except Exception as e:
         logger.error(f"Error announcing contest winners: {e}", exc_info=True)
         # Попытка отправить сообщение об ошибке
         try:
-            await context.bot.send_message(
-                chat_id=GROUP_CHAT_ID,
-                text="Произошла ошибка при подведении итогов конкурса. Пожалуйста, свяжитесь с администратором."
+            _enqueue_group_text(
+                "Произошла ошибка при подведении итогов конкурса. Пожалуйста, свяжитесь с администратором.",
+                "contest error notification"
             )
         except Exception as notify_error:
             logger.error(f"Error sending error notification: {notify_error}", exc_info=True) 
\ No newline at end of file
@@ -1,10 +1,16 @@
 # handlers/leaderboard.py
 import logging
-from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler
+import threading
+from typing import Dict, List, Tuple
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 from telegram.error import BadRequest # Import BadRequest
-from db_utils import get_db, get_leaderboard
-from handlers.achievements import get_achievement_for_volume  # Импортируем функцию для определения званий
+from config import GROUP_CHAT_ID
+from leaderboard_index import leaderboard_index, RankedRow
+from outbound_queue import outbound_queue, PRIORITY_LEADERBOARD
+from handlers.achievements import get_achievement_for_volume, achievements_version  # Импортируем функцию для определения званий
+from user_session import UserSession
+from chat_cache import chat_cache
 
 # Enable logging
 logging.basicConfig(
@@ -12,94 +18,192 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-import time # Import time module
+# Количество участников на одной странице таблицы лидеров. Вместе с ограничением
+# длины имени это держит сообщение заметно ниже лимита Telegram в 4096 символов.
+LEADERBOARD_PAGE_SIZE = 20
+MAX_DISPLAY_NAME_LENGTH = 48
+TELEGRAM_MESSAGE_LIMIT = 4096
 
-# Cooldown period in seconds
-LEADERBOARD_COOLDOWN = 5
+# Префикс callback_data кнопок навигации: "lb:page:<n>" и "lb:me"
+LEADERBOARD_CALLBACK_PREFIX = "lb:"
+
+# Кеш готовых страниц. Ключ включает версию индекса рейтинга (меняется при
+# новой записи о пиве, правке админом или смене имени) и версию определений достижений,
+# поэтому устаревший текст никогда не отдается и явная очистка при записи не нужна.
+_render_cache: Dict[Tuple[int, str, int, int], Tuple[str, int]] = {}
+_render_cache_lock = threading.Lock()
+_render_cache_stats = {"hits": 0, "misses": 0}
+
+def format_display_name(first_name, username) -> str:
+    """Формирует имя участника для таблицы: «Имя (@ник)»."""
+    display_name_parts = []
+    if first_name:
+        display_name_parts.append(first_name)
+    if username:
+        display_name_parts.append(f"(@{username})")
+    # Fallback if both are None/empty
+    return " ".join(display_name_parts) if display_name_parts else "Участник"
+
+def _format_leaderboard_page(rows: List[RankedRow], page: int, total_pages: int, total_users: int) -> str:
+    if not rows:
+        return "Таблица лидеров пока пуста. Будь первым! 🍻"
+
+    leaderboard_text = "🏆 Таблица лидеров участников - Летний пивной кубок 2025 🏆\n\n"
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    for rank, _user_id, first_name, username, volume in rows:
+        medal = medals.get(rank, f"{rank}.") # Get medal or use number
+
+        display_name = format_display_name(first_name, username)
+        if len(display_name) > MAX_DISPLAY_NAME_LENGTH:
+            display_name = display_name[:MAX_DISPLAY_NAME_LENGTH - 1] + "…"
+
+        # Определяем звание пользователя по объему выпитого пива
+        achievement = get_achievement_for_volume(volume)
+        achievement_text = f" - {achievement['title']} {achievement['icon']}" if achievement else ""
+
+        leaderboard_text += f"{medal} {display_name} - {volume:.2f} л{achievement_text}\n"
+
+    leaderboard_text += f"\nСтраница {page}/{total_pages} · участников: {total_users}"
+    return leaderboard_text[:TELEGRAM_MESSAGE_LIMIT]
+
+def render_leaderboard_page(page: int = 1, page_size: int = LEADERBOARD_PAGE_SIZE) -> Tuple[str, int, int]:
+    """
+    Возвращает текст страницы таблицы лидеров, используя кеш.
+
+    Страница выбирается из индекса рейтинга по смещению за O(log n + page_size),
+    повторные запросы без изменений в рейтинге обходятся поиском в словаре.
+
+    Args:
+        page (int): Номер страницы, начиная с 1 (приводится к допустимому диапазону)
+        page_size (int): Количество участников на странице
+
+    Returns:
+        Tuple[str, int, int]: Текст сообщения, фактический номер страницы и число страниц
+    """
+    total_users = len(leaderboard_index)
+    total_pages = max(1, (total_users + page_size - 1) // page_size)
+    page = min(max(1, page), total_pages)
+
+    # Версия читается до выборки: если рейтинг изменится во время форматирования,
+    # следующий запрос увидит новую версию и перестроит текст
+    key = (leaderboard_index.version, achievements_version(), page, page_size)
+    with _render_cache_lock:
+        cached = _render_cache.get(key)
+        if cached is not None:
+            _render_cache_stats["hits"] += 1
+            text, cached_total_pages = cached
+            return text, page, cached_total_pages
+        _render_cache_stats["misses"] += 1
+
+    rows = leaderboard_index.page((page - 1) * page_size, page_size)
+    leaderboard_text = _format_leaderboard_page(rows, page, total_pages, total_users)
+
+    with _render_cache_lock:
+        # Храним только страницы актуальной версии
+        for stale_key in [k for k in _render_cache if k[:2] != key[:2]]:
+            del _render_cache[stale_key]
+        _render_cache[key] = (leaderboard_text, total_pages)
+    return leaderboard_text, page, total_pages
+
+def get_render_cache_stats() -> Dict[str, int]:
+    """Возвращает счетчики попаданий и промахов кеша таблицы лидеров."""
+    with _render_cache_lock:
+        return dict(_render_cache_stats, size=len(_render_cache))
+
+def leaderboard_keyboard(page: int, total_pages: int) -> InlineKeyboardMarkup:
+    """Кнопки навигации: назад, номер страницы, вперед и «моё место»."""
+    navigation = []
+    if page > 1:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"{LEADERBOARD_CALLBACK_PREFIX}page:{page - 1}"))
+    navigation.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data=f"{LEADERBOARD_CALLBACK_PREFIX}page:{page}"))
+    if page < total_pages:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"{LEADERBOARD_CALLBACK_PREFIX}page:{page + 1}"))
+    return InlineKeyboardMarkup([
+        navigation,
+        [InlineKeyboardButton("📍 Моё место", callback_data=f"{LEADERBOARD_CALLBACK_PREFIX}me")],
+    ])
+
+async def send_leaderboard(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> None:
+    """
+    Отправляет первую страницу таблицы лидеров с кнопками навигации.
+
+    В групповой чат сообщение уходит через очередь исходящих сообщений.
+    ID отправленного сообщения сохраняется, чтобы удалить таблицу при следующем запросе.
+    """
+    leaderboard_text, page, total_pages = render_leaderboard_page(1)
+    reply_markup = leaderboard_keyboard(page, total_pages)
+    session: UserSession = context.user_data
+
+    async def send(bot: Bot) -> None:
+        sent_message = await bot.send_message(chat_id=chat_id, text=leaderboard_text, reply_markup=reply_markup)
+        # Store the new message ID per user
+        session.leaderboard_message_id = sent_message.message_id
+        logger.info(f"Stored new leaderboard message ID {sent_message.message_id} for user {user_id} in chat {chat_id}.")
+
+    if chat_id == GROUP_CHAT_ID:
+        outbound_queue.enqueue(chat_id, send, PRIORITY_LEADERBOARD, f"leaderboard for user {user_id}")
+    else:
+        await send(context.bot)
+
+async def leaderboard_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Переключает страницы таблицы лидеров, редактируя то же сообщение."""
+    query = update.callback_query
+    action = query.data[len(LEADERBOARD_CALLBACK_PREFIX):]
+
+    if action == "me":
+        rank = leaderboard_index.rank_of(query.from_user.id)
+        if rank is None:
+            await query.answer("Тебя пока нет в таблице. Отправь фото с пивом! 🍺", show_alert=True)
+            return
+        page = (rank - 1) // LEADERBOARD_PAGE_SIZE + 1
+        await query.answer(f"Твоё место: {rank}")
+    else:
+        try:
+            page = int(action.split(":", 1)[1])
+        except (IndexError, ValueError):
+            logger.warning(f"Invalid leaderboard callback data: {query.data}")
+            await query.answer()
+            return
+        await query.answer()
+
+    leaderboard_text, page, total_pages = render_leaderboard_page(page)
+    try:
+        await query.edit_message_text(text=leaderboard_text, reply_markup=leaderboard_keyboard(page, total_pages))
+    except BadRequest as e:
+        # Повторное нажатие на текущую страницу без изменений в рейтинге
+        if "not modified" not in str(e).lower():
+            logger.warning(f"Could not edit leaderboard message {query.message.message_id if query.message else None}: {e}")
 
 async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Fetches and displays the current leaderboard, deleting the previous one sent by the same user."""
     user = update.effective_user
     chat_id = update.effective_chat.id
     user_id = user.id
-    current_time = time.time()
 
     # Сохраняем ID сообщения пользователя, запросившего таблицу лидеров, чтобы удалить его позже
     user_message_id = update.message.message_id if update.message else None
-    
-    # Check cooldown for the user
-    last_request_time = context.user_data.get(f'leaderboard_last_request_{user_id}', 0)
-    if current_time - last_request_time < LEADERBOARD_COOLDOWN:
-        logger.info(f"User {user.first_name} ({user_id}) requested leaderboard too soon in chat {chat_id}. Ignoring.")
-        # Optionally send a message to the user
-        # await update.message.reply_text("Пожалуйста, подождите немного перед следующим запросом таблицы.", quote=True)
-        return # Exit if within cooldown
+    # Частые запросы отсекает rate_limiter (категория leaderboard) до вызова обработчика
+    session: UserSession = context.user_data
 
     logger.info(f"User {user.first_name} ({user_id}) requested leaderboard in chat {chat_id}.")
 
     # Try to delete the previous leaderboard message sent by this user
-    last_message_id = context.user_data.get(f'last_leaderboard_message_id_{user_id}')
+    last_message_id = session.leaderboard_message_id
     if last_message_id:
+        # Clear the stored ID even if deletion fails to prevent repeated attempts
+        session.leaderboard_message_id = None
         try:
             await context.bot.delete_message(chat_id=chat_id, message_id=last_message_id)
             logger.info(f"Deleted previous leaderboard message {last_message_id} for user {user_id} in chat {chat_id}.")
-            # Clear the stored ID after successful deletion
-            del context.user_data[f'last_leaderboard_message_id_{user_id}']
         except BadRequest as e:
             # Message might have been deleted already or is too old
             logger.warning(f"Could not delete message {last_message_id} for user {user_id} in chat {chat_id}: {e}")
-            # Clear the stored ID even if deletion failed to prevent repeated attempts
-            if f'last_leaderboard_message_id_{user_id}' in context.user_data:
-                 del context.user_data[f'last_leaderboard_message_id_{user_id}']
         except Exception as e:
             logger.error(f"Unexpected error deleting message {last_message_id} for user {user_id} in chat {chat_id}: {e}", exc_info=True)
-            # Clear the stored ID even on unexpected errors
-            if f'last_leaderboard_message_id_{user_id}' in context.user_data:
-                 del context.user_data[f'last_leaderboard_message_id_{user_id}']
 
     try:
-        with next(get_db()) as db:
-            leaderboard_data = get_leaderboard(db, limit=100) # Увеличиваем лимит до 100 участников
-
-        if not leaderboard_data:
-            leaderboard_text = "Таблица лидеров пока пуста. Будь первым! 🍻"
-        else:
-            leaderboard_text = "🏆 Таблица лидеров участников - Летний пивной кубок 2025 🏆\n\n"
-            medals = {1: "🥇", 2: "🥈", 3: "🥉"}
-            for i, (first_name, username, volume) in enumerate(leaderboard_data, start=1):
-                # Construct display name with username if available
-                display_name_parts = []
-                if first_name:
-                    display_name_parts.append(first_name)
-                if username:
-                    display_name_parts.append(f"(@{username})")
-                
-                if not display_name_parts: # Fallback if both are None/empty
-                    # We need the user_id here, but it's not directly available from get_leaderboard
-                    # For now, use a generic placeholder. A better solution might involve returning user_id too.
-                    display_name = "Участник"
-                else:
-                    display_name = " ".join(display_name_parts)
-
-                medal = medals.get(i, f"{i}.") # Get medal or use number
-                
-                # Определяем звание пользователя по объему выпитого пива
-                achievement = get_achievement_for_volume(volume)
-                achievement_text = f" - {achievement['title']} {achievement['icon']}" if achievement else ""
-                
-                leaderboard_text += f"{medal} {display_name} - {volume:.2f} л{achievement_text}\n"
-
-        # Отправляем таблицу как новое сообщение (не как reply)
-        sent_message = await context.bot.send_message(
-            chat_id=chat_id,
-            text=leaderboard_text
-        )
-
-        # Store the new message ID per user
-        context.user_data[f'last_leaderboard_message_id_{user_id}'] = sent_message.message_id
-        # Update the last request time for the user
-        context.user_data[f'leaderboard_last_request_{user_id}'] = current_time
-        logger.info(f"Stored new leaderboard message ID {sent_message.message_id} for user {user_id} in chat {chat_id}.")
+        # Отправляем первую страницу как новое сообщение (не как reply)
+        await send_leaderboard(context, chat_id, user_id)
         
         # Удаляем сообщение пользователя с запросом таблицы лидеров
         if user_message_id:
@@ -108,8 +212,8 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 is_group = update.effective_chat.type in ["group", "supergroup"]
                 
                 if is_group:
-                    # Проверяем права бота перед удалением
-                    bot_member = await context.bot.get_chat_member(chat_id, context.bot.id)
+                    # Проверяем права бота перед удалением (getChatMember не чаще раза в CHAT_CACHE_TTL)
+                    bot_member = await chat_cache.get_chat_member(context.bot, chat_id, context.bot.id)
                     can_delete = bot_member.can_delete_messages
                     
                     if can_delete:
@@ -132,4 +236,7 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
 # Handler for /leaderboard command (or button press)
 # Note: The handler registration is in main.py using MessageHandler
-# leaderboard_handler = CommandHandler("leaderboard", show_leaderboard) # Keep this if you also want /leaderboard command
\ No newline at end of file
+# leaderboard_handler = CommandHandler("leaderboard", show_leaderboard) # Keep this if you also want /leaderboard command
+
+# Навигация по страницам таблицы лидеров
+leaderboard_navigation_handler = CallbackQueryHandler(leaderboard_navigation, pattern=f"^{LEADERBOARD_CALLBACK_PREFIX}")
\ No newline at end of file
@@ -1,12 +1,30 @@
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes, CommandHandler
-from db_utils import add_or_update_user, add_beer_entry, get_db, get_user_total_volume
+from db_utils import add_or_update_user, add_beer_entry, run_db, get_user_total_volume
+from sqlalchemy.orm import Session
 from models import User # Import User if needed, or rely on db_utils
 import logging
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
+def _register_participant(db: Session, user_id: int, first_name, username) -> None:
+    """Adds or updates the user and creates the initial zero-volume entry for newcomers."""
+    db_user = add_or_update_user(db, user_id=user_id, first_name=first_name, username=username)
+
+    # Проверяем, есть ли у пользователя записи о пиве
+    total_volume = get_user_total_volume(db, user_id)
+
+    # Если у пользователя нет записей (новый пользователь),
+    # добавляем начальную запись с объемом 0.0 литров
+    if total_volume == 0.0:
+        try:
+            # Используем пустую строку для photo_id, так как нет реальной фотографии
+            add_beer_entry(db, user_id=db_user.id, volume=0.0, photo_id="initial_zero_volume")
+            logger.info(f"Added initial zero volume entry for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error adding initial zero volume entry: {e}", exc_info=True)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends explanation on how to use the bot and registers/updates the user."""
     user = update.effective_user
@@ -15,21 +33,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     # Add or update user in the database
-    with next(get_db()) as db:
-        db_user = add_or_update_user(db, user_id=user.id, first_name=user.first_name, username=user.username)
-        
-        # Проверяем, есть ли у пользователя записи о пиве
-        total_volume = get_user_total_volume(db, user.id)
-        
-        # Если у пользователя нет записей (новый пользователь), 
-        # добавляем начальную запись с объемом 0.0 литров
-        if total_volume == 0.0:
-            try:
-                # Используем пустую строку для photo_id, так как нет реальной фотографии
-                add_beer_entry(db, user_id=db_user.id, volume=0.0, photo_id="initial_zero_volume")
-                logger.info(f"Added initial zero volume entry for user {user.id}")
-            except Exception as e:
-                logger.error(f"Error adding initial zero volume entry: {e}", exc_info=True)
+    await run_db(_register_participant, user.id, user.first_name, user.username)
 
     # Define buttons
     keyboard = [
@@ -0,0 +1,249 @@
+# leaderboard_index.py
+"""
+Индекс рейтинга участников в памяти процесса.
+
+Повторяет таблицу user_totals и отвечает на запросы «топ N», «место участника»
+и «участники рядом с местом k» за O(log n) без обращения к базе данных.
+Внутри используется декартово дерево (treap) с размерами поддеревьев,
+упорядоченное по ключу (-общий объем, user_id).
+"""
+import logging
+import random
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Строка рейтинга: (место, user_id, first_name, username, общий объем)
+RankedRow = Tuple[int, int, Optional[str], Optional[str], float]
+
+_Key = Tuple[float, int]
+
+
+class _Node:
+    __slots__ = ("key", "priority", "left", "right", "size")
+
+    def __init__(self, key: _Key):
+        self.key = key
+        self.priority = random.random()
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+        self.size = 1
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node else 0
+
+
+def _update(node: _Node) -> None:
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node: Optional[_Node], key: _Key) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Splits the tree into keys < key and keys >= key."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        _update(node)
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    _update(node)
+    return left, node
+
+
+def _split_first(node: Optional[_Node]) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Detaches the smallest node from the tree."""
+    if node is None:
+        return None, None
+    if node.left is None:
+        rest = node.right
+        node.right = None
+        _update(node)
+        return node, rest
+    first, node.left = _split_first(node.left)
+    _update(node)
+    return first, node
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    """Merges two trees where every key of left is smaller than every key of right."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+class LeaderboardIndex:
+    """
+    Потокобезопасный рейтинг участников.
+
+    Записи в индекс выполняются из потока БД после успешного коммита,
+    чтения — из event loop, поэтому все операции защищены блокировкой.
+    Поле version увеличивается при каждом изменении и подходит для инвалидации кешей.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._root: Optional[_Node] = None
+        self._keys: Dict[int, _Key] = {}
+        self._names: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    @staticmethod
+    def _make_key(user_id: int, total_volume: float) -> _Key:
+        return (-total_volume, user_id)
+
+    def load(self, rows: Iterable[Tuple[int, Optional[str], Optional[str], Optional[float]]]) -> None:
+        """
+        Полностью заменяет содержимое индекса.
+
+        Args:
+            rows: Кортежи (user_id, first_name, username, total_volume). Участники
+                  без total_volume (None) попадают только в справочник имен.
+        """
+        keys: Dict[int, _Key] = {}
+        names: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        for user_id, first_name, username, total_volume in rows:
+            names[user_id] = (first_name, username)
+            if total_volume is not None:
+                keys[user_id] = self._make_key(user_id, total_volume)
+
+        root = None
+        # Ключи вставляются по возрастанию, поэтому каждая вставка — это слияние справа
+        for key in sorted(keys.values()):
+            root = _merge(root, _Node(key))
+
+        with self._lock:
+            self._root = root
+            self._keys = keys
+            self._names = names
+            self.version += 1
+        logger.info(f"Leaderboard index loaded: {len(keys)} ranked users")
+
+    def set_names(self, user_id: int, first_name: Optional[str], username: Optional[str]) -> None:
+        """Updates the display name of a user."""
+        with self._lock:
+            if self._names.get(user_id) != (first_name, username):
+                self._names[user_id] = (first_name, username)
+                if user_id in self._keys:
+                    self.version += 1
+
+    def update(self, user_id: int, total_volume: float) -> None:
+        """Inserts the user or moves them to the position of the new total."""
+        key = self._make_key(user_id, total_volume)
+        with self._lock:
+            old_key = self._keys.get(user_id)
+            if old_key == key:
+                return
+            if old_key is not None:
+                self._erase(old_key)
+            left, right = _split(self._root, key)
+            self._root = _merge(_merge(left, _Node(key)), right)
+            self._keys[user_id] = key
+            self.version += 1
+
+    def remove(self, user_id: int, forget_name: bool = False) -> None:
+        """Removes the user from the ranking (and optionally from the name directory)."""
+        with self._lock:
+            old_key = self._keys.pop(user_id, None)
+            if old_key is not None:
+                self._erase(old_key)
+                self.version += 1
+            if forget_name:
+                self._names.pop(user_id, None)
+
+    def _erase(self, key: _Key) -> None:
+        left, right = _split(self._root, key)
+        _removed, right = _split_first(right)
+        self._root = _merge(left, right)
+
+    def total_of(self, user_id: int) -> Optional[float]:
+        """Returns the total volume of a ranked user or None."""
+        key = self._keys.get(user_id)
+        return -key[0] if key is not None else None
+
+    def rank_of(self, user_id: int) -> Optional[int]:
+        """Returns the 1-based place of the user or None if the user is not ranked."""
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is None:
+                return None
+            rank = 0
+            node = self._root
+            while node is not None:
+                if key <= node.key:
+                    if key == node.key:
+                        return rank + _size(node.left) + 1
+                    node = node.left
+                else:
+                    rank += _size(node.left) + 1
+                    node = node.right
+            return None
+
+    def _iter_from(self, offset: int) -> Iterator[_Node]:
+        """Yields nodes in ranking order starting at the 0-based offset."""
+        stack: List[_Node] = []
+        node = self._root
+        while node is not None:
+            left_size = _size(node.left)
+            if offset < left_size:
+                stack.append(node)
+                node = node.left
+            elif offset == left_size:
+                stack.append(node)
+                break
+            else:
+                offset -= left_size + 1
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node
+            child = node.right
+            while child is not None:
+                stack.append(child)
+                child = child.left
+
+    def page(self, offset: int, limit: int) -> List[RankedRow]:
+        """Returns up to limit rows starting at the 0-based offset."""
+        rows: List[RankedRow] = []
+        if limit <= 0 or offset < 0:
+            return rows
+        with self._lock:
+            for rank, node in enumerate(self._iter_from(offset), start=offset + 1):
+                if len(rows) >= limit:
+                    break
+                neg_total, user_id = node.key
+                first_name, username = self._names.get(user_id, (None, None))
+                rows.append((rank, user_id, first_name, username, -neg_total))
+        return rows
+
+    def top(self, limit: int) -> List[RankedRow]:
+        """Returns the first limit rows of the ranking."""
+        return self.page(0, limit)
+
+    def around(self, rank: int, radius: int) -> List[RankedRow]:
+        """Returns the rows from rank - radius to rank + radius (1-based, clipped)."""
+        start = max(1, rank - radius)
+        return self.page(start - 1, rank + radius - start + 1)
+
+    def snapshot(self) -> Dict[int, float]:
+        """Returns a copy of {user_id: total_volume} for consistency checks."""
+        with self._lock:
+            return {user_id: -key[0] for user_id, key in self._keys.items()}
+
+
+# Общий экземпляр индекса для всего процесса
+leaderboard_index = LeaderboardIndex()
@@ -1,10 +1,16 @@
+import time
+
+# Момент запуска процесса: от него считается полная длительность старта, включая импорты
+PROCESS_STARTED = time.perf_counter()
+
+import asyncio
+import hashlib
+import json
 import logging
 import os
 import datetime
 import pytz
-import threading
-import http.server
-import socketserver
+from contextlib import contextmanager
 
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup # Добавлен импорт InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler # Добавлен импорт CallbackQueryHandler
@@ -14,11 +20,24 @@ from config import BOT_TOKEN, GROUP_CHAT_ID # Добавлен импорт GROU
 from handlers.start import start, info, rules
 # Use the conversation handler for beer tracking
 from handlers.beer_tracking import beer_tracking_conv_handler, AWAITING_VOLUME_CHOICE # Import state
-from handlers.leaderboard import show_leaderboard # Import the function directly 
+from handlers.leaderboard import show_leaderboard, send_leaderboard, leaderboard_navigation_handler, get_render_cache_stats # Import the function directly 
 from database.database import init_db # Import table creation function from database module
-from handlers.achievements import get_achievement_for_volume  # Импортируем функцию для определения званий
+from database.database import SessionLocal, checkpoint_wal, DB_DIRECTORY, engine
+from asset_optimizer import optimize_assets
+from handlers.achievements import ACHIEVEMENTS
+from db_utils import run_db, pending_db_jobs, shutdown_db_executor, ensure_user_totals, warm_leaderboard_index, check_leaderboard_index
+from outbound_queue import outbound_queue, PRIORITY_LEADERBOARD
+from submission_digest import submission_digest
+from change_journal import change_journal, JOURNAL_FSYNC_INTERVAL
+import web_server
+import metrics
+import tracing
+from bot_persistence import SQLitePersistence
+from user_session import UserSession, SESSION_EVICT_INTERVAL, evict_idle_sessions_job
+from chat_cache import chat_cache, register_chat_cache_handlers
+from rate_limiter import RateLimitHandler, RATE_LIMIT_HANDLER_GROUP
 # leaderboard_handler is now handled by MessageHandler below
-from handlers.admin import admin_conv_handler, change_leaderboard_conv_handler, check_submission_conv_handler, import_users_conv_handler, delete_user_conv_handler, list_users_command
+from handlers.admin import admin_conv_handler, change_leaderboard_conv_handler, check_submission_conv_handler, import_users_conv_handler, delete_user_conv_handler, list_users_command, slow_updates_command, restore_admin_sessions
 
 # Enable logging
 logging.basicConfig(
@@ -26,6 +45,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Интервал проверки индекса рейтинга на расхождение с БД (в секундах)
+LEADERBOARD_INDEX_CHECK_INTERVAL = 3600
+# Интервал checkpoint WAL-файла базы данных (в секундах)
+WAL_CHECKPOINT_INTERVAL = 600
+# Интервал резервного копирования базы данных (в секундах)
+BACKUP_INTERVAL = int(os.environ.get("BACKUP_INTERVAL_HOURS", "1")) * 3600
+# Через сколько секунд после начала опроса Telegram делать первую резервную копию
+STARTUP_BACKUP_DELAY = int(os.environ.get("STARTUP_BACKUP_DELAY", "30"))
+# Хеш последнего зарегистрированного списка команд (на постоянном диске вместе с базой)
+BOT_COMMANDS_HASH_FILE = os.path.join(DB_DIRECTORY, "bot_commands.sha256")
+
+BOT_COMMANDS = [
+    BotCommand("start", "Начать участие в челлендже"),
+    BotCommand("info", "Информация об участии в челлендже"),
+    BotCommand("rules", "Правила пивного челленджа"),
+    BotCommand("leaderboard", "Показать таблицу лидеров"),
+    BotCommand("admin", "Перейти в режим администратора"),
+    BotCommand("announce_winners", "Объявить победителей конкурса (только для админов)"),
+    BotCommand("import_users", "Импортировать список участников (только для админов)"),
+    BotCommand("change_leaderboard", "Изменить объем выпитого пива у участника (только для админов)"),
+    BotCommand("check_submission", "Просмотреть фото участника (только для админов)"),
+    BotCommand("delete_user", "Удалить участника (только для админов)"),
+    BotCommand("list_users", "Показать список участников (только для админов)"),
+    BotCommand("slow_updates", "Показать самые медленные обновления (только для админов)")
+]
+
+# Длительность этапов запуска в секундах (в порядке выполнения)
+startup_timings = {}
+
+
+@contextmanager
+def startup_phase(name: str):
+    """Measures one startup phase and logs its duration."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+        logger.info(f"Startup phase {name}: {startup_timings[name] * 1000:.0f}ms")
+
+
+async def startup_complete_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выполняется первой задачей после начала опроса Telegram и логирует итог запуска."""
+    total = time.perf_counter() - PROCESS_STARTED
+    phases = ", ".join(f"{name}={duration * 1000:.0f}ms" for name, duration in startup_timings.items())
+    logger.info(f"Startup complete in {total * 1000:.0f}ms ({phases})")
+
 
 async def prompt_for_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Prompts the user to send a photo when the 'Выпил пиво' button is pressed."""
@@ -36,8 +102,9 @@ async def prompt_for_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     )
     
     # Сохраняем ID сообщения и чата для последующего удаления
-    context.user_data['prompt_message_id'] = prompt_message.message_id
-    context.user_data['prompt_chat_id'] = update.message.chat_id
+    session: UserSession = context.user_data
+    session.prompt_message_id = prompt_message.message_id
+    session.prompt_chat_id = update.message.chat_id
     
     logger.info(f"Stored prompt message details: message_id={prompt_message.message_id}, chat_id={update.message.chat_id}")
     # Note: We don't return a state here, as the photo handler will trigger the conversation.
@@ -56,56 +123,17 @@ async def show_leaderboard_button(update: Update, context: ContextTypes.DEFAULT_
     button_message_id = query.message.message_id if query.message else None
     
     try:
-        # Вызываем логику получения таблицы лидеров напрямую из handlers/leaderboard.py
-        from db_utils import get_db, get_leaderboard
-        
-        with next(get_db()) as db:
-            leaderboard_data = get_leaderboard(db, limit=100) # Увеличиваем лимит до 100 участников
-
-        if not leaderboard_data:
-            leaderboard_text = "Таблица лидеров пока пуста. Будь первым! 🍻"
-        else:
-            leaderboard_text = "🏆 Таблица лидеров участников - Летний пивной кубок 2025 🏆\n\n"
-            medals = {1: "🥇", 2: "🥈", 3: "🥉"}
-            for i, (first_name, username, volume) in enumerate(leaderboard_data, start=1):
-                display_name_parts = []
-                if first_name:
-                    display_name_parts.append(first_name)
-                if username:
-                    display_name_parts.append(f"(@{username})")
-                
-                if not display_name_parts:
-                    display_name = "Участник"
-                else:
-                    display_name = " ".join(display_name_parts)
-
-                medal = medals.get(i, f"{i}.") # Get medal or use number
-                
-                # Определяем звание пользователя по объему выпитого пива
-                achievement = get_achievement_for_volume(volume)
-                achievement_text = f" - {achievement['title']} {achievement['icon']}" if achievement else ""
-                
-                leaderboard_text += f"{medal} {display_name} - {volume:.2f} л{achievement_text}\n"
-        
-        # Отправляем таблицу как новое сообщение (не как reply)
-        sent_message = await context.bot.send_message(
-            chat_id=chat_id,
-            text=leaderboard_text
-        )
-        
-        # Сохраняем ID нового сообщения в контексте пользователя
-        context.user_data[f'last_leaderboard_message_id_{user_id}'] = sent_message.message_id
+        # Отправляем первую страницу таблицы с навигацией, как и команда /leaderboard;
+        # ID нового сообщения сохраняется в контексте пользователя
+        await send_leaderboard(context, chat_id, user_id)
         
         # Удаляем исходное сообщение с кнопкой, если это обычное сообщение (не закрепленное)
         # Для закрепленного сообщения с кнопкой лидеров мы не будем удалять его
         if button_message_id:
-            # Проверяем, закреплено ли это сообщение
+            # Проверяем, закреплено ли это сообщение (getChat не чаще раза в CHAT_CACHE_TTL)
             try:
-                pinned_message = await context.bot.get_chat(chat_id)
-                is_pinned = (
-                    pinned_message.pinned_message 
-                    and pinned_message.pinned_message.message_id == button_message_id
-                )
+                pinned_message_id = await chat_cache.pinned_message_id(context.bot, chat_id)
+                is_pinned = pinned_message_id == button_message_id
                 
                 # Если это не закрепленное сообщение, удаляем его
                 if not is_pinned:
@@ -134,36 +162,154 @@ async def send_leaderboard_button_to_group(application: Application) -> None:
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    try:
+    async def send(bot) -> None:
         # Отправляем сообщение с кнопкой в групповой чат
-        await application.bot.send_message(
+        await bot.send_message(
             chat_id=GROUP_CHAT_ID,
             text="Нажмите на кнопку ниже, чтобы увидеть таблицу лидеров Летнего пивного кубка 2025:",
             reply_markup=reply_markup
         )
         logger.info(f"Leaderboard button message sent to group chat: {GROUP_CHAT_ID}")
+
+    outbound_queue.enqueue(GROUP_CHAT_ID, send, PRIORITY_LEADERBOARD, "leaderboard button")
+
+
+async def verify_leaderboard_index_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сверяет индекс рейтинга с БД и перезагружает его при расхождении."""
+    try:
+        await run_db(check_leaderboard_index)
+    except Exception as e:
+        logger.error(f"Error verifying leaderboard index: {e}", exc_info=True)
+
+
+async def checkpoint_wal_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Переносит накопленный WAL в основной файл, чтобы WAL не разрастался."""
+    try:
+        await asyncio.to_thread(checkpoint_wal, "PASSIVE")
     except Exception as e:
-        logger.error(f"Failed to send leaderboard button to group chat: {e}", exc_info=True)
+        logger.error(f"Error running WAL checkpoint: {e}", exc_info=True)
+
+
+async def sync_change_journal_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сбрасывает на диск записи журнала изменений, накопленные с последнего fsync."""
+    try:
+        await asyncio.to_thread(change_journal.sync)
+    except Exception as e:
+        logger.error(f"Error syncing change journal: {e}", exc_info=True)
+
+
+async def backup_database_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Создает резервную копию работающей базы данных в фоновом потоке."""
+    from db_backup import create_backup
+    try:
+        if not await asyncio.to_thread(create_backup):
+            logger.warning("Scheduled database backup failed")
+    except Exception as e:
+        logger.error(f"Error running scheduled backup: {e}", exc_info=True)
+
+
+async def optimize_achievement_images() -> None:
+    """Готовит облегченные варианты изображений достижений в фоновом потоке."""
+    try:
+        await asyncio.to_thread(optimize_assets, [achievement['image'] for achievement in ACHIEVEMENTS])
+    except Exception as e:
+        logger.error(f"Error optimizing achievement images: {e}", exc_info=True)
+
+
+def _bot_commands_hash(bot_id: int) -> str:
+    """Hashes the command list together with the bot ID (a new token means a new bot)."""
+    payload = json.dumps([bot_id, [(command.command, command.description) for command in BOT_COMMANDS]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def register_bot_commands(bot) -> None:
+    """Устанавливает команды бота, только если список изменился с последней регистрации."""
+    commands_hash = _bot_commands_hash(bot.id)
+    try:
+        with open(BOT_COMMANDS_HASH_FILE, encoding="utf-8") as hash_file:
+            if hash_file.read().strip() == commands_hash:
+                logger.info("Bot commands unchanged, skipping set_my_commands")
+                return
+    except OSError:
+        pass
+
+    # Устанавливаем команды бота для всех чатов
+    await bot.set_my_commands(BOT_COMMANDS)
+    try:
+        with open(BOT_COMMANDS_HASH_FILE, "w", encoding="utf-8") as hash_file:
+            hash_file.write(commands_hash)
+    except OSError as e:
+        logger.warning(f"Could not store bot commands hash: {e}")
+    logger.info("Bot commands set successfully")
 
 
 async def post_init(application: Application) -> None:
     """Устанавливает команды бота после инициализации и планирует завершение конкурса."""
-    bot_commands = [
-        BotCommand("start", "Начать участие в челлендже"),
-        BotCommand("info", "Информация об участии в челлендже"),
-        BotCommand("rules", "Правила пивного челленджа"),
-        BotCommand("leaderboard", "Показать таблицу лидеров"),
-        BotCommand("admin", "Перейти в режим администратора"),
-        BotCommand("announce_winners", "Объявить победителей конкурса (только для админов)"),
-        BotCommand("import_users", "Импортировать список участников (только для админов)"),
-        BotCommand("change_leaderboard", "Изменить объем выпитого пива у участника (только для админов)"),
-        BotCommand("check_submission", "Просмотреть фото участника (только для админов)"),
-        BotCommand("delete_user", "Удалить участника (только для админов)"),
-        BotCommand("list_users", "Показать список участников (только для админов)")
-    ]
+    # bot_data уже загружен из persistence в Application.initialize
+    restored_admins = restore_admin_sessions(application.bot_data)
+    if restored_admins:
+        logger.info(f"Restored {restored_admins} admin sessions")
     
-    # Устанавливаем команды бота для всех чатов
-    await application.bot.set_my_commands(bot_commands)
+    with startup_phase("register_commands"):
+        try:
+            await register_bot_commands(application.bot)
+        except Exception as e:
+            # Команды в меню не критичны для работы бота
+            logger.error(f"Error setting bot commands: {e}", exc_info=True)
+    
+    # В режиме опроса HTTP-сервер нужен только для проверки работоспособности на Render.com;
+    # в режиме вебхука его запускает web_server.run_webhook
+    if not web_server.WEBHOOK_MODE:
+        with startup_phase("http_server"):
+            await web_server.start(application, webhook=False)
+    
+    # Запускаем очередь исходящих сообщений в групповой чат
+    outbound_queue.start(application.bot)
+    
+    # Оптимизируем изображения достижений, не задерживая запуск: до готовности отправляются исходники
+    application.create_task(optimize_achievement_images())
+    
+    # Периодически сверяем индекс рейтинга в памяти с таблицей user_totals
+    application.job_queue.run_repeating(
+        verify_leaderboard_index_job,
+        interval=LEADERBOARD_INDEX_CHECK_INTERVAL,
+        first=LEADERBOARD_INDEX_CHECK_INTERVAL,
+    )
+    
+    # Резервные копии по расписанию. Первая делается в фоне через STARTUP_BACKUP_DELAY секунд
+    # после начала опроса Telegram, чтобы не задерживать ответы после запуска
+    if BACKUP_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            backup_database_job,
+            interval=BACKUP_INTERVAL,
+            first=STARTUP_BACKUP_DELAY,
+        )
+    else:
+        application.job_queue.run_once(backup_database_job, when=STARTUP_BACKUP_DELAY)
+    
+    # Очередь задач запускается после начала опроса, поэтому эта задача отмечает конец запуска
+    application.job_queue.run_once(startup_complete_job, when=0)
+    
+    # Периодический checkpoint WAL-файла базы данных
+    application.job_queue.run_repeating(
+        checkpoint_wal_job,
+        interval=WAL_CHECKPOINT_INTERVAL,
+        first=WAL_CHECKPOINT_INTERVAL,
+    )
+    
+    # Сессии пользователей, не присылавших обновлений дольше SESSION_TTL, удаляются
+    application.job_queue.run_repeating(
+        evict_idle_sessions_job,
+        interval=SESSION_EVICT_INTERVAL,
+        first=SESSION_EVICT_INTERVAL,
+    )
+    
+    # Записи журнала изменений попадают на диск не позже чем через JOURNAL_FSYNC_INTERVAL секунд
+    application.job_queue.run_repeating(
+        sync_change_journal_job,
+        interval=JOURNAL_FSYNC_INTERVAL,
+        first=JOURNAL_FSYNC_INTERVAL,
+    )
     
     # Больше не отправляем сообщение с кнопкой автоматически при запуске
     # await send_leaderboard_button_to_group(application)
@@ -193,8 +339,15 @@ async def post_init(application: Application) -> None:
             logger.warning("Contest end date is in the past, not scheduling announcement")
     except Exception as e:
         logger.error(f"Error scheduling contest end: {e}", exc_info=True)
-    
-    logger.info("Bot commands set successfully")
+
+
+async def post_stop(application: Application) -> None:
+    """Отправляет оставшиеся в очереди сообщения перед остановкой бота."""
+    # Сначала ставим в очередь недособранный альбом заявок, чтобы он не потерялся
+    submission_digest.flush()
+    await outbound_queue.stop()
+    logger.info(f"Outbound queue stopped: {outbound_queue.get_metrics()}")
+    await web_server.stop()
 
 
 async def announce_winners_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -204,7 +357,7 @@ async def announce_winners_command(update: Update, context: ContextTypes.DEFAULT
     
     # Проверка на администратора
     try:
-        chat_member = await context.bot.get_chat_member(chat_id, user.id)
+        chat_member = await chat_cache.get_chat_member(context.bot, chat_id, user.id)
         if chat_member.status not in ['administrator', 'creator']:
             await update.message.reply_text("Эта команда доступна только администраторам.")
             return
@@ -235,64 +388,55 @@ async def announce_winners_command(update: Update, context: ContextTypes.DEFAULT
         logger.error(f"Failed to delete command message: {delete_error}", exc_info=True)
 
 
-def start_http_server():
-    """Запускает простой HTTP-сервер, чтобы Render.com не отключал сервис из-за отсутствия открытых портов."""
-    # Определяем порт из переменной окружения или используем 8080 по умолчанию
-    port = int(os.environ.get("PORT", 8080))
-    
-    # Создаем простой HTTP-обработчик
-    class SimpleHandler(http.server.SimpleHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            
-            # Отправляем базовое сообщение
-            message = "Beer Challenge Bot is running! 🍺"
-            self.wfile.write(message.encode())
-            return
-        
-        # Чтобы уменьшить логирование каждого запроса
-        def log_message(self, format, *args):
-            if args[1] != '200':  # Логирование только ошибок, не успешных запросов
-                return http.server.SimpleHTTPRequestHandler.log_message(self, format, *args)
-    
-    # Создаем и запускаем сервер в отдельном потоке
-    try:
-        httpd = socketserver.TCPServer(("", port), SimpleHandler)
-        thread = threading.Thread(target=httpd.serve_forever)
-        thread.daemon = True  # Чтобы поток закрывался вместе с главным процессом
-        thread.start()
-        logger.info(f"Started HTTP server on port {port}")
-    except Exception as e:
-        logger.error(f"Failed to start HTTP server: {e}", exc_info=True)
-
-
 def main() -> None:
     """Start the bot."""
+    startup_timings["imports"] = time.perf_counter() - PROCESS_STARTED
+    logger.info(f"Startup phase imports: {startup_timings['imports'] * 1000:.0f}ms")
+
     # Load environment variables from .env file
     load_dotenv()
 
-    # Создаем резервную копию базы данных при каждом запуске
-    try:
-        from db_backup import create_backup
-        if create_backup():
-            logger.info("База данных успешно сохранена в резервную копию")
-        else:
-            logger.warning("Не удалось создать резервную копию базы данных")
-    except Exception as e:
-        logger.error(f"Ошибка при создании резервной копии БД: {e}", exc_info=True)
+    # Резервная копия при запуске больше не делается здесь: ее снимает фоновая задача
+    # после начала опроса Telegram (см. STARTUP_BACKUP_DELAY в post_init)
 
     # Create database tables if they don't exist
     logger.info("Creating database tables if they don't exist...")
-    init_db()
+    with startup_phase("init_db"):
+        init_db()
+        ensure_user_totals()
     logger.info("Database tables checked/created.")
 
+    # Загружаем рейтинг участников в память
+    with startup_phase("warm_leaderboard_index"):
+        with SessionLocal() as db:
+            ranked_users = warm_leaderboard_index(db)
+    logger.info(f"Leaderboard index warmed with {ranked_users} users.")
+
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(BOT_TOKEN).build()
+    with startup_phase("build_application"):
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            # Запросы к Bot API замеряются для /metrics; пулы соединений как у построителя по умолчанию
+            .request(metrics.MetricsHTTPXRequest(connection_pool_size=256))
+            .get_updates_request(metrics.MetricsHTTPXRequest(connection_pool_size=1))
+            # user_data, bot_data и состояния диалогов сохраняются в базе между перезапусками
+            .persistence(SQLitePersistence())
+            # context.user_data — UserSession с фиксированным набором полей (user_session.py)
+            .context_types(ContextTypes(user_data=UserSession))
+            .build()
+        )
 
     # Регистрируем функцию post_init для выполнения после инициализации
     application.post_init = post_init
+    application.post_stop = post_stop
+
+    # Ограничение частоты: лишние обновления отклоняются раньше всех остальных обработчиков
+    # (ответы внутри диалогов не ограничиваются, иначе диалог молча остановится)
+    application.add_handler(RateLimitHandler(conversations=(
+        beer_tracking_conv_handler, admin_conv_handler, change_leaderboard_conv_handler,
+        check_submission_conv_handler, import_users_conv_handler, delete_user_conv_handler,
+    )), group=RATE_LIMIT_HANDLER_GROUP)
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
@@ -311,13 +455,22 @@ def main() -> None:
     
     # Добавляем команду для показа списка участников
     application.add_handler(CommandHandler("list_users", list_users_command))
+    
+    # Добавляем команду для просмотра медленных обновлений
+    application.add_handler(CommandHandler("slow_updates", slow_updates_command))
 
     # Add handlers for the buttons
     application.add_handler(MessageHandler(filters.TEXT & filters.Regex('^Выпил пиво$'), prompt_for_photo))
     application.add_handler(MessageHandler(filters.TEXT & filters.Regex('^Таблица лидеров$'), show_leaderboard))
     
+    # Сброс кеша метаданных чатов при изменении прав и закреплении сообщений
+    register_chat_cache_handlers(application)
+    
     # Добавляем обработчик для inline-кнопки таблицы лидеров
     application.add_handler(CallbackQueryHandler(show_leaderboard_button, pattern="^show_leaderboard$"))
+    
+    # Добавляем обработчик кнопок навигации по страницам таблицы лидеров
+    application.add_handler(leaderboard_navigation_handler)
 
     # Add the conversation handler for beer tracking (starts with photo)
     application.add_handler(beer_tracking_conv_handler)
@@ -325,18 +478,39 @@ def main() -> None:
     application.add_handler(change_leaderboard_conv_handler)
     application.add_handler(check_submission_conv_handler)
 
-    # Запускаем HTTP-сервер для работы с Render.com
-    start_http_server()
-
     # Регистрируем хендлер для импорта пользователей
     application.add_handler(import_users_conv_handler)
     
     # Регистрируем хендлер для удаления пользователей
     application.add_handler(delete_user_conv_handler)
 
+    # Метрики для /metrics: длительность обработчиков, SQL-запросы и глубина очередей
+    metrics.instrument_handlers(application)
+    # Трассировка обновлений: отрезки БД и Bot API, журнал медленных обновлений
+    tracing.instrument_handlers(application)
+    metrics.instrument_engine(engine)
+    metrics.register_queue_gauges(application, outbound_queue, pending_db_jobs, submission_digest)
+    metrics.register_cache_gauges("leaderboard_render", get_render_cache_stats)
+    metrics.register_cache_gauges("chat_metadata", chat_cache.get_stats)
+
     # Run the bot until the user presses Ctrl-C
-    logger.info("Starting bot...")
-    application.run_polling()
+    if web_server.WEBHOOK_MODE:
+        logger.info("Starting bot in webhook mode...")
+        asyncio.run(web_server.run_webhook(application))
+    else:
+        logger.info("Starting bot in polling mode...")
+        # Как и вебхук, получаем все типы обновлений: chat_member нужен для сброса кеша прав
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    # Дожидаемся завершения операций с БД, поставленных в очередь до остановки
+    shutdown_db_executor()
+    # Последние записи журнала изменений сбрасываем на диск
+    change_journal.close()
+    # Переносим WAL в основной файл, чтобы на диске осталась одна целостная база
+    try:
+        checkpoint_wal("TRUNCATE")
+    except Exception as e:
+        logger.error(f"Error running final WAL checkpoint: {e}", exc_info=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
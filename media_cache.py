@@ -0,0 +1,111 @@
+# media_cache.py
+"""
+Отправка изображений достижений с повторным использованием Telegram file_id.
+
+Первая отправка загружает файл в Telegram, полученный file_id сохраняется в
+таблице media_file_cache вместе с SHA-256 содержимого. Следующие отправки
+передают только file_id. Если содержимое файла изменилось, хеш не совпадет
+и файл будет загружен заново.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from telegram import Bot, Message
+from telegram.error import BadRequest
+
+from db_utils import run_db, get_cached_file_ids, store_file_id, forget_file_id
+
+logger = logging.getLogger(__name__)
+
+# (путь, mtime_ns, размер) -> SHA-256, чтобы не читать файл при каждой отправке
+_hash_cache: Dict[Tuple[str, int, int], str] = {}
+
+# Фрагменты текста BadRequest, означающие недействительный или просроченный file_id.
+# Остальные ошибки (чат не найден, длинная подпись, нет прав) не связаны с кешем
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference expired")
+
+# asset_key -> (content_hash, file_id); загружается из БД при первом обращении
+_file_ids: Optional[Dict[str, Tuple[str, str]]] = None
+_file_ids_lock = asyncio.Lock()
+
+
+def _read_asset(path: str) -> Tuple[str, Optional[bytes]]:
+    """Returns the content hash of the file and its bytes if they had to be read."""
+    stat = os.stat(path)
+    stat_key = (path, stat.st_mtime_ns, stat.st_size)
+    content_hash = _hash_cache.get(stat_key)
+    if content_hash is not None:
+        return content_hash, None
+    with open(path, 'rb') as asset:
+        data = asset.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    _hash_cache[stat_key] = content_hash
+    return content_hash, data
+
+
+def is_stale_file_id_error(error: BadRequest) -> bool:
+    """Returns True if Telegram rejected the photo because the file_id itself is invalid or expired."""
+    message = str(error).lower()
+    return any(fragment in message for fragment in STALE_FILE_ID_ERRORS)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as asset:
+        return asset.read()
+
+
+async def _load_file_ids() -> Dict[str, Tuple[str, str]]:
+    global _file_ids
+    async with _file_ids_lock:
+        if _file_ids is None:
+            _file_ids = await run_db(get_cached_file_ids)
+            logger.info(f"Loaded {len(_file_ids)} cached media file_ids")
+    return _file_ids
+
+
+async def send_cached_photo(bot: Bot, chat_id: int, path: str, caption: Optional[str] = None) -> Message:
+    """
+    Отправляет изображение, используя сохраненный file_id, если содержимое файла не менялось.
+
+    Args:
+        bot (Bot): Экземпляр бота
+        chat_id (int): ID чата
+        path (str): Путь к файлу изображения
+        caption (str, optional): Подпись к фото
+
+    Returns:
+        Message: Отправленное сообщение
+    """
+    asset_key = os.path.basename(path)
+    content_hash, data = await asyncio.to_thread(_read_asset, path)
+    file_ids = await _load_file_ids()
+
+    cached = file_ids.get(asset_key)
+    if cached and cached[0] == content_hash:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=cached[1], caption=caption)
+        except BadRequest as e:
+            if not is_stale_file_id_error(e):
+                # Повторная загрузка не поможет, а сохраненный file_id по-прежнему верен
+                raise
+            # file_id мог стать недействительным (например, при смене токена бота)
+            logger.warning(f"Cached file_id for {asset_key} was rejected, re-uploading: {e}")
+            file_ids.pop(asset_key, None)
+            await run_db(forget_file_id, asset_key)
+
+    if data is None:
+        data = await asyncio.to_thread(_read_file, path)
+
+    started = time.perf_counter()
+    message = await bot.send_photo(chat_id=chat_id, photo=data, caption=caption, filename=asset_key)
+    logger.info(f"Uploaded {asset_key} ({len(data) / 1024:.0f} KB) in {time.perf_counter() - started:.2f}s")
+
+    if message.photo:
+        file_id = message.photo[-1].file_id
+        file_ids[asset_key] = (content_hash, file_id)
+        await run_db(store_file_id, asset_key, content_hash, file_id)
+    return message
@@ -0,0 +1,321 @@
+# metrics.py
+"""
+Метрики бота в текстовом формате Prometheus (маршрут /metrics в web_server.py).
+
+Собираются:
+    - длительность обработчиков Telegram (по имени callback) и их ошибки;
+    - количество и длительность SQL-запросов (события SQLAlchemy) и ошибки БД;
+    - задержка вызовов Telegram Bot API по методу и их ошибки;
+    - глубина очередей (исходящие сообщения, обновления, потоки БД, альбом заявок);
+    - попадания, промахи и размер кешей в памяти.
+
+Счетчики и гистограммы — это словари с числами под одной блокировкой, поэтому
+замер стоит несколько микросекунд и его можно не отключать в продакшене.
+Значения очередей считываются только в момент запроса /metrics.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from telegram.ext import Application, ApplicationHandlerStop
+from telegram.request import HTTPXRequest
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах (значения Prometheus по умолчанию и длинный хвост для getUpdates)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Монотонный счетчик с метками."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labels, values)} {value:g}" for values, value in items)
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # метки -> [счетчики корзин (без +Inf), сумма, количество]
+        self._values: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += seconds
+            state[2] += 1
+
+    def count(self, *label_values: str) -> int:
+        state = self._values.get(label_values)
+        return state[2] if state else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((values, (list(state[0]), state[1], state[2])) for values, state in self._values.items())
+        for values, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Gauge:
+    """Значение, вычисляемое функцией в момент запроса метрик (kind="counter" для готовых счетчиков)."""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            lines.append(f"{self.name} {float(self.read()):g}")
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} is unavailable: {e}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        return self.register(Histogram(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float], kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, documentation, read, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_duration = registry.histogram(
+    "beerbot_handler_duration_seconds", "Time spent in Telegram update handlers.", ("handler",))
+handler_errors = registry.counter(
+    "beerbot_handler_errors_total", "Exceptions raised by Telegram update handlers.", ("handler",))
+db_query_duration = registry.histogram(
+    "beerbot_db_query_duration_seconds", "SQL statement execution time.", ("statement",))
+db_errors = registry.counter(
+    "beerbot_db_errors_total", "SQL statements that raised an error.", ("statement",))
+telegram_api_duration = registry.histogram(
+    "beerbot_telegram_api_duration_seconds", "Telegram Bot API call latency.", ("method",))
+telegram_api_errors = registry.counter(
+    "beerbot_telegram_api_errors_total", "Telegram Bot API calls that failed or returned an error status.", ("method",))
+
+
+# --- Обработчики Telegram ---
+
+def _handler_name(callback: Callable) -> str:
+    return getattr(callback, "__qualname__", None) or getattr(callback, "__name__", repr(callback))
+
+
+def _timed_callback(callback: Callable) -> Callable:
+    name = _handler_name(callback)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # Штатная остановка цепочки обработчиков, не ошибка
+            raise
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, name)
+
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+
+def instrument_handlers(application: Application) -> int:
+    """
+    Оборачивает callback всех зарегистрированных обработчиков (включая вложенные
+    в ConversationHandler) замером длительности. Вызывается после add_handler.
+
+    Returns:
+        int: Количество обернутых обработчиков
+    """
+    wrapped = 0
+    for handler in tracing.iter_handlers(application):
+        if not getattr(handler.callback, "__metrics_wrapped__", False):
+            handler.callback = _timed_callback(handler.callback)
+            wrapped += 1
+    logger.info(f"Metrics enabled for {wrapped} handlers")
+    return wrapped
+
+
+# --- База данных ---
+
+def _statement_kind(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Подписывается на события SQLAlchemy, чтобы считать запросы и их длительность."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        duration = time.perf_counter() - started
+        db_query_duration.observe(duration, _statement_kind(statement))
+        tracing.record_span("sql", tracing.sql_span_name(statement), started, duration)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        connection = exception_context.connection
+        statement = exception_context.statement or ""
+        if connection is not None and connection.info.get("metrics_started"):
+            started = connection.info["metrics_started"].pop()
+            tracing.record_span("sql", tracing.sql_span_name(statement), started, time.perf_counter() - started,
+                                type(exception_context.original_exception).__name__)
+        db_errors.inc(_statement_kind(statement))
+
+
+# --- Telegram Bot API ---
+
+class MetricsHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий задержку каждого вызова Bot API по имени метода."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        error = None
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            if code >= 400:
+                error = f"HTTP {code}"
+            return code, payload
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            telegram_api_duration.observe(duration, api_method)
+            if error is not None:
+                telegram_api_errors.inc(api_method)
+            # Вызовы внутри обработчика попадают в его трассу (см. tracing.py)
+            tracing.record_span("telegram", api_method, started, duration, error)
+
+
+# --- Очереди ---
+
+def register_queue_gauges(application: Application, outbound_queue, pending_db_jobs: Callable[[], int],
+                          submission_digest=None) -> None:
+    """Регистрирует глубину очередей, которая считывается при каждом запросе /metrics."""
+    registry.gauge("beerbot_outbound_queue_depth", "Messages waiting in the outbound queue.",
+                   lambda: outbound_queue.get_metrics()["depth"])
+    registry.gauge("beerbot_update_queue_depth", "Telegram updates waiting to be processed.",
+                   application.update_queue.qsize)
+    registry.gauge("beerbot_db_executor_queue_depth", "Database jobs waiting for a worker thread.",
+                   pending_db_jobs)
+    if submission_digest is not None:
+        registry.gauge("beerbot_submission_digest_pending", "Submissions waiting to be sent as an album.",
+                       lambda: len(submission_digest))
+    # Счетчики очереди уже ведет сама очередь, здесь они только публикуются
+    for key in ("sent", "failed", "dropped", "retry_after"):
+        registry.gauge(f"beerbot_outbound_{key}_total", f"Outbound queue messages {key.replace('_', ' ')} since start.",
+                       lambda key=key: outbound_queue.get_metrics()[key], kind="counter")
+    # Задержка от постановки в очередь до успешной отправки по последним 1000 сообщениям
+    for quantile in ("p50", "p99"):
+        registry.gauge(f"beerbot_outbound_send_latency_{quantile}_seconds",
+                       f"Outbound message {quantile} latency from enqueue to successful send (last 1000 sends).",
+                       lambda quantile=quantile: outbound_queue.get_metrics()[f"latency_{quantile}"])
+
+
+# --- Кеши ---
+
+def register_cache_gauges(cache: str, get_stats: Callable[[], Dict[str, int]]) -> None:
+    """
+    Публикует счетчики кеша из get_stats(): ключ size — как gauge
+    beerbot_<cache>_cache_size, остальные — как счетчики beerbot_<cache>_cache_<key>_total.
+    """
+    for key in get_stats():
+        if key == "size":
+            registry.gauge(f"beerbot_{cache}_cache_size", f"Entries in the {cache.replace('_', ' ')} cache.",
+                           lambda: get_stats()["size"])
+        else:
+            registry.gauge(f"beerbot_{cache}_cache_{key}_total", f"{cache.replace('_', ' ').capitalize()} cache {key} since start.",
+                           lambda key=key: get_stats()[key], kind="counter")
+
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text exposition format."""
+    return registry.render()
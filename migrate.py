@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Миграции схемы базы данных.
+
+Бот применяет миграции автоматически при запуске (init_db). Скрипт позволяет
+сделать это вручную, посмотреть состояние и проверить планы ключевых запросов:
+    python migrate.py                # применить непримененные миграции
+    python migrate.py --status       # показать примененные и ожидающие миграции
+    python migrate.py --check-plans  # EXPLAIN QUERY PLAN для ключевых запросов
+"""
+import sys
+import argparse
+import logging
+
+from database.database import engine, init_db
+from database.migrations import MIGRATIONS, applied_versions, check_query_plans
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--status', action='store_true', help='Показать примененные и ожидающие миграции')
+    group.add_argument('--check-plans', action='store_true', help='Проверить, что ключевые запросы используют индексы')
+
+    args = parser.parse_args()
+
+    if args.status:
+        applied = applied_versions(engine)
+        for migration in sorted(MIGRATIONS):
+            state = "применена" if migration.version in applied else "ожидает"
+            print(f"{migration.version:>3}. {migration.description} — {state}")
+
+    elif args.check_plans:
+        problems = check_query_plans(engine)
+        if problems:
+            print(f"Найдено регрессий планов запросов: {len(problems)}")
+            for problem in problems:
+                print(f"- {problem}")
+            sys.exit(1)
+        print("Все ключевые запросы используют индексы.")
+
+    else:
+        # init_db создает недостающие таблицы и применяет миграции
+        applied_before = applied_versions(engine)
+        init_db()
+        applied_now = sorted(applied_versions(engine) - applied_before)
+        print(f"Применено миграций: {len(applied_now)} {applied_now if applied_now else ''}".rstrip())
+
+if __name__ == "__main__":
+    main()
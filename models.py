@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import create_engine, Column, Integer, String, Float, BigInteger, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, BigInteger, DateTime, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 
@@ -14,6 +14,7 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     beer_entries = relationship("BeerEntry", back_populates="user")
+    totals = relationship("UserTotal", back_populates="user", uselist=False)
 
     def __repr__(self):
         return f"<User(id={self.id}, username='{self.username}')>"
@@ -29,5 +30,49 @@ class BeerEntry(Base):
 
     user = relationship("User", back_populates="beer_entries")
 
+    # Те же индексы добавляют миграции 2 и 3 в database/migrations.py для существующих баз
+    __table_args__ = (
+        Index('ix_beer_entries_user_id_submitted_at', 'user_id', 'submitted_at'),
+        Index('ix_beer_entries_submitted_at', 'submitted_at'),
+    )
+
+    def __repr__(self):
+        return f"<BeerEntry(id={self.id}, user_id={self.user_id}, volume={self.volume_liters})>"
+
+class UserTotal(Base):
+    """Агрегат по записям пользователя, обновляется в той же транзакции, что и beer_entries."""
+    __tablename__ = 'user_totals'
+
+    user_id = Column(BigInteger, ForeignKey('users.id'), primary_key=True)
+    total_volume = Column(Float, nullable=False, default=0.0, index=True)
+    entry_count = Column(Integer, nullable=False, default=0)
+    last_submitted_at = Column(DateTime(timezone=True), nullable=True)
+
+    user = relationship("User", back_populates="totals")
+
+    def __repr__(self):
+        return f"<UserTotal(user_id={self.user_id}, total={self.total_volume}, entries={self.entry_count})>"
+
+class MediaFileCache(Base):
+    """Telegram file_id загруженных ассетов, чтобы не отправлять один и тот же файл повторно."""
+    __tablename__ = 'media_file_cache'
+
+    asset_key = Column(String, primary_key=True)  # Имя файла в папке assets
+    content_hash = Column(String, nullable=False)  # SHA-256 содержимого на момент загрузки
+    file_id = Column(String, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<MediaFileCache(asset_key='{self.asset_key}', content_hash='{self.content_hash[:12]}')>"
+
+class PersistentData(Base):
+    """Данные бота между перезапусками: user_data, bot_data и состояния диалогов (см. bot_persistence.py)."""
+    __tablename__ = 'bot_persistence'
+
+    namespace = Column(String, primary_key=True)  # user_data, bot_data или conversation:<имя>
+    key = Column(String, primary_key=True)  # ID пользователя или ключ диалога в JSON
+    data = Column(Text, nullable=False)  # Значение в JSON
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
     def __repr__(self):
-        return f"<BeerEntry(id={self.id}, user_id={self.user_id}, volume={self.volume_liters})>"
\ No newline at end of file
+        return f"<PersistentData(namespace='{self.namespace}', key='{self.key}')>"
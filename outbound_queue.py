@@ -0,0 +1,296 @@
+# outbound_queue.py
+"""
+Очередь исходящих сообщений в групповой чат.
+
+Обработчики ставят отправку в очередь и сразу возвращаются. Фоновая задача
+отправляет сообщения по приоритету (победители > достижения > заявки),
+соблюдая лимиты Telegram через token bucket на каждый чат и общий лимит бота.
+При RetryAfter чат ставится на паузу на указанное Telegram время, а сообщение
+возвращается в очередь. Размер очереди ограничен: при переполнении вытесняются
+сообщения с самым низким приоритетом.
+"""
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньшее значение отправляется раньше
+PRIORITY_WINNERS = 0
+PRIORITY_ACHIEVEMENT = 1
+PRIORITY_LEADERBOARD = 2
+PRIORITY_SUBMISSION = 3
+
+# Лимиты Telegram: не более ~20 сообщений в минуту в одну группу и ~30 в секунду всего
+GROUP_RATE_PER_SECOND = 20 / 60
+GROUP_BURST = 5
+PRIVATE_RATE_PER_SECOND = 1.0
+PRIVATE_BURST = 3
+GLOBAL_RATE_PER_SECOND = 25.0
+GLOBAL_BURST = 25
+
+MAX_QUEUE_SIZE = 1000
+MAX_ATTEMPTS = 5
+# Пауза перед повтором при сетевой ошибке (умножается на номер попытки)
+NETWORK_RETRY_DELAY = 2.0
+
+SendCallable = Callable[[Bot], Awaitable[Any]]
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не более burst накопленных."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at", "blocked_until")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Returns how long to wait until a token is available (0 if it is available now)."""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float) -> None:
+        """Pauses the bucket (used for RetryAfter) and drops accumulated tokens."""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "send", "description", "enqueued_at", "attempts", "not_before")
+
+    def __init__(self, priority: int, seq: int, chat_id: int, send: SendCallable, description: str):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.send = send
+        self.description = description
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.not_before = 0.0
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class OutboundQueue:
+    """Очередь отправки с приоритетами, ограничением скорости и повторами."""
+
+    def __init__(self, max_size: int = MAX_QUEUE_SIZE):
+        self.max_size = max_size
+        self._heap: List[_Job] = []
+        self._seq = itertools.count()
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._global_bucket = TokenBucket(GLOBAL_RATE_PER_SECOND, GLOBAL_BURST)
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._stats = {"enqueued": 0, "sent": 0, "failed": 0, "dropped": 0, "retry_after": 0, "retries": 0}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def start(self, bot: Bot) -> None:
+        """Starts the background sender (call from a running event loop)."""
+        self._bot = bot
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run(), name="outbound_queue")
+            logger.info("Outbound message queue started")
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Tries to send what is left in the queue, then stops the sender."""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while self._heap and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._heap:
+            logger.warning(f"Outbound queue stopped with {len(self._heap)} unsent messages")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def enqueue(self, chat_id: int, send: SendCallable, priority: int = PRIORITY_SUBMISSION, description: str = "") -> bool:
+        """
+        Ставит отправку в очередь.
+
+        Args:
+            chat_id (int): Чат, в который идет сообщение (для лимита на чат)
+            send: Корутина-функция вида send(bot), выполняющая отправку и
+                  при необходимости последующие действия с результатом
+            priority (int): Один из PRIORITY_* (меньше — важнее)
+            description (str): Описание для логов
+
+        Returns:
+            bool: False, если очередь переполнена сообщениями не ниже по приоритету
+        """
+        if len(self._heap) >= self.max_size:
+            worst = max(self._heap)
+            if worst.priority <= priority:
+                self._stats["dropped"] += 1
+                logger.warning(f"Outbound queue full, dropping {description or 'message'} for chat {chat_id}")
+                return False
+            self._heap.remove(worst)
+            heapq.heapify(self._heap)
+            self._stats["dropped"] += 1
+            logger.warning(f"Outbound queue full, evicted {worst.description or 'message'} for chat {worst.chat_id}")
+
+        heapq.heappush(self._heap, _Job(priority, next(self._seq), chat_id, send, description))
+        self._stats["enqueued"] += 1
+        self._wakeup.set()
+        return True
+
+    def enqueue_delete(self, chat_id: int, message_id: int, priority: int = PRIORITY_SUBMISSION) -> bool:
+        """
+        Ставит удаление сообщения в очередь отдельным заданием.
+
+        Каждое задание расходует один токен лимита чата, поэтому удаления после
+        репоста учитываются как отдельные вызовы Bot API, а RetryAfter на удалении
+        не приводит к повторной отправке уже отправленного сообщения.
+        """
+        async def delete(bot: Bot) -> None:
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+                logger.info(f"Deleted message {message_id} in chat {chat_id}")
+            except BadRequest as e:
+                # Сообщение уже удалено или слишком старое: повтор не поможет
+                logger.warning(f"Could not delete message {message_id} in chat {chat_id}: {e}")
+
+        return self.enqueue(chat_id, delete, priority, f"deletion of message {message_id}")
+
+    def _bucket_for(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные ID принадлежат группам и каналам
+            if chat_id < 0:
+                bucket = TokenBucket(GROUP_RATE_PER_SECOND, GROUP_BURST)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE_PER_SECOND, PRIVATE_BURST)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self, now: float) -> Tuple[Optional[_Job], float]:
+        """Returns the most important job that may be sent now, or the time to wait for one."""
+        global_wait = self._global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        shortest_wait = float("inf")
+        # Очередь ограничена по размеру, поэтому сортировка на каждом шаге дешевая
+        for job in sorted(self._heap):
+            wait = max(job.not_before - now, self._bucket_for(job.chat_id).wait_time(now))
+            if wait <= 0:
+                return job, 0.0
+            shortest_wait = min(shortest_wait, wait)
+        return None, shortest_wait
+
+    async def _run(self) -> None:
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            job, wait = self._next_ready(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    # Новое сообщение может оказаться в другом чате и быть готовым раньше
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._heap.remove(job)
+            heapq.heapify(self._heap)
+            self._global_bucket.consume(now)
+            self._bucket_for(job.chat_id).consume(now)
+            await self._dispatch(job)
+
+    async def _dispatch(self, job: _Job) -> None:
+        job.attempts += 1
+        try:
+            await job.send(self._bot)
+        except RetryAfter as e:
+            seconds = _retry_after_seconds(e)
+            self._stats["retry_after"] += 1
+            self._bucket_for(job.chat_id).block(time.monotonic(), seconds)
+            logger.warning(f"Flood control for chat {job.chat_id}, pausing {seconds:.0f}s ({job.description})")
+            self._requeue(job)
+        except (BadRequest, Forbidden) as e:
+            # Повтор не поможет: неверный запрос или бот удален из чата
+            self._stats["failed"] += 1
+            logger.error(f"Failed to send {job.description or 'message'} to chat {job.chat_id}: {e}")
+        except NetworkError as e:
+            logger.warning(f"Network error sending {job.description or 'message'} to chat {job.chat_id}: {e}")
+            job.not_before = time.monotonic() + NETWORK_RETRY_DELAY * job.attempts
+            self._requeue(job)
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.error(f"Unexpected error sending {job.description or 'message'} to chat {job.chat_id}: {e}", exc_info=True)
+        else:
+            self._stats["sent"] += 1
+            self._latencies.append(time.monotonic() - job.enqueued_at)
+
+    def _requeue(self, job: _Job) -> None:
+        if job.attempts >= MAX_ATTEMPTS:
+            self._stats["failed"] += 1
+            logger.error(f"Giving up on {job.description or 'message'} for chat {job.chat_id} after {job.attempts} attempts")
+            return
+        self._stats["retries"] += 1
+        # Сохраняем исходный порядковый номер, чтобы сообщение не потеряло место в очереди
+        heapq.heappush(self._heap, job)
+
+    def get_metrics(self) -> Dict[str, float]:
+        """Возвращает глубину очереди, счетчики и задержку от постановки до отправки."""
+        latencies = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return dict(
+            self._stats,
+            depth=len(self._heap),
+            latency_p50=pct(0.50),
+            latency_p99=pct(0.99),
+            latency_max=latencies[-1] if latencies else 0.0,
+        )
+
+
+# Общая очередь процесса; запускается в post_init
+outbound_queue = OutboundQueue()
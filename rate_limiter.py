@@ -0,0 +1,270 @@
+# rate_limiter.py
+"""
+Ограничение частоты обновлений: маркерные корзины (token bucket) на пользователя,
+на чат и общая, отдельно для каждого вида обновлений.
+
+RateLimitHandler регистрируется в группе RATE_LIMIT_HANDLER_GROUP раньше всех
+остальных обработчиков. Решение принимается в check_update, то есть еще до
+создания контекста: пропущенное обновление не стоит ничего, кроме проверки
+корзин, а лишнее останавливается через ApplicationHandlerStop до любых
+запросов к БД и Bot API. На лишнее нажатие inline-кнопки бот отвечает
+коротким уведомлением не чаще раза в RATE_LIMIT_NOTICE_INTERVAL секунд.
+
+Вид обновления определяет classify_update (фото, клавиатура объема, таблица
+лидеров, команды администратора и т.д.). Обычный текст пользователя, у которого
+идет диалог (ввод пароля, списка участников, нового объема), не ограничивается:
+отклоненное сообщение диалог бы не увидел и молча остановился.
+
+Лимиты задаются в RATE_LIMITS и переопределяются переменной окружения
+RATE_LIMITS в JSON, например:
+
+    RATE_LIMITS='{"photo": {"user": [3, 30], "chat": [20, 10]}, "leaderboard": {"global": null}}'
+
+где [N, S] — не больше N обновлений за S секунд (с запасом N подряд), null — без лимита.
+"""
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, BaseHandler, ContextTypes, ConversationHandler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Группа обработчика: выполняется раньше сброса кеша чатов (-1) и основных обработчиков (0)
+RATE_LIMIT_HANDLER_GROUP = -2
+# Как часто отвечать пользователю на отклоненные нажатия кнопок
+RATE_LIMIT_NOTICE_INTERVAL = 5.0
+RATE_LIMIT_NOTICE = "Слишком часто, подождите немного ⏳"
+# Полные (давно не использованные) корзины удаляются, когда их больше этого числа
+BUCKET_PRUNE_THRESHOLD = 10000
+
+# Команды, доступные только администраторам
+ADMIN_COMMANDS = frozenset({
+    "admin", "change_leaderboard", "check_submission", "import_users", "delete_user",
+    "list_users", "slow_updates", "announce_winners",
+})
+LEADERBOARD_TEXT = "Таблица лидеров"
+
+
+class Limit(NamedTuple):
+    """Не больше count обновлений за seconds секунд; запас — count обновлений подряд."""
+    count: float
+    seconds: float
+
+
+class RateRule(NamedTuple):
+    user: Optional[Limit] = None
+    chat: Optional[Limit] = None
+    global_: Optional[Limit] = None
+
+
+RATE_LIMITS: Dict[str, RateRule] = {
+    # Прежний LEADERBOARD_COOLDOWN: одна таблица на пользователя за 5 секунд
+    "leaderboard": RateRule(user=Limit(1, 5), chat=Limit(10, 60), global_=Limit(20, 1)),
+    "leaderboard_page": RateRule(user=Limit(5, 5), chat=Limit(30, 10)),
+    "photo": RateRule(user=Limit(3, 30), chat=Limit(20, 10), global_=Limit(30, 1)),
+    "volume_keyboard": RateRule(user=Limit(5, 5), chat=Limit(30, 10)),
+    "admin": RateRule(user=Limit(10, 10)),
+    "command": RateRule(user=Limit(5, 10), chat=Limit(20, 10), global_=Limit(30, 1)),
+    "message": RateRule(user=Limit(10, 10), chat=Limit(40, 10), global_=Limit(50, 1)),
+}
+
+_SCOPES = {"user": "user", "chat": "chat", "global": "global_"}
+
+
+def _parse_limit(value) -> Optional[Limit]:
+    if value is None:
+        return None
+    count, seconds = value
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f"rate limit must be positive, got {value!r}")
+    return Limit(float(count), float(seconds))
+
+
+def load_rate_limits(overrides: Optional[str] = None) -> Dict[str, RateRule]:
+    """Returns RATE_LIMITS with the per-category overrides from a RATE_LIMITS JSON string applied."""
+    rules = dict(RATE_LIMITS)
+    if not overrides:
+        return rules
+    for category, scopes in json.loads(overrides).items():
+        rule = rules.get(category, RateRule())
+        for scope, value in scopes.items():
+            if scope not in _SCOPES:
+                raise ValueError(f"Unknown rate limit scope {scope!r} for {category!r}, expected user, chat or global")
+            rule = rule._replace(**{_SCOPES[scope]: _parse_limit(value)})
+        rules[category] = rule
+    return rules
+
+
+def classify_update(update: Update) -> Optional[str]:
+    """Returns the rate limit category of the update; None for updates that are never limited."""
+    if update.callback_query is not None:
+        data = update.callback_query.data or ""
+        if data == "show_leaderboard":
+            return "leaderboard"
+        if data.startswith("lb:"):
+            return "leaderboard_page"
+        # Остальные кнопки — клавиатура выбора объема в handlers/beer_tracking.py
+        return "volume_keyboard"
+
+    message = update.message
+    if message is None:
+        # Изменения участников, редактирования и т.д. не ограничиваются
+        return None
+    if message.photo:
+        return "photo"
+    text = message.text or ""
+    if text.startswith("/"):
+        command = text[1:].split(None, 1)[0].split("@", 1)[0].lower() if len(text) > 1 else ""
+        if command in ADMIN_COMMANDS:
+            return "admin"
+        if command == "leaderboard":
+            return "leaderboard"
+        return "command"
+    if text == LEADERBOARD_TEXT:
+        return "leaderboard"
+    if message.from_user is None:
+        return None
+    return "message"
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """Маркерные корзины по ключам (категория, область, ID)."""
+
+    def __init__(self, rules: Dict[str, RateRule]):
+        self.rules = rules
+        self._buckets: Dict[Tuple[str, str, Optional[int]], _Bucket] = {}
+        self._prune_at = BUCKET_PRUNE_THRESHOLD
+
+    def _refill(self, key, limit: Limit, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(limit.count, now)
+        elif now > bucket.updated:
+            bucket.tokens = min(limit.count, bucket.tokens + (now - bucket.updated) * limit.count / limit.seconds)
+            bucket.updated = now
+        return bucket
+
+    def acquire(self, category: str, user_id: Optional[int], chat_id: Optional[int],
+                now: Optional[float] = None) -> Optional[str]:
+        """
+        Забирает по маркеру из корзин пользователя, чата и общей.
+
+        Маркеры списываются, только если они есть во всех корзинах, поэтому
+        отклоненное обновление не расходует лимиты других областей.
+
+        Returns:
+            Optional[str]: None, если обновление пропущено, иначе область
+            (user, chat или global), лимит которой исчерпан
+        """
+        rule = self.rules.get(category)
+        if rule is None:
+            return None
+        now = time.monotonic() if now is None else now
+        buckets = []
+        for scope, limit, scope_id in (("user", rule.user, user_id), ("chat", rule.chat, chat_id),
+                                       ("global", rule.global_, None)):
+            if limit is None or (scope != "global" and scope_id is None):
+                continue
+            bucket = self._refill((category, scope, scope_id), limit, now)
+            if bucket.tokens < 1.0:
+                return scope
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.tokens -= 1.0
+        if len(self._buckets) > self._prune_at:
+            self.prune(now)
+        return None
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Удаляет корзины, которые успели наполниться: они ничем не отличаются от новых."""
+        now = time.monotonic() if now is None else now
+        full = []
+        for key, bucket in self._buckets.items():
+            limit = getattr(self.rules[key[0]], _SCOPES[key[1]])
+            if limit is None or bucket.tokens + (now - bucket.updated) * limit.count / limit.seconds >= limit.count:
+                full.append(key)
+        for key in full:
+            del self._buckets[key]
+        self._prune_at = max(BUCKET_PRUNE_THRESHOLD, 2 * len(self._buckets))
+        return len(full)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+rate_limiter = RateLimiter(load_rate_limits(os.environ.get("RATE_LIMITS")))
+
+rate_limited = metrics.registry.counter(
+    "beerbot_rate_limited_total", "Updates rejected by the rate limiter.", ("category", "scope"))
+
+
+class RateLimitHandler(BaseHandler[Update, ContextTypes.DEFAULT_TYPE, None]):
+    """
+    Останавливает обработку обновлений сверх лимита.
+
+    check_update возвращает результат только для отклоненных обновлений, поэтому
+    для пропущенных контекст не создается и callback не вызывается.
+    """
+
+    __slots__ = ("limiter", "conversations", "_notified")
+
+    def __init__(self, limiter: RateLimiter = rate_limiter, conversations: Iterable[ConversationHandler] = ()):
+        super().__init__(self._reject)
+        self.limiter = limiter
+        # Диалоги, текстовые ответы в которых пропускаются без лимита
+        self.conversations = tuple(conversations)
+        # user_id -> время последнего уведомления об ограничении
+        self._notified: Dict[int, float] = {}
+
+    def check_update(self, update: object) -> Optional[Tuple[str, str]]:
+        if not isinstance(update, Update):
+            return None
+        category = classify_update(update)
+        if category is None:
+            return None
+        if category == "message" and self._in_conversation(update):
+            return None
+        user = update.effective_user
+        chat = update.effective_chat
+        scope = self.limiter.acquire(category, user.id if user else None, chat.id if chat else None)
+        if scope is None:
+            return None
+        rate_limited.inc(category, scope)
+        logger.debug(f"Rate limited {category} update {update.update_id} from user {user.id if user else None} ({scope} limit)")
+        return category, scope
+
+    def _in_conversation(self, update: Update) -> bool:
+        """Проверяет, ждет ли какой-либо из диалогов это сообщение как ответ пользователя."""
+        # Точки входа диалогов бота — команды и фото, поэтому обычный текст подходит
+        # диалогу (check_update не None), только если пользователь находится в одном из его состояний
+        return any(handler.check_update(update) is not None for handler in self.conversations)
+
+    async def _reject(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        query = update.callback_query
+        if query is not None:
+            now = time.monotonic()
+            user_id = query.from_user.id
+            if now - self._notified.get(user_id, 0.0) >= RATE_LIMIT_NOTICE_INTERVAL:
+                self._notified[user_id] = now
+                if len(self._notified) > BUCKET_PRUNE_THRESHOLD:
+                    cutoff = now - RATE_LIMIT_NOTICE_INTERVAL
+                    self._notified = {uid: at for uid, at in self._notified.items() if at >= cutoff}
+                try:
+                    await query.answer(RATE_LIMIT_NOTICE)
+                except Exception as e:
+                    logger.debug(f"Could not answer rate limited callback query: {e}")
+        raise ApplicationHandlerStop
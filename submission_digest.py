@@ -0,0 +1,118 @@
+# submission_digest.py
+"""
+Режим дайджеста заявок для группового чата.
+
+Вместо отдельного фото на каждую заявку бот собирает заявки, пришедшие в течение
+окна SUBMISSION_DIGEST_WINDOW секунд, и отправляет их одним альбомом
+(send_media_group, до 10 фото) с общей подписью. Альбом уходит по таймеру,
+сразу при наборе 10 фото и при остановке бота. Отправка идет через
+outbound_queue, поэтому лимиты и повторы при RetryAfter сохраняются.
+
+Режим выключен, если SUBMISSION_DIGEST_WINDOW не задан или равен 0.
+"""
+import asyncio
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from telegram import Bot, InputMediaPhoto
+
+from config import GROUP_CHAT_ID
+from outbound_queue import outbound_queue, PRIORITY_SUBMISSION
+
+logger = logging.getLogger(__name__)
+
+# Окно накопления заявок в секундах; 0 отключает режим дайджеста
+DIGEST_WINDOW = float(os.environ.get("SUBMISSION_DIGEST_WINDOW", "0"))
+
+# Ограничения Telegram для альбома
+MEDIA_GROUP_LIMIT = 10
+CAPTION_LIMIT = 1024
+
+
+class PendingSubmission:
+    """Заявка, ожидающая отправки в составе альбома."""
+
+    __slots__ = ("photo_file_id", "caption_line", "cleanup_messages")
+
+    def __init__(self, photo_file_id: str, caption_line: str, cleanup_messages: List[Tuple[int, int]]):
+        self.photo_file_id = photo_file_id
+        self.caption_line = caption_line
+        # Сообщения (chat_id, message_id), которые удаляются после репоста
+        self.cleanup_messages = cleanup_messages
+
+
+def build_digest_caption(lines: List[str]) -> str:
+    """Собирает общую подпись альбома, укладываясь в лимит подписи Telegram."""
+    if len(lines) == 1:
+        return lines[0][:CAPTION_LIMIT]
+    caption = f"🍻 Новые заявки ({len(lines)}):"
+    for index, line in enumerate(lines):
+        # Оставляем место для строки «…и еще N», если дальше есть другие заявки
+        reserve = len(f"\n…и еще {len(lines)}") if index < len(lines) - 1 else 0
+        if len(caption) + 1 + len(line) + reserve > CAPTION_LIMIT:
+            return caption + f"\n…и еще {len(lines) - index}"
+        caption += "\n" + line
+    return caption
+
+
+class SubmissionDigest:
+    """Накапливает заявки и отправляет их альбомами через очередь исходящих сообщений."""
+
+    def __init__(self, chat_id: Optional[int], window: float = DIGEST_WINDOW):
+        self.chat_id = chat_id
+        self.window = window
+        self._pending: List[PendingSubmission] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.chat_id) and self.window > 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, submission: PendingSubmission) -> None:
+        """Adds a submission; flushes when the album is full, otherwise arms the timer."""
+        self._pending.append(submission)
+        if len(self._pending) >= MEDIA_GROUP_LIMIT:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self) -> None:
+        """Ставит все накопленные заявки в очередь отправки альбомами по 10 фото."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:MEDIA_GROUP_LIMIT]
+            del self._pending[:MEDIA_GROUP_LIMIT]
+            self._enqueue_batch(batch)
+
+    def _enqueue_batch(self, batch: List[PendingSubmission]) -> None:
+        chat_id = self.chat_id
+        caption = build_digest_caption([submission.caption_line for submission in batch])
+        cleanup_messages = [message for submission in batch for message in submission.cleanup_messages]
+
+        async def send_digest(bot: Bot) -> None:
+            if len(batch) == 1:
+                # Альбом должен содержать минимум 2 элемента
+                await bot.send_photo(chat_id=chat_id, photo=batch[0].photo_file_id, caption=caption)
+            else:
+                # Подпись первого элемента отображается как подпись всего альбома
+                media = [
+                    InputMediaPhoto(submission.photo_file_id, caption=caption if index == 0 else None)
+                    for index, submission in enumerate(batch)
+                ]
+                await bot.send_media_group(chat_id=chat_id, media=media)
+            logger.info(f"Submission digest with {len(batch)} photos sent to group chat: {chat_id}")
+            # Удаления — отдельные задания, чтобы каждое расходовало свой токен лимита чата
+            for message_chat_id, message_id in cleanup_messages:
+                outbound_queue.enqueue_delete(message_chat_id, message_id)
+
+        outbound_queue.enqueue(chat_id, send_digest, PRIORITY_SUBMISSION, f"digest of {len(batch)} submissions")
+
+
+# Общий дайджест для группового чата; сбрасывается в post_stop
+submission_digest = SubmissionDigest(GROUP_CHAT_ID)
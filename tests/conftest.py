@@ -0,0 +1,63 @@
+"""Общие фикстуры тестов: база SQLite в памяти, журнал изменений во временной папке."""
+import contextlib
+import os
+
+# config.py требует токен при импорте; обработчики в тестах к Bot API не обращаются
+os.environ.setdefault("BOT_TOKEN", "123456:test-token")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from change_journal import change_journal
+from database.database import SessionLocal, create_sqlite_engine
+from leaderboard_index import leaderboard_index
+from models import Base
+
+
+@pytest.fixture
+def memory_engine():
+    # StaticPool: все сессии видят одну и ту же базу в памяти
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@contextlib.contextmanager
+def _bound_session(engine, tmp_path):
+    """SessionLocal и журнал изменений перенаправлены в engine и во временную папку, индекс рейтинга пуст."""
+    previous_bind = SessionLocal.kw.get("bind")
+    previous_journal = change_journal.path
+    SessionLocal.configure(bind=engine)
+    change_journal.close()
+    change_journal.path = str(tmp_path / "journal" / "changes.jsonl")
+    leaderboard_index.load([])
+    try:
+        with SessionLocal() as session:
+            yield session
+    finally:
+        change_journal.close()
+        change_journal.path = previous_journal
+        SessionLocal.configure(bind=previous_bind)
+        leaderboard_index.load([])
+
+
+@pytest.fixture
+def db(memory_engine, tmp_path):
+    """Сессия базы в памяти (см. _bound_session)."""
+    with _bound_session(memory_engine, tmp_path) as session:
+        yield session
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    """
+    Сессия базы в файле tmp_path/beer_challenge.db с теми же PRAGMA, что у бота
+    (для бэкапов и восстановления, которые работают с файлом через sqlite3).
+    """
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'beer_challenge.db'}")
+    Base.metadata.create_all(bind=engine)
+    with _bound_session(engine, tmp_path) as session:
+        yield session
+    engine.dispose()
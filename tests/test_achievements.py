@@ -0,0 +1,65 @@
+"""Поиск достижений по порогам (bisect): точные пороги, несколько порогов сразу, уменьшение объема."""
+import pytest
+
+from handlers import achievements
+from handlers.achievements import (
+    check_new_achievement, get_achievement_for_volume, get_crossed_achievements, load_achievements,
+)
+
+
+def _definition(volume):
+    return {"volume": volume, "title": f"{volume} л", "message": "", "icon": "🍺", "image": ""}
+
+
+@pytest.fixture
+def thresholds():
+    """Пороги 1, 5, 10, 20 (определения передаются не по порядку)."""
+    original = list(achievements.ACHIEVEMENTS)
+    load_achievements([_definition(10), _definition(1), _definition(20), _definition(5)])
+    yield
+    load_achievements(original)
+
+
+def _volumes(found):
+    return [achievement["volume"] for achievement in found]
+
+
+@pytest.mark.parametrize("old, new, expected", [
+    (0.5, 1.0, [1]),        # ровно на пороге — достижение засчитывается
+    (1.0, 1.5, []),         # порог 1 уже был достигнут
+    (4.99, 5.0, [5]),
+    (0.0, 0.99, []),
+])
+def test_exact_thresholds(thresholds, old, new, expected):
+    assert _volumes(get_crossed_achievements(old, new)) == expected
+
+
+def test_several_thresholds_at_once(thresholds):
+    assert _volumes(get_crossed_achievements(0.0, 12.0)) == [1, 5, 10]
+    assert _volumes(get_crossed_achievements(4.0, 25.0)) == [5, 10, 20]
+    assert check_new_achievement(4.0, 25.0)["volume"] == 20
+
+
+def test_no_crossing(thresholds):
+    assert get_crossed_achievements(6.0, 9.5) == []
+    assert get_crossed_achievements(25.0, 100.0) == []
+    assert check_new_achievement(6.0, 9.5) is None
+
+
+@pytest.mark.parametrize("old, new", [(12.0, 3.0), (5.0, 4.9), (20.0, 0.0), (7.0, 7.0)])
+def test_decreasing_or_equal_totals_cross_nothing(thresholds, old, new):
+    # Правка или удаление записей админом не объявляет достижений
+    assert get_crossed_achievements(old, new) == []
+
+
+@pytest.mark.parametrize("volume, expected", [(0.0, None), (0.99, None), (1.0, 1), (9.99, 5), (10.0, 10), (500.0, 20)])
+def test_achievement_for_volume(thresholds, volume, expected):
+    found = get_achievement_for_volume(volume)
+    assert (found["volume"] if found else None) == expected
+
+
+def test_version_changes_with_definitions(thresholds):
+    version = achievements.achievements_version()
+    load_achievements([_definition(1), _definition(5), _definition(10), _definition(25)])
+    assert achievements.achievements_version() != version
+    assert _volumes(get_crossed_achievements(10.0, 30.0)) == [25]
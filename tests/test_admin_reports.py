@@ -0,0 +1,62 @@
+"""Разбиение отчетов администратора на сообщения: границы частей, длинные строки, заголовок."""
+from admin_reports import build_user_report, chunk_lines
+from db_utils import add_or_update_user, set_user_total_volume
+
+PREFIX = "Часть {}/{}:\n"
+
+
+def test_single_chunk_has_no_part_prefix():
+    assert chunk_lines(["a", "b", "c"], header="H") == ["H\na\nb\nc"]
+    assert chunk_lines(["a", "b"]) == ["a\nb"]
+
+
+def test_empty_input():
+    assert chunk_lines([]) == []
+    assert chunk_lines([], header="H") == ["H"]
+
+
+def test_chunk_filled_exactly_to_limit_is_not_split():
+    # "aaaa\nbbbb" — ровно 9 символов
+    assert chunk_lines(["aaaa", "bbbb"], limit=9) == ["aaaa\nbbbb"]
+
+
+def test_line_that_would_overflow_starts_next_chunk():
+    chunks = chunk_lines(["aaaa", "bbbb", "cc"], limit=9)
+    assert chunks == [PREFIX.format(1, 2) + "aaaa\nbbbb", PREFIX.format(2, 2) + "cc"]
+
+
+def test_lines_are_never_split_at_chunk_boundary():
+    lines = [f"line {i:03d}" for i in range(100)]
+    chunks = chunk_lines(lines, header="Отчет", limit=50)
+    assert len(chunks) > 1
+    bodies = []
+    for index, chunk in enumerate(chunks, start=1):
+        prefix = PREFIX.format(index, len(chunks))
+        assert chunk.startswith(prefix)
+        body = chunk[len(prefix):]
+        assert len(body) <= 50
+        bodies.append(body)
+    assert "\n".join(bodies).split("\n") == ["Отчет"] + lines
+
+
+def test_header_starts_first_chunk_only():
+    chunks = chunk_lines(["xxxx", "yyyy"], header="HEAD", limit=9)
+    assert chunks == [PREFIX.format(1, 2) + "HEAD\nxxxx", PREFIX.format(2, 2) + "yyyy"]
+
+
+def test_overlong_line_is_cut_at_limit():
+    chunks = chunk_lines(["ab", "x" * 12, "cd"], limit=5)
+    bodies = [chunk.split("\n", 1)[1] for chunk in chunks]
+    # Накопленное перед длинной строкой уходит отдельной частью, остаток строки продолжает следующую
+    assert bodies == ["ab", "xxxxx", "xxxxx", "xx\ncd"]
+    assert chunks[0].startswith(PREFIX.format(1, 4))
+
+
+def test_build_user_report(db):
+    assert build_user_report(db, str, "H") == []
+    for user_id in (3, 1, 2):
+        add_or_update_user(db, user_id, f"User{user_id}", None)
+    set_user_total_volume(db, 2, 1.5)
+
+    report = build_user_report(db, lambda row: f"{row[0]}:{row[3]:g}", "Участники", footer="Конец")
+    assert report == ["Участники\n1:0\n2:1.5\n3:0\n\nКонец"]
@@ -0,0 +1,139 @@
+"""Хранилище снимков: снимок → блоки → манифест → восстановление, дедупликация, удаление старых снимков."""
+import os
+import sqlite3
+
+import pytest
+
+import backup_store
+from backup_store import BackupStore, BackupStoreError
+
+
+@pytest.fixture
+def source(tmp_path):
+    """База SQLite примерно из 40 блоков по 4 страницы."""
+    path = str(tmp_path / "source.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, payload BLOB)")
+    connection.executemany("INSERT INTO items VALUES (?, ?)", [(i, os.urandom(1000)) for i in range(600)])
+    connection.commit()
+    connection.close()
+    return path
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup_store, "CHUNK_PAGES", 4)
+    return BackupStore(str(tmp_path / "store"))
+
+
+def _update_row(path, row_id):
+    connection = sqlite3.connect(path)
+    connection.execute("UPDATE items SET payload = ? WHERE id = ?", (os.urandom(1000), row_id))
+    connection.commit()
+    connection.close()
+
+
+def _read(path):
+    with open(path, "rb") as db_file:
+        return db_file.read()
+
+
+def test_snapshot_round_trip(store, source, tmp_path):
+    manifest = store.create_snapshot(source, label="test", metadata={"journal_seq": 7})
+
+    assert manifest["page_size"] == 4096
+    assert manifest["chunk_size"] == 4 * 4096
+    assert manifest["size"] == os.path.getsize(source)
+    assert manifest["new_chunks"] == len(set(manifest["chunks"])) > 10
+    assert manifest["journal_seq"] == 7
+    assert store.get_snapshot(manifest["id"]) == manifest
+    assert store.latest_snapshot() == manifest
+
+    restored = str(tmp_path / "restored.db")
+    assert store.export_snapshot(manifest["id"], restored) == manifest["size"]
+    assert _read(restored) == _read(source)
+    connection = sqlite3.connect(restored)
+    assert connection.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert connection.execute("SELECT count(*) FROM items").fetchone()[0] == 600
+    connection.close()
+
+
+def test_unchanged_blocks_are_stored_once(store, source, tmp_path):
+    first = store.create_snapshot(source)
+    stored = store.stored_bytes()
+
+    again = store.create_snapshot(source)
+    assert again["id"] != first["id"]
+    assert again["chunks"] == first["chunks"]
+    assert again["new_chunks"] == 0
+    assert store.stored_bytes() == stored
+
+    _update_row(source, 300)
+    changed = store.create_snapshot(source)
+    # Меняются заголовок базы (счетчик изменений) и страница со строкой
+    assert 0 < changed["new_chunks"] <= 2
+    assert store.stored_bytes() > stored
+
+    for manifest, expected in ((first, None), (changed, _read(source))):
+        restored = str(tmp_path / f"{manifest['id']}.db")
+        store.export_snapshot(manifest["id"], restored)
+        if expected is not None:
+            assert _read(restored) == expected
+    assert [manifest["id"] for manifest in store.list_snapshots()] == [first["id"], again["id"], changed["id"]]
+
+
+def test_damaged_snapshots_are_rejected(store, source, tmp_path):
+    manifest = store.create_snapshot(source)
+    with pytest.raises(BackupStoreError):
+        store.get_snapshot("missing")
+
+    target = str(tmp_path / "restored.db")
+    chunk_path = store._chunk_path(manifest["chunks"][3])
+    with open(chunk_path, "rb") as chunk_file:
+        original = chunk_file.read()
+    with open(chunk_path, "wb") as chunk_file:
+        chunk_file.write(backup_store.gzip.compress(b"not the original block"))
+    with pytest.raises(BackupStoreError, match="corrupted"):
+        store.export_snapshot(manifest["id"], target)
+    # Недособранный файл не остается на месте восстановления
+    assert not os.path.exists(target)
+    assert not os.path.exists(target + ".tmp")
+
+    os.remove(chunk_path)
+    with pytest.raises(BackupStoreError, match="missing"):
+        store.export_snapshot(manifest["id"], target)
+
+    with open(chunk_path, "wb") as chunk_file:
+        chunk_file.write(original)
+    store.export_snapshot(manifest["id"], target)
+
+
+def test_prune_keeps_latest_snapshots_and_their_chunks(store, source, tmp_path):
+    manifests = []
+    for row_id in (10, 200, 400, 590):
+        manifests.append(store.create_snapshot(source))
+        _update_row(source, row_id)
+
+    assert store.prune(0) == 0
+    assert store.prune(4) == 0
+    removed = store.prune(2)
+
+    kept = manifests[-2:]
+    assert [manifest["id"] for manifest in store.list_snapshots()] == [manifest["id"] for manifest in kept]
+    referenced = {digest for manifest in kept for digest in manifest["chunks"]}
+    only_old = {digest for manifest in manifests[:2] for digest in manifest["chunks"]} - referenced
+    assert removed == len(only_old) > 0
+    for digest in only_old:
+        assert not os.path.exists(store._chunk_path(digest))
+    for manifest in kept:
+        store.export_snapshot(manifest["id"], str(tmp_path / f"{manifest['id']}.db"))
+    with pytest.raises(BackupStoreError):
+        store.get_snapshot(manifests[0]["id"])
+
+
+def test_snapshots_of_the_same_second_keep_their_order(store, source):
+    # Больше десяти снимков за секунду: суффиксы _10, _11 не должны обгонять _2 при сортировке
+    ids = [store.create_snapshot(source)["id"] for _ in range(12)]
+    assert [manifest["id"] for manifest in store.list_snapshots()] == ids
+    store.prune(3)
+    assert [manifest["id"] for manifest in store.list_snapshots()] == ids[-3:]
@@ -0,0 +1,227 @@
+"""SQLitePersistence: запись только изменившихся ключей, удаление, повтор после ошибки, срок хранения."""
+import asyncio
+import datetime
+import threading
+
+import pytest
+from sqlalchemy import update
+
+import bot_persistence
+from bot_persistence import BOT_DATA, BOT_DATA_KEY, CONVERSATION_PREFIX, USER_DATA, SQLitePersistence
+from db_utils import load_persistent_data, store_persistent_data
+from models import PersistentData
+from user_session import SESSION_TTL, UserSession
+
+
+@pytest.fixture
+def writes(db, monkeypatch):
+    """Записывает аргументы каждого вызова store_persistent_data: (строки, продленные ключи)."""
+    calls = []
+
+    def recording(session, rows, touched=()):
+        rows, touched = list(rows), list(touched)
+        calls.append((sorted(rows, key=str), sorted(touched)))
+        return store_persistent_data(session, rows, touched)
+
+    monkeypatch.setattr(bot_persistence, "store_persistent_data", recording)
+    return calls
+
+
+def _session(**fields):
+    session = UserSession()
+    for name, value in fields.items():
+        setattr(session, name, value)
+    return session
+
+
+def _stored(db, namespace):
+    db.expire_all()
+    return load_persistent_data(db, namespace)
+
+
+def _age(db, namespace, key, seconds):
+    """Сдвигает updated_at ключа на seconds секунд в прошлое."""
+    moment = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(seconds=seconds)
+    db.execute(
+        update(PersistentData)
+        .where(PersistentData.namespace == namespace, PersistentData.key == key)
+        .values(updated_at=moment)
+    )
+    db.commit()
+
+
+def _updated_at(db, namespace, key):
+    db.expire_all()
+    return db.get(PersistentData, (namespace, key)).updated_at
+
+
+def test_only_changed_keys_are_written(db, writes):
+    async def scenario():
+        persistence = SQLitePersistence()
+        sessions = {user_id: _session(photo_file_id=f"photo-{user_id}") for user_id in (1, 2, 3)}
+        for user_id in sessions:
+            await persistence.refresh_user_data(user_id, UserSession())
+        for user_id, session in sessions.items():
+            await persistence.update_user_data(user_id, session)
+        await persistence.flush()
+
+        sessions[2] = _session(photo_file_id="photo-2", leaderboard_message_id=10)
+        for user_id, session in sessions.items():
+            await persistence.update_user_data(user_id, session)
+        await persistence.update_bot_data({"admins": [1]})
+        await persistence.flush()
+
+        # Ничего не изменилось: в базу ничего не пишется
+        for user_id, session in sessions.items():
+            await persistence.update_user_data(user_id, session)
+        await persistence.update_bot_data({"admins": [1]})
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert [[key for _namespace, key, _data in rows] for rows, _touched in writes] == [["1", "2", "3"], ["bot", "2"]]
+    assert all(touched == [] for _rows, touched in writes)
+    assert _stored(db, USER_DATA)["2"] == '{"leaderboard_message_id":10,"photo_file_id":"photo-2"}'
+
+
+def test_unloaded_user_without_data_is_not_written(db, writes):
+    async def scenario():
+        persistence = SQLitePersistence()
+        await persistence.update_user_data(5, UserSession())
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert writes == []
+
+
+def test_none_or_empty_value_deletes_the_row(db, writes):
+    async def scenario():
+        persistence = SQLitePersistence()
+        await persistence.refresh_user_data(1, UserSession())
+        await persistence.update_user_data(1, _session(photo_file_id="photo"))
+        await persistence.update_user_data(2, _session(photo_file_id="photo"))
+        await persistence.update_bot_data({"key": "value"})
+        await persistence.update_conversation("submit", (-100, 1), 2)
+        await persistence.flush()
+        assert set(_stored(db, USER_DATA)) == {"1", "2"}
+        assert _stored(db, CONVERSATION_PREFIX + "submit") == {"[-100, 1]": "2"}
+
+        await persistence.update_user_data(1, UserSession())
+        await persistence.drop_user_data(2)
+        await persistence.update_bot_data({})
+        await persistence.update_conversation("submit", (-100, 1), None)
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert _stored(db, USER_DATA) == {}
+    assert _stored(db, BOT_DATA) == {}
+    assert _stored(db, CONVERSATION_PREFIX + "submit") == {}
+    assert set(writes[-1][0]) == {
+        (CONVERSATION_PREFIX + "submit", "[-100, 1]", None), (BOT_DATA, BOT_DATA_KEY, None),
+        (USER_DATA, "1", None), (USER_DATA, "2", None),
+    }
+
+
+def test_failed_batch_is_requeued_without_overwriting_newer_values(db, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def flaky(session, rows, touched=()):
+        calls.append(list(rows))
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+            raise RuntimeError("database is locked")
+        return store_persistent_data(session, rows, touched)
+
+    monkeypatch.setattr(bot_persistence, "store_persistent_data", flaky)
+
+    async def scenario():
+        persistence = SQLitePersistence()
+        await persistence.update_bot_data({"version": 1})
+        await persistence.update_conversation("admin", (7, 7), 1)
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        # Новое значение приходит, пока первая запись еще идет
+        await persistence.update_bot_data({"version": 2})
+        release.set()
+        assert await persistence._write_task == 0
+        assert persistence._dirty[(BOT_DATA, BOT_DATA_KEY)] == {"version": 2}
+        assert persistence._dirty[(CONVERSATION_PREFIX + "admin", "[7, 7]")] == 1
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert _stored(db, BOT_DATA) == {BOT_DATA_KEY: '{"version":2}'}
+    assert _stored(db, CONVERSATION_PREFIX + "admin") == {"[7, 7]": "1"}
+
+
+def test_stale_keys_are_purged_on_load(db):
+    store_persistent_data(db, [
+        (USER_DATA, "1", '{"photo_file_id":"old"}'),
+        (USER_DATA, "2", '{"photo_file_id":"fresh"}'),
+        (CONVERSATION_PREFIX + "submit", "[-100, 1]", "1"),
+        (CONVERSATION_PREFIX + "submit", "[-100, 2]", "2"),
+        (CONVERSATION_PREFIX + "admin", "[1, 1]", "3"),
+    ])
+    _age(db, USER_DATA, "1", SESSION_TTL + 60)
+    _age(db, CONVERSATION_PREFIX + "submit", "[-100, 1]", SESSION_TTL + 60)
+    _age(db, USER_DATA, "2", SESSION_TTL - 60)
+
+    async def scenario():
+        persistence = SQLitePersistence()
+        assert await persistence.get_user_data() == {}
+        assert await persistence.get_conversations("submit") == {(-100, 2): 2}
+
+    asyncio.run(scenario())
+    assert set(_stored(db, USER_DATA)) == {"2"}
+    # Диалоги другого обработчика не затрагиваются
+    assert _stored(db, CONVERSATION_PREFIX + "admin") == {"[1, 1]": "3"}
+
+
+def test_activity_without_changes_extends_the_ttl(db, writes):
+    store_persistent_data(db, [
+        (USER_DATA, "1", '{"photo_file_id":"photo"}'),
+        (CONVERSATION_PREFIX + "submit", "[-100, 1]", "1"),
+        (CONVERSATION_PREFIX + "submit", "[-100, 2]", "1"),
+    ])
+    for namespace, key in ((USER_DATA, "1"), (CONVERSATION_PREFIX + "submit", "[-100, 1]"),
+                           (CONVERSATION_PREFIX + "submit", "[-100, 2]")):
+        _age(db, namespace, key, SESSION_TTL - 60)
+    old = {key: _updated_at(db, namespace, key) for namespace, key in (
+        (USER_DATA, "1"), (CONVERSATION_PREFIX + "submit", "[-100, 1]"), (CONVERSATION_PREFIX + "submit", "[-100, 2]"))}
+
+    async def active_user(persistence):
+        session = UserSession()
+        await persistence.refresh_user_data(1, session)
+        await persistence.update_user_data(1, session)
+        await persistence.flush()
+
+    async def scenario():
+        persistence = SQLitePersistence()
+        await persistence.get_user_data()
+        await persistence.get_conversations("submit")
+        # Пользователь 1 пишет боту, но его сессия и диалог не меняются
+        await active_user(persistence)
+        # Повторная активность в пределах PERSISTENCE_TOUCH_INTERVAL в базу не пишется
+        await persistence.update_user_data(1, _session(photo_file_id="photo"))
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert writes == [([], [(CONVERSATION_PREFIX + "submit", "[-100, 1]"), (USER_DATA, "1")])]
+    assert _updated_at(db, USER_DATA, "1") > old["1"]
+    assert _updated_at(db, CONVERSATION_PREFIX + "submit", "[-100, 1]") > old["[-100, 1]"]
+    assert _updated_at(db, CONVERSATION_PREFIX + "submit", "[-100, 2]") == old["[-100, 2]"]
+
+    # Через сутки после прежнего updated_at пропадают только данные неактивного пользователя 2
+    for namespace, key in ((USER_DATA, "1"), (CONVERSATION_PREFIX + "submit", "[-100, 1]")):
+        _age(db, namespace, key, 120)
+    _age(db, CONVERSATION_PREFIX + "submit", "[-100, 2]", SESSION_TTL + 60)
+
+    async def restart():
+        persistence = SQLitePersistence()
+        await persistence.get_user_data()
+        return await persistence.get_conversations("submit")
+
+    assert asyncio.run(restart()) == {(-100, 1): 1}
+    assert set(_stored(db, USER_DATA)) == {"1"}
@@ -0,0 +1,214 @@
+"""Журнал изменений и восстановление на момент времени: повторное применение, маркер восстановления, сжатие."""
+import os
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+import db_backup
+from change_journal import OP_ENTRY_ADDED, OP_RESTORED, OP_USER, change_journal, replay_journal, utc_now
+from db_utils import (
+    add_beer_entry, add_or_update_user, bulk_import_users, delete_beer_entry, delete_user, set_user_total_volume,
+)
+
+
+@pytest.fixture
+def backups(file_db, tmp_path, monkeypatch):
+    """db_backup работает с файловой базой теста и хранит снимки во временной папке."""
+    backup_dir = tmp_path / "backups"
+    monkeypatch.setattr(db_backup, "DB_FILE", str(tmp_path / "beer_challenge.db"))
+    monkeypatch.setattr(db_backup, "BACKUP_DIR", str(backup_dir))
+    monkeypatch.setattr(db_backup, "BACKUP_STORE_DIR", str(backup_dir / "store"))
+    monkeypatch.setattr(db_backup, "BACKUP_STEP_PAUSE", 0)
+    return db_backup._store()
+
+
+def _state(path):
+    """Содержимое таблиц, которые восстанавливает журнал."""
+    connection = sqlite3.connect(path)
+    try:
+        return {
+            "users": connection.execute("SELECT id, first_name, username FROM users ORDER BY id").fetchall(),
+            "entries": connection.execute(
+                "SELECT id, user_id, volume_liters, photo_file_id, submitted_at FROM beer_entries ORDER BY id"
+            ).fetchall(),
+            "totals": connection.execute(
+                "SELECT user_id, total_volume, entry_count, last_submitted_at FROM user_totals ORDER BY user_id"
+            ).fetchall(),
+        }
+    finally:
+        connection.close()
+
+
+def _copy(source, target):
+    source_connection, target_connection = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        source_connection.close()
+        target_connection.close()
+
+
+def _replay(path, records):
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        return replay_journal(connection, records)
+    finally:
+        connection.close()
+
+
+def _moment():
+    """Время между двумя записями журнала (метки ts с точностью до миллисекунды)."""
+    time.sleep(0.005)
+    moment = utc_now()
+    time.sleep(0.005)
+    return moment
+
+
+def _history(db):
+    add_or_update_user(db, 1, "Иван", "ivan")
+    add_or_update_user(db, 2, "Петр", "petr")
+    add_beer_entry(db, 1, 0.5, "photo-1")
+    entry = add_beer_entry(db, 2, 1.0, "photo-2")
+    add_beer_entry(db, 2, 0.33, "photo-3")
+    set_user_total_volume(db, 1, 4.0)
+    delete_beer_entry(db, entry.id)
+    # Ник ivan переходит от участника 1 к участнику 3
+    add_or_update_user(db, 1, "Иван", None)
+    bulk_import_users(db, [(3, "Анна", "ivan", 2.0), (4, "Олег", None, 0.5)])
+    delete_user(db, 4)
+
+
+def test_append_and_read(tmp_path):
+    journal = type(change_journal)(str(tmp_path / "journal.jsonl"), fsync_batch=1)
+    assert journal.last_seq == 0
+    assert journal.append(OP_USER, user_id=1, first_name="A", username=None) == 1
+    moment = _moment()
+    assert journal.append(OP_USER, user_id=2, first_name="B", username=None) == 2
+    journal.close()
+
+    # Строка, оборванная при сбое, пропускается, нумерация продолжается
+    with open(journal.path, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"seq": 3, "op": "us')
+    assert journal.append(OP_USER, user_id=3, first_name="C", username=None) == 3
+    journal.close()
+
+    assert [record["user_id"] for record in journal.read()] == [1, 2, 3]
+    assert [record["seq"] for record in journal.read(after_seq=1)] == [2, 3]
+    assert [record["seq"] for record in journal.read(until_ts=moment)] == [1]
+    assert journal.last_seq == 3
+
+
+def test_replay_rebuilds_the_database_and_is_idempotent(file_db, tmp_path):
+    live = str(tmp_path / "beer_challenge.db")
+    empty = str(tmp_path / "empty.db")
+    _copy(live, empty)
+
+    _history(file_db)
+    change_journal.sync()
+    records = list(change_journal.read())
+    assert records[0]["op"] == OP_USER and records[-1]["op"] != OP_RESTORED
+
+    expected = _state(live)
+    assert _replay(empty, records) == len(records)
+    assert _state(empty) == expected
+    # Повторное применение тех же записей ничего не меняет
+    _replay(empty, records)
+    assert _state(empty) == expected
+
+
+def test_replay_on_top_of_a_later_snapshot(file_db, tmp_path):
+    live = str(tmp_path / "beer_challenge.db")
+    add_or_update_user(file_db, 1, "Иван", "ivan")
+    add_beer_entry(file_db, 1, 0.5, "photo-1")
+    seq = change_journal.last_seq
+    snapshot = str(tmp_path / "snapshot.db")
+    _history(file_db)
+    # Снимок снят позже своей позиции в журнале: часть записей после seq в нем уже есть
+    _copy(live, snapshot)
+    add_beer_entry(file_db, 2, 1.5, "photo-4")
+
+    _replay(snapshot, change_journal.read(after_seq=seq))
+    assert _state(snapshot) == _state(live)
+
+
+def test_restore_to_moment(file_db, backups, tmp_path):
+    live = str(tmp_path / "beer_challenge.db")
+    add_or_update_user(file_db, 1, "Иван", "ivan")
+    add_beer_entry(file_db, 1, 0.5, "photo-1")
+    assert db_backup.create_backup()
+    add_beer_entry(file_db, 1, 1.0, "photo-2")
+    add_or_update_user(file_db, 2, "Петр", "petr")
+    moment = _moment()
+    expected = _state(live)
+    add_beer_entry(file_db, 2, 3.0, "photo-3")
+    delete_user(file_db, 1)
+    file_db.close()
+    undone_seq = change_journal.last_seq
+
+    assert db_backup.restore_to(moment)
+
+    assert _state(live) == expected
+    marker = change_journal.last_restore_marker()
+    assert marker["seq"] == undone_seq + 1
+    # Отмененные записи перенесены в архив, в журнале остались только записи до момента восстановления
+    kept = [record["seq"] for record in change_journal.read() if record["op"] != OP_RESTORED]
+    assert max(kept) == marker["restored_seq"] < undone_seq
+    archives = [name for name in os.listdir(os.path.dirname(change_journal.path)) if ".undone_" in name]
+    assert len(archives) == 1
+    labels = [manifest["id"].split("_", 1)[0] for manifest in backups.list_snapshots()]
+    assert labels == ["beer", "pre", "post"]
+    assert backups.latest_snapshot()["journal_seq"] == marker["seq"]
+
+
+def test_compaction_keeps_the_restore_marker_while_older_snapshots_remain(file_db, backups, tmp_path):
+    live = str(tmp_path / "beer_challenge.db")
+    add_or_update_user(file_db, 1, "Иван", "ivan")
+    assert db_backup.create_backup()
+    first = backups.latest_snapshot()
+    add_beer_entry(file_db, 1, 1.0, "photo-1")
+    file_db.close()
+
+    # Восстановление из первого снимка: запись о пиве уходит в архив, начинается новая ветка истории
+    assert db_backup.restore_backup(first["id"])
+    marker = change_journal.last_restore_marker()
+    post_restore = backups.latest_snapshot()
+    assert post_restore["journal_seq"] == marker["seq"]
+
+    add_beer_entry(file_db, 1, 2.0, "photo-2")
+    moment = _moment()
+    expected = _state(live)
+
+    # Снимок pre_restore (старая ветка, journal_seq < seq маркера) остается: маркер нельзя удалить
+    db_backup.cleanup_old_backups(keep=2)
+    assert [manifest["id"].split("_", 1)[0] for manifest in backups.list_snapshots()] == ["pre", "post"]
+    assert change_journal.last_restore_marker() == marker
+    assert min(record["seq"] for record in change_journal.read()) > first["journal_seq"]
+
+    # Без снимка новой ветки снимок старой ветки не годится: в нем есть отмененная запись
+    post_manifest = backups._manifest_path(post_restore["id"])
+    shutil.move(post_manifest, str(tmp_path / "post_restore.json"))
+    assert not db_backup.restore_to(moment)
+    shutil.move(str(tmp_path / "post_restore.json"), post_manifest)
+
+    assert db_backup.restore_to(moment)
+    assert _state(live) == expected
+
+    # Когда все снимки относятся к новой ветке, маркер больше не нужен и сжатие может его удалить
+    db_backup.cleanup_old_backups(keep=1)
+    snapshots = backups.list_snapshots()
+    assert all(manifest["journal_seq"] >= marker["seq"] for manifest in snapshots)
+    assert all(record["seq"] >= min(m["journal_seq"] for m in snapshots) for record in change_journal.read())
+
+
+def test_compact_never_drops_the_last_record(tmp_path):
+    journal = type(change_journal)(str(tmp_path / "journal.jsonl"))
+    for user_id in range(1, 4):
+        journal.append(OP_ENTRY_ADDED, entry_id=user_id, user_id=user_id, volume=0.5, photo_file_id="p", submitted_at=None)
+    assert journal.compact(1) == 1
+    assert journal.compact(10) == 1
+    assert [record["seq"] for record in journal.read()] == [3]
+    # Нумерация продолжается после сжатия
+    assert journal.append(OP_USER, user_id=1, first_name="A", username=None) == 4
+    journal.close()
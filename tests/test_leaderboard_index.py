@@ -0,0 +1,116 @@
+"""Индекс рейтинга в памяти против user_totals: места, страницы, соседи и кеш страниц."""
+from sqlalchemy import desc
+
+from db_utils import (
+    add_beer_entry, add_or_update_user, delete_beer_entry, delete_user, get_user_entries,
+    set_user_total_volume, verify_leaderboard_index, warm_leaderboard_index,
+)
+from handlers import leaderboard
+from leaderboard_index import LeaderboardIndex, leaderboard_index
+from models import UserTotal
+
+
+def _expected_ranking(db):
+    """Рейтинг из user_totals: по убыванию объема, при равенстве — по user_id."""
+    return [
+        user_id for user_id, _total in
+        db.query(UserTotal.user_id, UserTotal.total_volume).order_by(desc(UserTotal.total_volume), UserTotal.user_id)
+    ]
+
+
+def _assert_matches_db(db):
+    assert verify_leaderboard_index(db) == []
+    ranking = _expected_ranking(db)
+    assert len(leaderboard_index) == len(ranking)
+    for place, user_id in enumerate(ranking, start=1):
+        assert leaderboard_index.rank_of(user_id) == place
+    assert [row[1] for row in leaderboard_index.page(0, len(ranking) + 5)] == ranking
+    for offset in range(len(ranking)):
+        assert [row[1] for row in leaderboard_index.page(offset, 2)] == ranking[offset:offset + 2]
+    for place in range(1, len(ranking) + 1):
+        start = max(1, place - 1)
+        assert [row[0] for row in leaderboard_index.around(place, 1)] == list(range(start, min(len(ranking), place + 1) + 1))
+        assert [row[1] for row in leaderboard_index.around(place, 1)] == ranking[start - 1:place + 1]
+
+
+def _add_users(db, *user_ids):
+    for user_id in user_ids:
+        add_or_update_user(db, user_id, f"User{user_id}", None)
+
+
+def test_inserts_and_ties_match_user_totals(db):
+    _add_users(db, 1, 2, 3, 4)
+    add_beer_entry(db, 1, 1.0)
+    add_beer_entry(db, 2, 2.0)
+    add_beer_entry(db, 3, 1.0)
+    add_beer_entry(db, 4, 0.5)
+    add_beer_entry(db, 4, 0.5)
+    # 1, 3 и 4 набрали по 1.0 л: порядок среди них — по user_id
+    assert [row[1] for row in leaderboard_index.top(4)] == [2, 1, 3, 4]
+    _assert_matches_db(db)
+
+
+def test_updates_and_deletes_match_user_totals(db):
+    _add_users(db, 1, 2, 3, 4, 5)
+    for user_id, volume in ((1, 1.0), (2, 2.0), (3, 3.0), (4, 0.5), (5, 2.0)):
+        add_beer_entry(db, user_id, volume)
+    _assert_matches_db(db)
+
+    set_user_total_volume(db, 1, 5.0)
+    _assert_matches_db(db)
+    assert leaderboard_index.rank_of(1) == 1
+
+    entry_id = get_user_entries(db, 3)[0][0]
+    delete_beer_entry(db, entry_id)
+    _assert_matches_db(db)
+    assert leaderboard_index.rank_of(3) is None
+
+    delete_user(db, 2)
+    _assert_matches_db(db)
+
+    # Перезагрузка из базы дает тот же рейтинг
+    before = leaderboard_index.page(0, 10)
+    warm_leaderboard_index(db)
+    assert leaderboard_index.page(0, 10) == before
+
+
+def test_verify_reports_drift(db):
+    _add_users(db, 1, 2)
+    add_beer_entry(db, 1, 1.0)
+    add_beer_entry(db, 2, 2.0)
+    leaderboard_index.update(1, 10.0)
+    leaderboard_index.remove(2)
+    assert verify_leaderboard_index(db) == [(1, 10.0, 1.0), (2, None, 2.0)]
+
+
+def test_rank_of_unknown_user_and_out_of_range_pages():
+    index = LeaderboardIndex()
+    index.load([(1, "A", None, 1.0), (2, "B", None, None)])
+    assert index.rank_of(2) is None
+    assert index.rank_of(3) is None
+    assert index.page(5, 10) == []
+    assert index.page(0, 0) == []
+    assert index.around(1, 3) == [(1, 1, "A", None, 1.0)]
+
+
+def test_render_cache_key_changes_with_index_version(db):
+    _add_users(db, 1, 2)
+    add_beer_entry(db, 1, 1.0)
+    text, _page, _pages = leaderboard.render_leaderboard_page(1)
+    hits = leaderboard.get_render_cache_stats()["hits"]
+    assert leaderboard.render_leaderboard_page(1)[0] == text
+    assert leaderboard.get_render_cache_stats()["hits"] == hits + 1
+
+    version = leaderboard_index.version
+    add_beer_entry(db, 2, 3.0)
+    assert leaderboard_index.version > version
+    new_text = leaderboard.render_leaderboard_page(1)[0]
+    assert new_text != text
+    assert "User2" in new_text
+    # Страницы прежней версии вытесняются из кеша
+    assert all(key[0] == leaderboard_index.version for key in leaderboard._render_cache)
+
+    version = leaderboard_index.version
+    add_or_update_user(db, 2, "Renamed", None)
+    assert leaderboard_index.version > version
+    assert "Renamed" in leaderboard.render_leaderboard_page(1)[0]
@@ -0,0 +1,54 @@
+"""Повторное использование file_id: повторная загрузка только при недействительном file_id."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.error import BadRequest
+
+import media_cache
+from db_utils import get_cached_file_ids, store_file_id
+
+
+@pytest.fixture
+def asset(db, tmp_path, monkeypatch):
+    path = tmp_path / "achievement.jpg"
+    path.write_bytes(b"jpeg bytes")
+    content_hash, _data = media_cache._read_asset(str(path))
+    store_file_id(db, "achievement.jpg", content_hash, "cached-file-id")
+    # Кеш file_id модуля перечитывается из тестовой базы
+    monkeypatch.setattr(media_cache, "_file_ids", None)
+    return str(path)
+
+
+def _bot(*send_results):
+    bot = MagicMock()
+    bot.send_photo = AsyncMock(side_effect=list(send_results))
+    return bot
+
+
+def _uploaded(file_id):
+    return MagicMock(photo=[MagicMock(file_id=file_id)])
+
+
+def test_cached_file_id_is_reused(db, asset):
+    bot = _bot(_uploaded("cached-file-id"))
+    asyncio.run(media_cache.send_cached_photo(bot, -1, asset, caption="hi"))
+    assert bot.send_photo.await_args.kwargs["photo"] == "cached-file-id"
+
+
+@pytest.mark.parametrize("error", ["Wrong file identifier/http url specified", "File reference expired"])
+def test_stale_file_id_is_forgotten_and_reuploaded(db, asset, error):
+    bot = _bot(BadRequest(error), _uploaded("new-file-id"))
+    asyncio.run(media_cache.send_cached_photo(bot, -1, asset))
+    assert bot.send_photo.await_count == 2
+    assert bot.send_photo.await_args.kwargs["photo"] == b"jpeg bytes"
+    assert get_cached_file_ids(db)["achievement.jpg"][1] == "new-file-id"
+
+
+@pytest.mark.parametrize("error", ["Chat not found", "Message caption is too long", "Not enough rights to send photos"])
+def test_other_bad_requests_keep_the_cache(db, asset, error):
+    bot = _bot(BadRequest(error))
+    with pytest.raises(BadRequest):
+        asyncio.run(media_cache.send_cached_photo(bot, -1, asset))
+    assert bot.send_photo.await_count == 1
+    assert get_cached_file_ids(db)["achievement.jpg"][1] == "cached-file-id"
@@ -0,0 +1,47 @@
+"""Схема после миграций: ключевые запросы должны идти по индексам (EXPLAIN QUERY PLAN)."""
+import pytest
+
+from database.database import create_sqlite_engine
+from database.migrations import MIGRATIONS, QUERY_PLAN_EXPECTATIONS, applied_versions, check_query_plans, run_migrations
+from models import Base
+
+
+@pytest.fixture
+def migrated_engine(tmp_path):
+    """Временная база, подготовленная так же, как в init_db: create_all и все миграции."""
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    yield engine
+    engine.dispose()
+
+
+def _query_plan(engine, sql):
+    with engine.connect() as connection:
+        return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def test_all_migrations_applied(migrated_engine):
+    assert applied_versions(migrated_engine) == {migration.version for migration in MIGRATIONS}
+    # Повторный запуск ничего не применяет
+    assert run_migrations(migrated_engine) == []
+
+
+@pytest.mark.parametrize("name, sql, expected_index", QUERY_PLAN_EXPECTATIONS,
+                         ids=[name for name, _sql, _index in QUERY_PLAN_EXPECTATIONS])
+def test_query_uses_index(migrated_engine, name, sql, expected_index):
+    plan = _query_plan(migrated_engine, sql)
+    assert any(expected_index in detail for detail in plan), f"{name}: expected {expected_index}, got {plan}"
+    assert not any(detail.startswith("SCAN") and "INDEX" not in detail for detail in plan), f"{name}: full scan in {plan}"
+    assert not any("USE TEMP B-TREE" in detail for detail in plan), f"{name}: sorts in a temporary B-tree: {plan}"
+
+
+def test_check_query_plans_reports_no_regressions(migrated_engine):
+    assert check_query_plans(migrated_engine) == []
+
+
+def test_check_query_plans_detects_missing_index(migrated_engine):
+    with migrated_engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_user_totals_total_volume")
+    problems = check_query_plans(migrated_engine)
+    assert len(problems) == 1 and problems[0].startswith("leaderboard top")
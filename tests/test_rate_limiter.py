@@ -0,0 +1,152 @@
+"""Ограничение частоты: корзины с подставным временем, области лимитов и ответы внутри диалогов."""
+import asyncio
+import datetime
+
+import pytest
+from telegram import CallbackQuery, Chat, Message, PhotoSize, Update, User
+from telegram.ext import ApplicationBuilder, CallbackContext, ConversationHandler, MessageHandler, filters
+
+from rate_limiter import (
+    Limit, RateLimiter, RateLimitHandler, RateRule, RATE_LIMITS, classify_update, load_rate_limits,
+)
+
+NOW = datetime.datetime.now(datetime.timezone.utc)
+GROUP = Chat(id=-100, type=Chat.SUPERGROUP)
+OTHER_GROUP = Chat(id=-200, type=Chat.SUPERGROUP)
+ALICE = User(1, "Alice", False)
+BOB = User(2, "Bob", False)
+PHOTO = (PhotoSize("file", "unique", 1280, 960),)
+
+_update_ids = iter(range(1, 10 ** 6))
+
+
+def _message(user=ALICE, chat=GROUP, text=None, photo=None) -> Update:
+    update_id = next(_update_ids)
+    return Update(update_id, message=Message(update_id, NOW, chat, from_user=user, text=text, photo=photo))
+
+
+def _callback(data, user=ALICE) -> Update:
+    update_id = next(_update_ids)
+    message = Message(update_id, NOW, GROUP, from_user=user, text="Выберите объем")
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), user, "instance", message=message, data=data))
+
+
+def _acquired(limiter, count, category="test", user_id=1, chat_id=-100, now=0.0):
+    return [limiter.acquire(category, user_id, chat_id, now=now) for _ in range(count)]
+
+
+def test_burst_then_limit():
+    limiter = RateLimiter({"test": RateRule(user=Limit(3, 30))})
+    assert _acquired(limiter, 4) == [None, None, None, "user"]
+    # Корзины других пользователей не затрагиваются
+    assert limiter.acquire("test", 2, -100, now=0.0) is None
+
+
+def test_refill_is_proportional_and_capped():
+    limiter = RateLimiter({"test": RateRule(user=Limit(3, 30))})
+    _acquired(limiter, 3)
+    assert limiter.acquire("test", 1, -100, now=9.9) == "user"
+    # За 10 секунд набирается один маркер (3 за 30 секунд)
+    assert _acquired(limiter, 2, now=10.0) == [None, "user"]
+    # После долгой паузы запас не больше count
+    assert _acquired(limiter, 4, now=1000.0) == [None, None, None, "user"]
+    # Время, идущее назад, не добавляет маркеров
+    assert limiter.acquire("test", 1, -100, now=500.0) == "user"
+
+
+def test_rejection_does_not_spend_other_scopes():
+    limiter = RateLimiter({"test": RateRule(user=Limit(1, 10), chat=Limit(2, 10), global_=Limit(3, 10))})
+    assert limiter.acquire("test", 1, -100, now=0.0) is None
+    # Отклонено по лимиту пользователя: маркер чата и общий маркер не списаны
+    assert limiter.acquire("test", 1, -100, now=0.0) == "user"
+    assert limiter.acquire("test", 2, -100, now=0.0) is None
+    assert limiter.acquire("test", 3, -100, now=0.0) == "chat"
+    assert limiter.acquire("test", 4, -200, now=0.0) is None
+    assert limiter.acquire("test", 5, -300, now=0.0) == "global"
+
+
+def test_missing_scope_ids_and_unknown_categories_are_not_limited():
+    limiter = RateLimiter({"test": RateRule(user=Limit(1, 10), chat=Limit(1, 10))})
+    assert _acquired(limiter, 3, user_id=None, chat_id=None) == [None, None, None]
+    assert _acquired(limiter, 3, category="unknown") == [None, None, None]
+    assert len(limiter) == 0
+
+
+def test_prune_drops_only_refilled_buckets():
+    limiter = RateLimiter({"test": RateRule(user=Limit(2, 10))})
+    limiter.acquire("test", 1, None, now=0.0)
+    limiter.acquire("test", 2, None, now=4.0)
+    assert len(limiter) == 2
+    assert limiter.prune(now=6.0) == 1
+    assert len(limiter) == 1
+    # Удаленная корзина ничем не отличалась от новой
+    assert _acquired(limiter, 3, user_id=1, chat_id=None, now=6.0) == [None, None, "user"]
+
+
+def test_load_rate_limits():
+    rules = load_rate_limits('{"photo": {"user": [1, 60], "global": null}, "custom": {"chat": [5, 1]}}')
+    assert rules["photo"] == RATE_LIMITS["photo"]._replace(user=Limit(1.0, 60.0), global_=None)
+    assert rules["custom"] == RateRule(chat=Limit(5.0, 1.0))
+    assert rules["leaderboard"] == RATE_LIMITS["leaderboard"]
+    assert load_rate_limits(None) == RATE_LIMITS
+    with pytest.raises(ValueError):
+        load_rate_limits('{"photo": {"room": [1, 1]}}')
+    with pytest.raises(ValueError):
+        load_rate_limits('{"photo": {"user": [0, 1]}}')
+
+
+@pytest.mark.parametrize("update, category", [
+    (_message(photo=PHOTO), "photo"),
+    (_message(text="/leaderboard@beer_bot"), "leaderboard"),
+    (_message(text="Таблица лидеров"), "leaderboard"),
+    (_message(text="/import_users"), "admin"),
+    (_message(text="/start"), "command"),
+    (_message(text="0.5"), "message"),
+    (_callback("show_leaderboard"), "leaderboard"),
+    (_callback("lb:page:2"), "leaderboard_page"),
+    (_callback("0.5"), "volume_keyboard"),
+    (Update(1), None),
+])
+def test_classify_update(update, category):
+    assert classify_update(update) == category
+
+
+@pytest.fixture
+def conversation():
+    """Диалог как в handlers/beer_tracking.py: фото начинает его, затем ожидается текст."""
+    async def start(update, context):
+        return 1
+
+    async def answer(update, context):
+        return 1
+
+    return ConversationHandler(
+        entry_points=[MessageHandler(filters.PHOTO, start)],
+        states={1: [MessageHandler(filters.TEXT & ~filters.COMMAND, answer)]},
+        fallbacks=[],
+    )
+
+
+def _enter(conversation, update):
+    """Передает обновление диалогу так же, как Application."""
+    application = ApplicationBuilder().token("123456:test-token").build()
+    check = conversation.check_update(update)
+    assert check is not None
+    context = CallbackContext.from_update(update, application)
+    asyncio.run(conversation.handle_update(update, application, check, context))
+
+
+def test_text_inside_an_active_conversation_is_never_limited(conversation):
+    handler = RateLimitHandler(
+        RateLimiter({"message": RateRule(user=Limit(2, 60)), "photo": RateRule(user=Limit(2, 60))}),
+        conversations=(conversation,),
+    )
+    _enter(conversation, _message(photo=PHOTO))
+
+    for _ in range(20):
+        assert handler.check_update(_message(text="0.5")) is None
+    # Пользователь вне диалога, тот же пользователь в другом чате и команды ограничиваются как обычно
+    assert [handler.check_update(_message(user=BOB, text="привет")) for _ in range(3)] == [None, None, ("message", "user")]
+    assert [handler.check_update(_message(chat=OTHER_GROUP, text="привет")) for _ in range(3)] == [None, None, ("message", "user")]
+    # Фото не входит в исключение, даже если диалог активен
+    assert [handler.check_update(_message(photo=PHOTO)) for _ in range(3)] == [None, None, ("photo", "user")]
@@ -0,0 +1,143 @@
+"""Массовый импорт участников: разбор текста и CSV/TSV, ошибки строк, импорт «все или ничего»."""
+import asyncio
+import io
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from change_journal import change_journal
+from db_utils import add_or_update_user, add_beer_entry, bulk_import_users, get_user_entries
+from handlers import admin
+from leaderboard_index import leaderboard_index
+from models import User, UserTotal
+from user_import import parse_csv_stream, parse_text_payload
+
+
+def _csv(text):
+    return parse_csv_stream(io.BytesIO(text.encode("utf-8")))
+
+
+@pytest.mark.parametrize("payload", [
+    "id,name,username,volume\n1,Иван,@ivan,1.5\n2,Петр,-,0\n",
+    "1\tИван\t@ivan\t1.5\n2\tПетр\tнет\t0\n",
+    # Точка с запятой определяется раньше запятой: объем может быть с десятичной запятой
+    "1;Иван;ivan;1,5\n2;Петр;;0\n",
+])
+def test_csv_delimiters_and_header(payload):
+    parsed = _csv(payload)
+    assert parsed.errors == []
+    assert parsed.rows == {1: (1, "Иван", "ivan", 1.5), 2: (2, "Петр", None, 0.0)}
+
+
+def test_csv_bom_blank_lines_and_duplicate_ids():
+    parsed = parse_csv_stream(io.BytesIO("\ufeff1,Иван,ivan,1\n\n1,Иван,ivan,2.5\n".encode("utf-8")))
+    assert parsed.errors == []
+    # Последняя строка с тем же ID побеждает
+    assert parsed.rows == {1: (1, "Иван", "ivan", 2.5)}
+
+
+def test_csv_malformed_rows_are_reported_with_line_numbers():
+    parsed = _csv(
+        "id,name,username,volume\n"
+        "1,Иван,ivan,1.5\n"
+        "2,Петр,petr\n"
+        "3,Анна,anna,много\n"
+        "4,Олег,oleg,-1\n"
+        "5, ,nick,2\n"
+        "x,Имя,nick,2\n"
+    )
+    assert parsed.errors == [
+        "❌ Строка 3: ожидается 4 колонки (id, имя, ник, объем)",
+        "❌ Строка 4: could not convert string to float: 'много'",
+        "❌ Строка 5: объем не может быть отрицательным",
+        "❌ Строка 6: пустое имя",
+        "❌ Строка 7: invalid literal for int() with base 10: 'x'",
+    ]
+    assert list(parsed.rows) == [1]
+
+
+def test_csv_first_data_row_is_not_taken_for_header():
+    parsed = _csv("7,Иван,ivan,1\n")
+    assert parsed.rows == {7: (7, "Иван", "ivan", 1.0)}
+    assert _csv("").rows == {}
+
+
+def test_text_payload():
+    parsed = parse_text_payload(
+        "ID: 1, Имя: Иван, Ник: @ivan, Объем: 1.5 л\n"
+        "\n"
+        "ID: 2, Имя: Петр, Ник: нет, Объем: 0 л\n"
+        "ID: 3, Имя: Анна\n"
+    )
+    assert parsed.rows == {1: (1, "Иван", "ivan", 1.5), 2: (2, "Петр", None, 0.0)}
+    assert parsed.errors == ["❌ Неверный формат строки: 'ID: 3, Имя: Анна'"]
+
+
+def _snapshot(db):
+    db.expire_all()
+    users = sorted((user.id, user.first_name, user.username) for user in db.query(User))
+    totals = sorted((total.user_id, total.total_volume) for total in db.query(UserTotal))
+    entries = {user_id: [volume for _id, volume, _at in get_user_entries(db, user_id)] for user_id, _n, _u in users}
+    return users, totals, entries
+
+
+def _seed(db):
+    add_or_update_user(db, 1, "Иван", "ivan")
+    add_or_update_user(db, 2, "Петр", "petr")
+    add_beer_entry(db, 1, 0.5, "photo-1")
+    add_beer_entry(db, 2, 1.0, "photo-2")
+
+
+def test_bulk_import_replaces_entries_and_totals(db):
+    _seed(db)
+    assert bulk_import_users(db, [(1, "Иван", "ivan", 3.0), (3, "Анна", None, 2.0)]) == 2
+    users, totals, entries = _snapshot(db)
+    assert users == [(1, "Иван", "ivan"), (2, "Петр", "petr"), (3, "Анна", None)]
+    assert totals == [(1, 3.0), (2, 1.0), (3, 2.0)]
+    assert entries == {1: [3.0], 2: [1.0], 3: [2.0]}
+    assert [row[1] for row in leaderboard_index.page(0, 10)] == [1, 3, 2]
+
+
+def test_bulk_import_rolls_back_everything_on_conflict(db):
+    _seed(db)
+    before = _snapshot(db)
+    journal_before = list(change_journal.read())
+
+    # Ник petr уже занят участником 2: ни одна строка импорта не должна сохраниться
+    with pytest.raises(Exception):
+        bulk_import_users(db, [(1, "Иван", "ivan", 9.0), (3, "Анна", None, 4.0), (4, "Самозванец", "petr", 1.0)])
+
+    assert _snapshot(db) == before
+    assert list(change_journal.read()) == journal_before
+    assert [row[1] for row in leaderboard_index.page(0, 10)] == [2, 1]
+
+
+def _update():
+    update = MagicMock()
+    update.message.reply_text = AsyncMock()
+    return update
+
+
+def test_import_with_parse_errors_saves_nothing(db):
+    _seed(db)
+    before = _snapshot(db)
+    parsed = _csv("1,Иван,ivan,5\n3,Анна,anna,-2\n")
+    update = _update()
+
+    assert asyncio.run(admin._import_parsed(update, parsed)) == admin.AWAITING_USER_LIST
+    assert _snapshot(db) == before
+    replies = "".join(call.args[0] for call in update.message.reply_text.await_args_list)
+    assert "Импорт отменен, ничего не сохранено" in replies
+    assert "Строка 2: объем не может быть отрицательным" in replies
+
+
+def test_import_failing_in_db_saves_nothing(db):
+    _seed(db)
+    before = _snapshot(db)
+    update = _update()
+
+    result = asyncio.run(admin._import_parsed(update, parse_text_payload("ID: 5, Имя: Олег, Ник: @ivan, Объем: 1 л")))
+
+    assert result == admin.ConversationHandler.END
+    assert _snapshot(db) == before
+    assert update.message.reply_text.await_args.args[0].startswith("❌ Импорт отменен, изменения не сохранены")
@@ -0,0 +1,43 @@
+"""Сессии пользователей: сохранение полей, удаление неактивных сессий, таймаут диалогов."""
+import time
+
+from telegram.ext import ApplicationBuilder, ContextTypes, ConversationHandler
+
+from handlers import admin, beer_tracking
+from user_session import CONVERSATION_TIMEOUT, SESSION_TTL, UserSession, evict_idle_sessions
+
+
+def test_to_dict_and_restore():
+    session = UserSession()
+    assert session.to_dict() == {}
+    session.photo_file_id = "photo"
+    session.entries = (1, 2)
+
+    restored = UserSession()
+    restored.leaderboard_message_id = 5
+    # JSON превращает кортежи в списки
+    restored.restore({"photo_file_id": "photo", "entries": [1, 2], "leaderboard_message_id": 7})
+    assert restored.to_dict() == {"photo_file_id": "photo", "entries": (1, 2), "leaderboard_message_id": 5}
+
+
+def test_idle_sessions_are_evicted():
+    application = (
+        ApplicationBuilder().token("123456:test-token").context_types(ContextTypes(user_data=UserSession)).build()
+    )
+    active, idle = application.user_data[1], application.user_data[2]
+    active.photo_file_id = idle.photo_file_id = "photo"
+    idle.last_seen = time.monotonic() - SESSION_TTL - 1
+
+    assert evict_idle_sessions(application) == 1
+    assert set(application.user_data) == {1}
+    assert application.user_data[1] is active
+
+
+def test_every_conversation_times_out_with_the_session():
+    conversations = [
+        value for module in (admin, beer_tracking) for value in vars(module).values()
+        if isinstance(value, ConversationHandler)
+    ]
+    assert len(conversations) == 6
+    for conversation in conversations:
+        assert conversation.conversation_timeout == CONVERSATION_TIMEOUT, conversation.name
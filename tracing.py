@@ -0,0 +1,224 @@
+# tracing.py
+"""
+Трассировка обработки обновлений и журнал медленных обновлений.
+
+Каждый обработчик, зарегистрированный в main.main(), оборачивается функцией,
+которая открывает трассу обновления в contextvar. Внутри нее записываются
+отрезки (spans):
+    db       — вызов run_db (включая ожидание свободного потока БД);
+    sql      — отдельный SQL-запрос (события SQLAlchemy, см. metrics.py);
+    telegram — вызов Bot API (MetricsHTTPXRequest в metrics.py).
+
+Если обновление обрабатывалось дольше SLOW_UPDATE_THRESHOLD секунд, трасса со
+всеми отрезками пишется в ротируемый лог SLOW_UPDATE_LOG и сохраняется в памяти
+(последние SLOW_UPDATE_BUFFER штук) для админ-команды /slow_updates.
+"""
+import datetime
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Deque, Iterator, List, Optional
+
+from telegram.ext import Application, ApplicationHandlerStop, BaseHandler, ConversationHandler
+
+from database.database import DB_DIRECTORY
+
+logger = logging.getLogger(__name__)
+
+# Порог медленного обновления в секундах
+SLOW_UPDATE_THRESHOLD = float(os.environ.get("SLOW_UPDATE_THRESHOLD", "1.0"))
+SLOW_UPDATE_LOG = os.environ.get("SLOW_UPDATE_LOG", os.path.join(DB_DIRECTORY, "slow_updates.log"))
+SLOW_UPDATE_LOG_MAX_BYTES = 1024 * 1024
+SLOW_UPDATE_LOG_BACKUPS = 3
+# Сколько последних медленных обновлений держать в памяти
+SLOW_UPDATE_BUFFER = int(os.environ.get("SLOW_UPDATE_BUFFER", "100"))
+# Ограничение числа отрезков в одной трассе (например, при массовом импорте)
+MAX_SPANS_PER_TRACE = 200
+# Длина текста SQL-запроса в названии отрезка
+SQL_NAME_LENGTH = 80
+
+
+class Span:
+    __slots__ = ("kind", "name", "start", "duration", "error")
+
+    def __init__(self, kind: str, name: str, start: float, duration: float, error: Optional[str]):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.error = error
+
+
+class Trace:
+    """Трасса обработки одного обновления одним обработчиком."""
+
+    __slots__ = ("handler", "update_id", "user_id", "chat_id", "started_at", "started", "duration",
+                 "error", "spans", "dropped_spans")
+
+    def __init__(self, handler: str, update):
+        self.handler = handler
+        self.update_id = getattr(update, "update_id", None)
+        user = getattr(update, "effective_user", None)
+        chat = getattr(update, "effective_chat", None)
+        self.user_id = user.id if user else None
+        self.chat_id = chat.id if chat else None
+        self.started_at = datetime.datetime.now()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+
+    def add(self, kind: str, name: str, start: float, duration: float, error: Optional[str] = None) -> None:
+        # list.append атомарен, поэтому отрезки из потоков БД добавляются без блокировки
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped_spans += 1
+            return
+        self.spans.append(Span(kind, name, start - self.started, duration, error))
+
+    def format(self) -> str:
+        """Formats the trace with its span breakdown, one span per line."""
+        lines = [
+            f"{self.started_at:%Y-%m-%d %H:%M:%S} {self.handler} took {self.duration * 1000:.0f}ms "
+            f"(update {self.update_id}, user {self.user_id}, chat {self.chat_id})"
+            + (f" failed: {self.error}" if self.error else "")
+        ]
+        totals = {}
+        # Отрезки добавляются по завершении, выводим их по времени начала
+        for span in sorted(self.spans, key=lambda span: span.start):
+            totals[span.kind] = totals.get(span.kind, 0.0) + span.duration
+            lines.append(
+                f"  +{span.start * 1000:7.1f}ms {span.duration * 1000:7.1f}ms {span.kind:<8} {span.name}"
+                + (f" ERROR {span.error}" if span.error else "")
+            )
+        if self.dropped_spans:
+            lines.append(f"  ... {self.dropped_spans} more spans not recorded")
+        summary = ", ".join(f"{kind}={total * 1000:.0f}ms" for kind, total in sorted(totals.items()))
+        lines.append(f"  total by kind: {summary or 'no spans'}")
+        return "\n".join(lines)
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def record_span(kind: str, name: str, start: float, duration: float, error: Optional[str] = None) -> None:
+    """Adds a span to the trace of the update being handled (no-op outside handlers)."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(kind, name, start, duration, error)
+
+
+def sql_span_name(statement: str) -> str:
+    name = " ".join(statement.split())
+    return name if len(name) <= SQL_NAME_LENGTH else name[:SQL_NAME_LENGTH - 3] + "..."
+
+
+class SlowUpdateLog:
+    """Медленные обновления: ротируемый файл и ограниченный буфер в памяти."""
+
+    def __init__(self, path: str = SLOW_UPDATE_LOG, capacity: int = SLOW_UPDATE_BUFFER):
+        self.path = path
+        self._traces: Deque[Trace] = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._file_logger: Optional[logging.Logger] = None
+
+    def _get_file_logger(self) -> logging.Logger:
+        if self._file_logger is None:
+            file_logger = logging.getLogger("slow_updates")
+            file_logger.propagate = False
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            file_handler = RotatingFileHandler(
+                self.path, maxBytes=SLOW_UPDATE_LOG_MAX_BYTES, backupCount=SLOW_UPDATE_LOG_BACKUPS, encoding="utf-8"
+            )
+            file_handler.setFormatter(logging.Formatter("%(message)s"))
+            file_logger.addHandler(file_handler)
+            file_logger.setLevel(logging.INFO)
+            self._file_logger = file_logger
+        return self._file_logger
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces.append(trace)
+        logger.warning(f"Slow update: {trace.handler} took {trace.duration * 1000:.0f}ms (update {trace.update_id})")
+        try:
+            self._get_file_logger().info(trace.format())
+        except OSError as e:
+            logger.error(f"Failed to write slow update log {self.path}: {e}")
+
+    def worst(self, limit: int) -> List[Trace]:
+        """Returns the slowest of the recently recorded slow updates."""
+        with self._lock:
+            traces = list(self._traces)
+        return sorted(traces, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+
+slow_updates = SlowUpdateLog()
+
+
+def traced(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Оборачивает callback обработчика: трасса обновления и запись медленных обновлений."""
+    handler_name = name or getattr(callback, "__qualname__", None) or getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        trace = Trace(handler_name, update)
+        token = current_trace.set(trace)
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception as e:
+            trace.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            if trace.duration >= SLOW_UPDATE_THRESHOLD:
+                slow_updates.add(trace)
+
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def iter_handlers(application: Application) -> Iterator[BaseHandler]:
+    """Yields every registered handler with a callback, descending into ConversationHandlers."""
+
+    def walk(handler: BaseHandler) -> Iterator[BaseHandler]:
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points:
+                yield from walk(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    yield from walk(nested)
+            for nested in handler.fallbacks:
+                yield from walk(nested)
+        elif getattr(handler, "callback", None) is not None:
+            yield handler
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            yield from walk(handler)
+
+
+def instrument_handlers(application: Application) -> int:
+    """
+    Включает трассировку для всех зарегистрированных обработчиков.
+
+    Returns:
+        int: Количество обернутых обработчиков
+    """
+    wrapped = 0
+    for handler in iter_handlers(application):
+        if not getattr(handler.callback, "__traced__", False):
+            handler.callback = traced(handler.callback)
+            wrapped += 1
+    logger.info(f"Tracing enabled for {wrapped} handlers (slow update threshold {SLOW_UPDATE_THRESHOLD}s)")
+    return wrapped
@@ -0,0 +1,131 @@
+# user_import.py
+"""
+Разбор списков участников для массового импорта (/import_users).
+
+Поддерживаются два формата:
+- текст сообщения, по строке на участника:
+  ID: 123456789, Имя: Имя_участника, Ник: @username, Объем: X.XX л
+- CSV/TSV-файл, отправленный документом, с колонками id, имя, ник, объем
+  (строка заголовка необязательна, разделитель определяется по первой строке).
+
+Сначала разбирается весь список. Если хотя бы одна строка содержит ошибку,
+импорт отменяется целиком; иначе все строки записываются одной транзакцией
+(см. db_utils.bulk_import_users).
+"""
+import codecs
+import csv
+import re
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+# Строка импорта: (user_id, first_name, username, volume)
+ImportRow = Tuple[int, str, Optional[str], float]
+
+# Регулярное выражение для извлечения данных из строки сообщения
+TEXT_LINE_PATTERN = re.compile(r'ID:\s*(\d+),\s*Имя:\s*([^,]+),\s*Ник:\s*([^,]+),\s*Объем:\s*(\d+\.?\d*)\s*л')
+
+# Значения поля «Ник», означающие отсутствие ника
+EMPTY_USERNAMES = {'нет', 'no', '-', ''}
+
+CSV_DELIMITERS = "\t;,"
+
+
+def normalize_username(raw: Optional[str]) -> Optional[str]:
+    """Strips '@' and whitespace; returns None for empty placeholders."""
+    if raw is None or raw.strip().lower() in EMPTY_USERNAMES:
+        return None
+    return raw.strip().lstrip('@') or None
+
+
+def _make_row(user_id: str, name: str, username: Optional[str], volume: str) -> ImportRow:
+    volume_value = float(volume.strip().replace(',', '.'))
+    if volume_value < 0:
+        raise ValueError("объем не может быть отрицательным")
+    name = name.strip()
+    if not name:
+        raise ValueError("пустое имя")
+    return int(user_id.strip()), name, normalize_username(username), volume_value
+
+
+class ImportParseResult:
+    """Результат разбора: корректные строки (последняя строка для ID побеждает) и ошибки."""
+
+    __slots__ = ("rows", "errors")
+
+    def __init__(self):
+        self.rows: Dict[int, ImportRow] = {}
+        self.errors: List[str] = []
+
+    def add(self, row: ImportRow) -> None:
+        self.rows[row[0]] = row
+
+
+def parse_text_payload(text: str) -> ImportParseResult:
+    """Разбирает список участников из текста сообщения."""
+    result = ImportParseResult()
+    for line in text.strip().split('\n'):
+        if not line.strip():
+            continue
+        match = TEXT_LINE_PATTERN.search(line)
+        if not match:
+            result.errors.append(f"❌ Неверный формат строки: '{line}'")
+            continue
+        try:
+            result.add(_make_row(*match.groups()))
+        except ValueError as e:
+            result.errors.append(f"❌ Ошибка в строке '{line}': {e}")
+    return result
+
+
+def _iter_text_lines(stream: BinaryIO, encoding: str = 'utf-8-sig') -> Iterable[str]:
+    """Decodes a binary stream line by line without reading it into memory at once."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for block in iter(lambda: stream.read(64 * 1024), b''):
+        pending += decoder.decode(block)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def parse_csv_stream(stream: BinaryIO) -> ImportParseResult:
+    """
+    Разбирает CSV/TSV-документ потоково.
+
+    Args:
+        stream (BinaryIO): Содержимое файла (UTF-8, допускается BOM)
+
+    Returns:
+        ImportParseResult: Корректные строки и описания ошибок с номерами строк
+    """
+    result = ImportParseResult()
+    lines = iter(_iter_text_lines(stream))
+    first_line = next(lines, None)
+    if first_line is None:
+        return result
+
+    # Табуляция и точка с запятой проверяются первыми: в объеме может встретиться десятичная запятая
+    delimiter = next((candidate for candidate in CSV_DELIMITERS if candidate in first_line), ',')
+
+    def all_lines():
+        yield first_line
+        yield from lines
+
+    reader = csv.reader(all_lines(), delimiter=delimiter)
+    for record in reader:
+        line_number = reader.line_num
+        if not record or not any(cell.strip() for cell in record):
+            continue
+        # Первая строка может быть заголовком
+        if line_number == 1 and not record[0].strip().isdigit():
+            continue
+        if len(record) < 4:
+            result.errors.append(f"❌ Строка {line_number}: ожидается 4 колонки (id, имя, ник, объем)")
+            continue
+        try:
+            result.add(_make_row(record[0], record[1], record[2], record[3]))
+        except ValueError as e:
+            result.errors.append(f"❌ Строка {line_number}: {e}")
+    return result
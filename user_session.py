@@ -0,0 +1,133 @@
+# user_session.py
+"""
+Состояние пользователя между обновлениями (context.user_data).
+
+Вместо словаря с произвольными ключами Application создает для каждого
+пользователя UserSession (ContextTypes(user_data=UserSession) в main.py):
+фиксированный набор полей в __slots__, без словаря атрибутов. Поля группами
+очищаются по завершении диалога (clear_submission, clear_delete_user).
+
+last_seen обновляется при каждом обновлении от пользователя (см.
+SQLitePersistence.refresh_user_data). Задача evict_idle_sessions_job удаляет
+сессии, к которым не обращались дольше SESSION_TTL секунд, вместе с их записью
+в bot_persistence, поэтому память и таблица растут только с числом недавно
+активных пользователей. Брошенные диалоги завершает сам ConversationHandler:
+у всех диалогов бота conversation_timeout=CONVERSATION_TIMEOUT, а состояния,
+сохраненные до перезапуска и брошенные дольше SESSION_TTL, удаляются при
+запуске (SQLitePersistence.get_conversations).
+"""
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+from telegram.ext import Application, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд без обновлений сессия пользователя удаляется
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 24 * 60 * 60))
+# Как часто искать устаревшие сессии
+SESSION_EVICT_INTERVAL = 10 * 60
+# Диалог без обновлений дольше этого времени завершается (ConversationHandler.conversation_timeout)
+CONVERSATION_TIMEOUT = SESSION_TTL
+
+
+class UserSession:
+    """Данные пользователя между обновлениями: заявка, таблица лидеров и диалоги администратора."""
+
+    # Сохраняемые поля (имена совпадают с прежними ключами user_data); last_seen живет только в памяти
+    FIELDS: Tuple[str, ...] = (
+        # Отправка заявки (handlers/beer_tracking.py, main.prompt_for_photo)
+        "photo_file_id", "original_message_id", "original_chat_id", "prompt_message_id", "prompt_chat_id",
+        # Таблица лидеров (handlers/leaderboard.py)
+        "leaderboard_message_id",
+        # Диалоги администратора (handlers/admin.py)
+        "target_user_id", "entries", "selected_entry", "delete_user_id", "delete_user_name", "delete_user_volume",
+    )
+    __slots__ = FIELDS + ("last_seen",)
+
+    def __init__(self):
+        self.photo_file_id: Optional[str] = None
+        self.original_message_id: Optional[int] = None
+        self.original_chat_id: Optional[int] = None
+        self.prompt_message_id: Optional[int] = None
+        self.prompt_chat_id: Optional[int] = None
+        self.leaderboard_message_id: Optional[int] = None
+        self.target_user_id: Optional[str] = None
+        self.entries: Optional[Tuple[int, ...]] = None
+        self.selected_entry: Optional[int] = None
+        self.delete_user_id: Optional[int] = None
+        self.delete_user_name: Optional[str] = None
+        self.delete_user_volume: Optional[float] = None
+        self.last_seen = time.monotonic()
+
+    def touch(self) -> None:
+        self.last_seen = time.monotonic()
+
+    def clear_submission(self) -> None:
+        """Забывает фото заявки и сообщения, которые нужно было удалить."""
+        self.photo_file_id = None
+        self.original_message_id = None
+        self.original_chat_id = None
+        self.prompt_message_id = None
+        self.prompt_chat_id = None
+
+    def clear_delete_user(self) -> None:
+        self.delete_user_id = None
+        self.delete_user_name = None
+        self.delete_user_volume = None
+
+    def clear(self) -> None:
+        """Сбрасывает все поля (отмена диалога администратора)."""
+        last_seen = self.last_seen
+        self.__init__()
+        self.last_seen = last_seen
+
+    def to_dict(self) -> dict:
+        """Returns the fields that are set, for persistence; an empty dict means nothing to store."""
+        data = {}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        return data
+
+    def restore(self, data: dict) -> None:
+        """Заполняет поля из сохраненных данных, не затирая уже установленные в этом процессе."""
+        for name in self.FIELDS:
+            if name in data and getattr(self, name) is None:
+                value = data[name]
+                setattr(self, name, tuple(value) if isinstance(value, list) else value)
+
+    def __deepcopy__(self, memo) -> "UserSession":
+        # Все поля неизменяемые (числа, строки, кортежи), поэтому копии полей достаточно.
+        # Application копирует user_data всех активных пользователей при каждой записи persistence
+        copy = UserSession.__new__(UserSession)
+        for name in self.__slots__:
+            setattr(copy, name, getattr(self, name))
+        return copy
+
+    def __repr__(self) -> str:
+        return f"<UserSession({self.to_dict()})>"
+
+
+def evict_idle_sessions(application: Application, ttl: float = SESSION_TTL) -> int:
+    """
+    Удаляет сессии пользователей, не присылавших обновлений дольше ttl секунд.
+
+    Returns:
+        int: Количество удаленных сессий
+    """
+    cutoff = time.monotonic() - ttl
+    idle = [user_id for user_id, session in application.user_data.items() if session.last_seen < cutoff]
+    for user_id in idle:
+        # Вместе с сессией в памяти удаляется и ее запись в bot_persistence
+        application.drop_user_data(user_id)
+    return len(idle)
+
+
+async def evict_idle_sessions_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    evicted = evict_idle_sessions(context.application)
+    if evicted:
+        logger.info(f"Evicted {evicted} idle user sessions, {len(context.application.user_data)} remain")
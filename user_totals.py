@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Проверка и пересборка агрегированной таблицы user_totals.
+
+Таблица обновляется в тех же транзакциях, что и beer_entries, но после ручных
+правок базы или восстановления старой копии суммы могут разойтись с записями.
+"""
+import sys
+import argparse
+import logging
+
+from database.database import SessionLocal, init_db
+from db_utils import rebuild_user_totals, verify_user_totals
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка и пересборка таблицы user_totals.")
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--verify', action='store_true', help='Сравнить user_totals с записями о пиве')
+    group.add_argument('--rebuild', action='store_true', help='Пересчитать user_totals по записям о пиве')
+
+    args = parser.parse_args()
+
+    init_db()
+
+    with SessionLocal() as db:
+        if args.verify:
+            drift = verify_user_totals(db)
+            if not drift:
+                print("Расхождений не найдено.")
+                return
+            print(f"Найдено расхождений: {len(drift)}")
+            for user_id, stored_total, actual_total, stored_count, actual_count in drift:
+                print(
+                    f"ID: {user_id}, сохранено: {stored_total:.2f} л / {stored_count} зап., "
+                    f"по записям: {actual_total:.2f} л / {actual_count} зап."
+                )
+            sys.exit(1)
+
+        elif args.rebuild:
+            users = rebuild_user_totals(db)
+            print(f"Таблица user_totals пересобрана для {users} участников.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# web_server.py
+"""
+HTTP-сервер бота на aiohttp в том же event loop, что и бот.
+
+Маршруты:
+    GET  /          — проверка работоспособности (healthCheckPath на Render.com)
+    GET  /metrics   — метрики в формате Prometheus (см. metrics.py)
+    POST /telegram  — вебхук Telegram (только в режиме BOT_MODE=webhook)
+
+В режиме вебхука Telegram сам присылает обновления на WEBHOOK_URL + WEBHOOK_PATH,
+каждый запрос проверяется по заголовку X-Telegram-Bot-Api-Secret-Token.
+В режиме опроса (по умолчанию) сервер отвечает только на проверку работоспособности.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import signal
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+import metrics
+from config import BOT_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# polling — long polling (запасной вариант), webhook — обновления через HTTP-сервер
+BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"BOT_MODE must be polling or webhook, got {BOT_MODE!r}")
+WEBHOOK_MODE = BOT_MODE == "webhook"
+
+PORT = int(os.environ.get("PORT", 8080))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# Публичный адрес сервиса; на Render.com он доступен в RENDER_EXTERNAL_URL
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or os.environ.get("RENDER_EXTERNAL_URL")
+# Если секрет не задан, он выводится из токена: одинаковый между перезапусками и неизвестный посторонним
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode("utf-8")).hexdigest()
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+HEALTH_MESSAGE = "Beer Challenge Bot is running! 🍺"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def _health(request: web.Request) -> web.Response:
+    return web.Response(text=HEALTH_MESSAGE, content_type="text/html")
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+async def _telegram_webhook(request: web.Request) -> web.Response:
+    """Принимает обновление от Telegram и ставит его в очередь приложения."""
+    secret = request.headers.get(SECRET_HEADER, "")
+    if not hmac.compare_digest(secret.encode("utf-8"), WEBHOOK_SECRET.encode("utf-8")):
+        logger.warning(f"Rejected webhook request with invalid secret token from {request.remote}")
+        return web.Response(status=403)
+
+    application: Application = request.app["application"]
+    try:
+        data = await request.json()
+        update = Update.de_json(data, application.bot)
+    except Exception as e:
+        logger.warning(f"Rejected malformed webhook update: {e}")
+        return web.Response(status=400)
+
+    # Обработка идет в приложении: Telegram получает ответ сразу и не повторяет запрос
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+async def start(application: Application, webhook: bool) -> None:
+    """
+    Запускает HTTP-сервер на порту PORT.
+
+    Args:
+        application (Application): Приложение бота (нужно для вебхука)
+        webhook (bool): Добавить маршрут вебхука WEBHOOK_PATH
+    """
+    global _runner
+    app = web.Application()
+    app["application"] = application
+    app.router.add_get("/", _health)
+    app.router.add_get("/metrics", _metrics)
+    if webhook:
+        app.router.add_post(WEBHOOK_PATH, _telegram_webhook)
+
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, port=PORT).start()
+    logger.info(f"Started HTTP server on port {PORT}" + (f" with webhook at {WEBHOOK_PATH}" if webhook else ""))
+
+
+async def stop() -> None:
+    """Останавливает HTTP-сервер, если он запущен."""
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
+        logger.info("HTTP server stopped")
+
+
+def _wait_for_stop_signal() -> asyncio.Event:
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl-C через KeyboardInterrupt
+            pass
+    return stop_event
+
+
+async def run_webhook(application: Application) -> None:
+    """
+    Запускает бота в режиме вебхука до SIGINT/SIGTERM.
+
+    Повторяет жизненный цикл Application.run_polling (post_init, post_stop,
+    post_shutdown), но вместо опроса Telegram регистрирует вебхук и принимает
+    обновления HTTP-сервером в этом же event loop.
+    """
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL (or RENDER_EXTERNAL_URL) must be set in webhook mode")
+    webhook_url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+    stop_event = _wait_for_stop_signal()
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await start(application, webhook=True)
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Webhook set to {webhook_url}")
+        await application.start()
+        try:
+            await stop_event.wait()
+        finally:
+            # Сначала перестаем принимать обновления, затем дорабатываем уже полученные
+            await stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)